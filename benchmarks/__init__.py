@@ -0,0 +1,9 @@
+"""Benchmarks for lutronbond. See the README for how to run them."""
+import os
+
+
+# lutronbond.config requires these at import. Benchmarks don't talk to real
+# devices, so they are placeholders, replaced where a benchmark needs to.
+os.environ.setdefault('LB_LUTRON_BRIDGE_ADDR', '127.0.0.1')
+os.environ.setdefault('LB_BOND_BRIDGE_ADDR', '127.0.0.1')
+os.environ.setdefault('LB_BOND_BRIDGE_API_TOKEN', 'simtoken')
@@ -0,0 +1,8 @@
+import sys
+
+from lutronbond import eventloop
+
+from .e2e import main, parse_args
+
+
+sys.exit(eventloop.run(main, parse_args().loop))
@@ -0,0 +1,330 @@
+"""End-to-end latency and throughput of the controller against stand-ins.
+
+Starts the real controller against a simulated Lutron bridge, Bond Bridge and
+Tuya plugs (see lutronbond.sim), with a generated config of N Lutron devices
+each controlling one Bond, Tuya or Lutron target. Events are played at
+increasing rates, and the time from each event leaving the Lutron stand-in to
+its command reaching the target's stand-in is measured.
+
+The stand-ins run in the same process as the controller, so CPU and memory
+figures include theirs. Compare runs on the same machine only.
+"""
+import argparse
+import asyncio
+import collections
+import logging
+import sys
+import time
+import typing
+
+import tinytuya  # type: ignore
+
+from lutronbond import bond, config, controller, eventbus, eventloop, startup, tuya
+from lutronbond.sim import bond as bond_sim
+from lutronbond.sim import lutron as lutron_sim
+from lutronbond.sim import tuya as tuya_sim
+
+from . import results
+
+
+WORKLOADS = ('press', 'fade')
+TARGET_KINDS = ('bond', 'tuya', 'lutron')
+# Integration IDs of Lutron targets, kept clear of the triggering devices
+LUTRON_TARGET_BASE = 1000
+FADE_LEVELS = ['{:.2f}'.format(level) for level in range(0, 101, 10)]
+
+Target = typing.Tuple[str, str]
+
+logger = logging.getLogger(__name__)
+
+
+def target_of(device: int) -> Target:
+    """The kind and ID of the target controlled by Lutron device `device`."""
+
+    kind = TARGET_KINDS[(device - 1) % len(TARGET_KINDS)]
+
+    if kind == 'bond':
+        return kind, 'sim{:04d}'.format(device)
+    if kind == 'tuya':
+        return kind, 'simtuya{:04d}'.format(device)
+    return kind, str(LUTRON_TARGET_BASE + device)
+
+
+def make_mapping(
+        devices: int,
+        tuya_devices: typing.Dict[str, tuya_sim.VirtualDevice]
+) -> typing.Dict[int, typing.Dict]:
+    """Every event for a device in the mapping produces exactly one command."""
+
+    mapping: typing.Dict[int, typing.Dict] = {}
+
+    for device in range(1, devices + 1):
+        kind, target_id = target_of(device)
+
+        if kind == 'bond':
+            entry: typing.Dict[str, typing.Any] = {'id': target_id, 'actions': {
+                'BTN_1': {'PRESS': 'TurnLightOn', 'RELEASE': 'TurnLightOff'},
+                'ANY': {'SET_LEVEL': {
+                    level: {'SetBrightness': int(float(level))} for level in FADE_LEVELS
+                }},
+            }}
+        elif kind == 'tuya':
+            entry = dict(tuya_devices[target_id].config, actions={
+                'BTN_1': {'PRESS': 'TurnOn', 'RELEASE': 'TurnOff'},
+                'ANY': {'SET_LEVEL': {
+                    level: 'TurnOn' if float(level) >= 50 else 'TurnOff'
+                    for level in FADE_LEVELS
+                }},
+            })
+        else:
+            entry = {'id': int(target_id), 'actions': {
+                'BTN_1': {'PRESS': {'SET_LEVEL': '100'}, 'RELEASE': {'SET_LEVEL': '0'}},
+                'ANY': {'SET_LEVEL': {
+                    level: {'SET_LEVEL': level} for level in FADE_LEVELS
+                }},
+            }}
+
+        mapping[device] = {'name': 'Benchmark {}'.format(device), kind: entry}
+
+    return mapping
+
+
+def make_events(workload: str, devices: int, count: int) -> typing.List[typing.Tuple[int, str]]:
+    """`count` (device, event line) pairs, spread round-robin over devices."""
+
+    events = []
+
+    for i in range(count):
+        if workload == 'press':
+            # Press then release on each device in turn
+            device = (i // 2) % devices + 1
+            events.append((device, '~DEVICE,{},2,{}'.format(device, 3 + i % 2)))
+        else:
+            # Each device steps through the fade levels
+            device = i % devices + 1
+            level = FADE_LEVELS[(i // devices) % len(FADE_LEVELS)]
+            events.append((device, '~OUTPUT,{},1,{}'.format(device, level)))
+
+    return events
+
+
+class StandIns:
+    """The three simulated systems, and where the controller finds them."""
+
+    def __init__(self, devices: int) -> None:
+        self.lutron = lutron_sim.LutronSimulator()
+        self.bond = bond_sim.BondSimulator(devices=bond_sim.make_devices(devices))
+        self.tuya = tuya_sim.TuyaEmulator([
+            tuya_sim.VirtualDevice(target_id, '{:016d}'.format(device), port=0)
+            for device in range(1, devices + 1)
+            for kind, target_id in [target_of(device)] if kind == 'tuya'
+        ])
+
+    async def start(self) -> None:
+        await asyncio.gather(self.lutron.start(), self.bond.start(), self.tuya.start())
+
+    async def close(self) -> None:
+        await asyncio.gather(self.lutron.close(), self.bond.close(), self.tuya.close())
+
+    def arrivals(self, target: Target) -> typing.List[float]:
+        """Monotonic times at which commands reached a target, in order."""
+
+        kind, target_id = target
+
+        if kind == 'bond':
+            return [r.arrived for r in self.bond.actions(target_id)]
+
+        if kind == 'tuya':
+            return sorted(
+                t for t, cmd, _ in self.tuya.devices[target_id].requests
+                if cmd == tinytuya.CONTROL
+            )
+
+        prefix = '#OUTPUT,{},'.format(target_id).encode('ascii')
+        return [t for t, line in self.lutron.commands if line.startswith(prefix)]
+
+
+def configure(stand_ins: StandIns, devices: int) -> None:
+    config.LUTRON_BRIDGE_ADDR = stand_ins.lutron.host
+    config.LUTRON_BRIDGE_PORT = stand_ins.lutron.port
+    config.BOND_BRIDGE_ADDR = stand_ins.bond.address
+    config.BOND_BRIDGE_API_TOKEN = stand_ins.bond.token
+    config.LUTRON_MAPPING = make_mapping(devices, stand_ins.tuya.devices)
+    config.BOND_BPUP = False
+    config.BOND_KEEPALIVE_INTERVAL = 0
+    config.TUYA_DISCOVERY = False
+    config.METRICS_PORT = 0
+    config.LOOP_MONITOR = 0
+    # Events repeat far faster than anyone could press buttons
+    config.STORM_LIMIT = 0
+
+    for name in ('LUTRON_BRIDGE2_ADDR', 'LUTRON2_MAPPING', 'BOND_BRIDGE2_ADDR'):
+        if hasattr(config, name):
+            delattr(config, name)
+
+    # Fresh state for every run
+    controller.shutting_down = False
+    eventbus.get_bus.cache_clear()
+    tuya.reset_device_cache()
+    bond.get_bond_connection.cache_clear()
+
+
+async def wait_for(predicate: typing.Callable[[], bool], timeout: float) -> bool:
+    deadline = time.monotonic() + timeout
+
+    while not predicate():
+        if time.monotonic() > deadline:
+            return False
+        await asyncio.sleep(0.01)
+
+    return True
+
+
+async def run(
+        workload: str,
+        rate: float,
+        duration: float,
+        devices: int,
+        timeout: float
+) -> typing.Dict[str, typing.Any]:
+    stand_ins = StandIns(devices)
+    await stand_ins.start()
+    configure(stand_ins, devices)
+
+    task = asyncio.create_task(controller.start())
+
+    try:
+        if not await wait_for(lambda: bool(stand_ins.lutron.clients), timeout):
+            raise RuntimeError('Controller did not connect to the Lutron stand-in')
+
+        events = make_events(workload, devices, max(1, int(rate * duration)))
+        loop = asyncio.get_running_loop()
+        emitted: typing.Dict[Target, typing.List[float]] = collections.defaultdict(list)
+
+        cpu_start = time.process_time()
+        start = loop.time()
+
+        for i, (device, line) in enumerate(events):
+            await asyncio.sleep(max(0.0, start + i / rate - loop.time()))
+            await stand_ins.lutron.emit(line)
+            emitted[target_of(device)].append(stand_ins.lutron.sent[-1][0])
+
+        def received() -> int:
+            return sum(
+                min(len(stand_ins.arrivals(target)), len(times))
+                for target, times in emitted.items()
+            )
+
+        await wait_for(lambda: received() >= len(events), timeout)
+        wall = loop.time() - start
+        cpu = time.process_time() - cpu_start
+    finally:
+        await controller.shutdown()
+        await asyncio.wait_for(task, timeout)
+        await stand_ins.close()
+
+    latencies = []
+    last_arrival = 0.0
+    for target, times in emitted.items():
+        arrivals = stand_ins.arrivals(target)
+        for sent, arrived in zip(times, arrivals):
+            latencies.append((arrived - sent) * 1000)
+        if arrivals:
+            last_arrival = max(last_arrival, arrivals[-1])
+
+    elapsed = max(last_arrival - stand_ins.lutron.sent[0][0], 1e-9) if latencies else wall
+
+    return {
+        'workload': workload,
+        'rate': rate,
+        'devices': devices,
+        'events': len(events),
+        'completed': len(latencies),
+        'missing': len(events) - len(latencies),
+        'throughput': len(latencies) / elapsed,
+        'p50_ms': results.percentile(latencies, 50),
+        'p99_ms': results.percentile(latencies, 99),
+        'max_ms': max(latencies, default=0.0),
+        'cpu_percent': cpu / wall * 100,
+        'rss_mb': startup.peak_rss_mb(),
+    }
+
+
+def parse_args(argv: typing.Optional[typing.Sequence[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workload', choices=WORKLOADS, action='append', dest='workloads')
+    parser.add_argument(
+        '--rates', default='5,10,20,50',
+        type=lambda value: [float(r) for r in value.split(',')],
+        help='Comma separated events per second, run in turn (default: 5,10,20,50)'
+    )
+    parser.add_argument('--duration', type=float, default=5.0, help='Seconds per rate')
+    parser.add_argument('--devices', type=int, default=9, help='Lutron devices')
+    parser.add_argument('--timeout', type=float, default=15.0, help='Seconds to wait')
+    parser.add_argument('--output', help='Where to save JSON results')
+    parser.add_argument('--baseline', help='JSON results to compare against')
+    parser.add_argument(
+        '--threshold', type=float, default=0.2,
+        help='Fraction worse than the baseline that is a regression (default: 0.2)'
+    )
+    parser.add_argument(
+        '--loop', choices=eventloop.LOOPS, default='auto',
+        help='Event loop implementation (default: uvloop if installed)'
+    )
+    parser.add_argument('--log-level', default='WARNING')
+    return parser.parse_args(argv)
+
+
+def print_result(result: typing.Dict[str, typing.Any]) -> None:
+    print(
+        '{workload:>6} {rate:>7.1f}/s  {completed:>5}/{events:<5} '
+        '{throughput:>7.1f}/s  p50 {p50_ms:>7.2f}ms  p99 {p99_ms:>7.2f}ms  '
+        'max {max_ms:>7.2f}ms  cpu {cpu_percent:>5.1f}%  rss {rss_mb:>6.1f}MB'.format(**result)
+    )
+
+
+async def main(argv: typing.Optional[typing.Sequence[str]] = None) -> int:
+    args = parse_args(argv)
+    logging.basicConfig(level=args.log_level)
+
+    report: typing.Dict[str, typing.Any] = {
+        'benchmark': 'e2e',
+        'environment': results.environment(),
+        'settings': {'duration': args.duration, 'devices': args.devices},
+        'results': [],
+    }
+
+    for workload in args.workloads or WORKLOADS:
+        for rate in args.rates:
+            result = await run(workload, rate, args.duration, args.devices, args.timeout)
+            report['results'].append(result)
+            print_result(result)
+
+    output = args.output or results.default_output('e2e')
+    results.save(report, output)
+    print('Results saved to {}'.format(output))
+
+    if args.baseline:
+        baseline = results.load(args.baseline)
+        print('Compared with {} ({} event loop):'.format(
+            args.baseline, baseline['environment'].get('event_loop', 'asyncio')
+        ))
+        for change in results.changes(report['results'], baseline['results'], ('workload', 'rate')):
+            print('  {}'.format(change))
+
+        regressions = results.compare(
+            report['results'],
+            baseline['results'],
+            ('workload', 'rate'),
+            args.threshold
+        )
+        for regression in regressions:
+            print('REGRESSION {}'.format(regression))
+        if regressions:
+            return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(eventloop.run(main, parse_args().loop))
@@ -0,0 +1,361 @@
+"""Microbenchmarks of the per-event hot paths.
+
+Times parsing Lutron events, formatting Lutron commands, publishing on the
+event bus and running the Bond, Tuya and Lutron handlers with the action
+tables from lutronbond.config. Handlers run for real, up to the point where
+they would talk to a device, which is stubbed out.
+
+Each benchmark is calibrated to a number of loops that takes at least
+MIN_SAMPLE_TIME, warmed up, then sampled repeatedly with the garbage collector
+off. The median time per loop is the figure to compare.
+"""
+import argparse
+import fnmatch
+import functools
+import gc
+import logging
+import statistics
+import sys
+import time
+import typing
+
+from lutronbond import bond, breaker, config, eventbus, eventloop, lutron, tuya
+
+from . import results
+
+
+MIN_SAMPLE_TIME = 0.05
+MAX_LOOPS = 2 ** 24
+WARMUPS = 2
+BRIDGE = '127.0.0.1'
+TUYA_DEVICE: typing.Dict[str, typing.Any] = dict(
+    config.HAYES_CLOUD_LIGHT, actions=config.SMART_SWITCH_OUTPUT_ACTIONS
+)
+# Shaped like the Lutron entries in LUTRON_MAPPING
+LUTRON_ACTIONS = {
+    'BTN_RAISE': {'PRESS': None, 'RELEASE': {'SET_LEVEL': '100,00.50'}},
+    'BTN_LOWER': {'PRESS': None, 'RELEASE': {'SET_LEVEL': '0,01'}},
+    'BTN_2': {'PRESS': None, 'RELEASE': {'SET_LEVEL': '38,01'}},
+}
+
+# Settings changed while benchmarking. Sending the same command over and over
+# is the point here, so the storm guard would only get in the way.
+STUBBED_CONFIG = {'STORM_LIMIT': 0}
+
+# Runs the benchmarked code `loops` times, returning the seconds it took
+Timer = typing.Callable[[int], typing.Awaitable[float]]
+
+logger = logging.getLogger(__name__)
+
+# The settings STUBBED_CONFIG replaced, to put back afterwards
+saved_config: typing.Dict[str, typing.Any] = {}
+
+
+def device_event(component: lutron.Component, action: lutron.DeviceAction) -> lutron.LutronEvent:
+    return lutron.LutronEvent(lutron.Operation.DEVICE, 5, component, action, '', BRIDGE)
+
+
+def output_event(level: str) -> lutron.LutronEvent:
+    return lutron.LutronEvent(
+        lutron.Operation.OUTPUT,
+        5,
+        lutron.Component.ANY,
+        lutron.OutputAction.SET_LEVEL,
+        level,
+        BRIDGE
+    )
+
+
+async def time_parse(raw: bytes, loops: int) -> float:
+    parse = lutron.LutronEvent.parse
+    start = time.perf_counter()
+    for _ in range(loops):
+        parse(raw, BRIDGE)
+    return time.perf_counter() - start
+
+
+async def time_command(command: lutron.LutronCommand, loops: int) -> float:
+    start = time.perf_counter()
+    for _ in range(loops):
+        str(command)
+    return time.perf_counter() - start
+
+
+async def time_sub(loops: int) -> float:
+    bus = eventbus.EventBus()
+    start = time.perf_counter()
+    for i in range(loops):
+        bus.sub(i % 100, noop)
+    return time.perf_counter() - start
+
+
+async def time_pub(subscribers: int, loops: int) -> float:
+    bus = eventbus.EventBus()
+    event = device_event(lutron.Component.BTN_1, lutron.DeviceAction.PRESS)
+    for _ in range(subscribers):
+        bus.sub(event.device, noop)
+
+    start = time.perf_counter()
+    for _ in range(loops):
+        bus.pub(event.device, event)
+    # Publishing only schedules the handlers, so include running them
+    await bus.await_running_handlers()
+    return time.perf_counter() - start
+
+
+async def time_get_handler(
+        get_handler: typing.Callable[[dict], typing.Any],
+        configmap: dict,
+        loops: int
+) -> float:
+    start = time.perf_counter()
+    for _ in range(loops):
+        get_handler(configmap)
+    return time.perf_counter() - start
+
+
+async def time_handler(
+        handler: typing.Callable[[lutron.LutronEvent], typing.Awaitable[bool]],
+        event: lutron.LutronEvent,
+        loops: int
+) -> float:
+    start = time.perf_counter()
+    for _ in range(loops):
+        # A fresh event, or the Bond handler abandons it as stale
+        event.timestamp = time.monotonic()
+        await handler(event)
+    return time.perf_counter() - start
+
+
+async def noop(*args: typing.Any) -> None:
+    pass
+
+
+class StubOutlet:
+    """Stands in for a tinytuya.OutletDevice without touching the network."""
+
+    address = BRIDGE
+    port = 6668
+
+    def turn_on(self) -> typing.Dict:
+        return {}
+
+    def turn_off(self) -> typing.Dict:
+        return {}
+
+
+def stub_devices() -> None:
+    """Replace every device connection the handlers use with a no-op."""
+
+    bond.get_default_bond_connection().action = noop
+    tuya.devices[TUYA_DEVICE['id']] = StubOutlet()
+    lutron.get_default_lutron_connection().send = noop  # type: ignore
+
+    for name, value in STUBBED_CONFIG.items():
+        saved_config[name] = getattr(config, name)
+        setattr(config, name, value)
+
+
+async def reset() -> None:
+    for name, value in saved_config.items():
+        setattr(config, name, value)
+    saved_config.clear()
+
+    await bond.close()
+    bond.get_bond_connection.cache_clear()
+    tuya.reset_device_cache()
+    lutron.reset_connection_cache()
+    breaker.reset()
+
+
+def bond_handler(actions: dict) -> typing.Callable:
+    return bond.get_handler({'id': 'benchmark', 'actions': actions})
+
+
+def tuya_handler() -> typing.Callable:
+    return tuya.get_handler(TUYA_DEVICE)
+
+
+def lutron_handler() -> typing.Callable:
+    return lutron.get_handler({'id': 50, 'actions': LUTRON_ACTIONS})
+
+
+def benchmarks() -> typing.List[typing.Tuple[str, Timer]]:
+    """(name, timer) of every benchmark. Devices must be stubbed first."""
+
+    release = functools.partial(device_event, lutron.Component.BTN_1, lutron.DeviceAction.RELEASE)
+    press = functools.partial(device_event, lutron.Component.BTN_1, lutron.DeviceAction.PRESS)
+    raise_release = device_event(lutron.Component.BTN_RAISE, lutron.DeviceAction.RELEASE)
+
+    return [
+        ('parse/device', functools.partial(time_parse, b'~DEVICE,60,2,4\r\n')),
+        ('parse/output', functools.partial(time_parse, b'~OUTPUT,12,1,100.00\r\n')),
+        ('parse/after_prompt', functools.partial(time_parse, b'GNET> ~DEVICE,60,2,4\r\n')),
+        ('command/output', functools.partial(time_command, lutron.LutronCommand(
+            lutron.Operation.OUTPUT, 50, lutron.Component.ANY, lutron.OutputAction.SET_LEVEL,
+            '100,00.50', BRIDGE
+        ))),
+        ('command/device', functools.partial(time_command, lutron.LutronCommand(
+            lutron.Operation.DEVICE, 50, lutron.Component.BTN_1, lutron.DeviceAction.PRESS,
+            '', BRIDGE
+        ))),
+        ('eventbus/sub', time_sub),
+        ('eventbus/pub_unsubscribed', functools.partial(time_pub, 0)),
+        ('eventbus/pub', functools.partial(time_pub, 1)),
+        ('eventbus/pub_3_subscribers', functools.partial(time_pub, 3)),
+        ('get_handler/bond', functools.partial(
+            time_get_handler, bond.get_handler, {'id': 'benchmark', 'actions': config.FAN_CONFIG}
+        )),
+        ('get_handler/tuya', functools.partial(time_get_handler, tuya.get_handler, TUYA_DEVICE)),
+        ('get_handler/lutron', functools.partial(
+            time_get_handler, lutron.get_handler, {'id': 50, 'actions': LUTRON_ACTIONS}
+        )),
+        ('handler/bond_ignored', functools.partial(
+            time_handler, bond_handler(config.FAN_LIGHT_CONFIG), press()
+        )),
+        ('handler/bond_light', functools.partial(
+            time_handler, bond_handler(config.FAN_LIGHT_CONFIG), release()
+        )),
+        ('handler/bond_fan_speed', functools.partial(
+            time_handler, bond_handler(config.FAN_CONFIG), release()
+        )),
+        ('handler/tuya_output', functools.partial(
+            time_handler, tuya_handler(), output_event('100.00')
+        )),
+        ('handler/lutron_output', functools.partial(
+            time_handler, lutron_handler(), raise_release
+        )),
+    ]
+
+
+async def calibrate(timer: Timer, min_time: float = MIN_SAMPLE_TIME) -> int:
+    """The smallest power of 2 loops that take at least `min_time`."""
+
+    loops = 1
+    while loops < MAX_LOOPS and await timer(loops) < min_time:
+        loops *= 2
+    return loops
+
+
+async def measure(
+        timer: Timer,
+        samples: int,
+        min_time: float = MIN_SAMPLE_TIME,
+        warmups: int = WARMUPS
+) -> typing.Dict[str, typing.Any]:
+    loops = await calibrate(timer, min_time)
+
+    for _ in range(warmups):
+        await timer(loops)
+
+    times = []
+    gc.collect()
+    gc.disable()
+    try:
+        for _ in range(samples):
+            times.append(await timer(loops) / loops * 1e6)
+    finally:
+        gc.enable()
+
+    return {
+        'loops': loops,
+        'samples': samples,
+        'median_us': statistics.median(times),
+        'mean_us': statistics.mean(times),
+        'stdev_us': statistics.stdev(times) if samples > 1 else 0.0,
+        'min_us': min(times),
+    }
+
+
+async def run(
+        patterns: typing.Sequence[str],
+        samples: int,
+        min_time: float = MIN_SAMPLE_TIME
+) -> typing.List[typing.Dict[str, typing.Any]]:
+    report = []
+
+    stub_devices()
+    try:
+        for name, timer in benchmarks():
+            if patterns and not any(fnmatch.fnmatch(name, p) for p in patterns):
+                continue
+
+            result = dict(name=name, **await measure(timer, samples, min_time))
+            report.append(result)
+            print_result(result)
+    finally:
+        await reset()
+
+    return report
+
+
+def parse_args(argv: typing.Optional[typing.Sequence[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        '--filter', action='append', dest='patterns', default=[],
+        help='Only run benchmarks whose name matches this glob, like "parse/*"'
+    )
+    parser.add_argument('--samples', type=int, default=20, help='Samples per benchmark')
+    parser.add_argument(
+        '--min-time', type=float, default=MIN_SAMPLE_TIME, help='Minimum seconds per sample'
+    )
+    parser.add_argument('--output', help='Where to save JSON results')
+    parser.add_argument('--baseline', help='JSON results to compare against')
+    parser.add_argument(
+        '--threshold', type=float, default=0.1,
+        help='Fraction slower than the baseline that is a regression (default: 0.1)'
+    )
+    parser.add_argument(
+        '--loop', choices=eventloop.LOOPS, default='auto',
+        help='Event loop implementation (default: uvloop if installed)'
+    )
+    parser.add_argument('--log-level', default='WARNING')
+    return parser.parse_args(argv)
+
+
+def print_result(result: typing.Dict[str, typing.Any]) -> None:
+    print(
+        '{name:<28} {median_us:>9.3f}us  mean {mean_us:>9.3f}us  '
+        '+- {stdev_us:>7.3f}us  min {min_us:>9.3f}us  ({samples} x {loops})'.format(**result)
+    )
+
+
+async def main(argv: typing.Optional[typing.Sequence[str]] = None) -> int:
+    args = parse_args(argv)
+    logging.basicConfig(level=args.log_level)
+
+    report: typing.Dict[str, typing.Any] = {
+        'benchmark': 'micro',
+        'environment': results.environment(),
+        'settings': {'samples': args.samples, 'min_time': args.min_time},
+        'results': await run(args.patterns, args.samples, args.min_time),
+    }
+
+    output = args.output or results.default_output('micro')
+    results.save(report, output)
+    print('Results saved to {}'.format(output))
+
+    if args.baseline:
+        baseline = results.load(args.baseline)
+        print('Compared with {} ({} event loop):'.format(
+            args.baseline, baseline['environment'].get('event_loop', 'asyncio')
+        ))
+        for change in results.changes(report['results'], baseline['results'], ('name',)):
+            print('  {}'.format(change))
+
+        regressions = results.compare(
+            report['results'],
+            baseline['results'],
+            ('name',),
+            args.threshold
+        )
+        for regression in regressions:
+            print('REGRESSION {}'.format(regression))
+        if regressions:
+            return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(eventloop.run(main, parse_args().loop))
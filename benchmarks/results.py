@@ -0,0 +1,129 @@
+"""Saving benchmark results and comparing them against a baseline."""
+import json
+import math
+import os
+import platform
+import time
+import typing
+
+from lutronbond import eventloop
+
+
+# Result fields where a higher value is a regression
+HIGHER_IS_WORSE = ('p50_ms', 'p99_ms', 'median_us')
+# Result fields where a lower value is a regression
+LOWER_IS_WORSE = ('throughput',)
+
+
+def percentile(values: typing.Sequence[float], percent: float) -> float:
+    """Nearest-rank percentile."""
+
+    if not values:
+        return 0.0
+
+    ordered = sorted(values)
+    rank = max(1, math.ceil(percent / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def environment() -> typing.Dict[str, typing.Any]:
+    return {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'cpus': os.cpu_count(),
+        'event_loop': eventloop.current(),
+    }
+
+
+def save(report: typing.Dict[str, typing.Any], path: str) -> None:
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+        f.write('\n')
+
+
+def load(path: str) -> typing.Dict[str, typing.Any]:
+    with open(path) as f:
+        report: typing.Dict[str, typing.Any] = json.load(f)
+    return report
+
+
+def compare(
+        current: typing.Sequence[typing.Dict[str, typing.Any]],
+        baseline: typing.Sequence[typing.Dict[str, typing.Any]],
+        key: typing.Sequence[str],
+        threshold: float
+) -> typing.List[str]:
+    """Describe every result that is more than `threshold` (a fraction) worse
+    than the baseline result with the same `key` fields.
+    """
+
+    baseline_by_key = {tuple(r[k] for k in key): r for r in baseline}
+    regressions = []
+
+    for result in current:
+        name = ' '.join(str(result[k]) for k in key)
+        previous = baseline_by_key.get(tuple(result[k] for k in key))
+        if previous is None:
+            continue
+
+        for field in HIGHER_IS_WORSE:
+            if field in result and previous.get(field):
+                if result[field] > previous[field] * (1 + threshold):
+                    regressions.append('{}: {} {:.3f} -> {:.3f}'.format(
+                        name, field, previous[field], result[field]
+                    ))
+
+        for field in LOWER_IS_WORSE:
+            if field in result and previous.get(field):
+                if result[field] < previous[field] * (1 - threshold):
+                    regressions.append('{}: {} {:.3f} -> {:.3f}'.format(
+                        name, field, previous[field], result[field]
+                    ))
+
+    return regressions
+
+
+def changes(
+        current: typing.Sequence[typing.Dict[str, typing.Any]],
+        baseline: typing.Sequence[typing.Dict[str, typing.Any]],
+        key: typing.Sequence[str]
+) -> typing.List[str]:
+    """Describe how every result compares with the baseline result with the
+    same `key` fields, better or worse.
+    """
+
+    baseline_by_key = {tuple(r[k] for k in key): r for r in baseline}
+    described = []
+
+    for result in current:
+        name = ' '.join(str(result[k]) for k in key)
+        previous = baseline_by_key.get(tuple(result[k] for k in key))
+        if previous is None:
+            continue
+
+        for field in HIGHER_IS_WORSE + LOWER_IS_WORSE:
+            if field in result and previous.get(field):
+                described.append('{}: {} {:.3f} -> {:.3f} ({:+.1f}%)'.format(
+                    name,
+                    field,
+                    previous[field],
+                    result[field],
+                    (result[field] / previous[field] - 1) * 100
+                ))
+
+    return described
+
+
+def default_output(name: str) -> str:
+    return os.path.join(
+        os.path.dirname(__file__),
+        'results',
+        '{}-{}.json'.format(name, time.strftime('%Y%m%d-%H%M%S'))
+    )
@@ -0,0 +1,296 @@
+"""Checks on the mappings as a whole, made whenever they are loaded.
+
+Every action is checked against what its kind of target can carry out. Lutron
+targets are also followed to the events they cause: the bridge reports a
+button pressed or a level set over the integration protocol just as it would
+one done by hand, so a Lutron target can trigger the mappings of the device it
+controls. Rules that trigger each other in a loop would send commands forever,
+and long chains fan one button press out into many commands.
+"""
+import typing
+
+from . import backends
+from . import lutron
+
+
+COMPONENTS = {c.name for c in lutron.Component if c is not lutron.Component.UNKNOWN}
+DEVICE_ACTIONS = {a.name for a in lutron.DeviceAction if a is not lutron.DeviceAction.UNKNOWN}
+OUTPUT_ACTIONS = {a.name for a in lutron.OutputAction if a is not lutron.OutputAction.UNKNOWN}
+
+# An event the mappings react to: bridge address, integration ID, component
+# and action
+State = typing.Tuple[str, int, str, str]
+Graph = typing.Dict[State, typing.Set[State]]
+Mappings = typing.List[typing.Tuple[str, typing.Dict]]
+
+
+def get_targets(entry: dict) -> typing.Iterator[typing.Tuple[str, dict]]:
+    for kind in backends.get_kinds(entry):
+        targets = entry.get(kind, [])
+        for target in targets if type(targets) is list else [targets]:
+            yield kind, target
+
+
+def is_level_map(kind: str, component: str, action: str, value: typing.Any) -> bool:
+    """Whether `value` picks an action by the level an output was set to."""
+
+    if component != 'ANY' or action != 'SET_LEVEL' or not isinstance(value, dict):
+        return False
+
+    if kind != 'lutron':
+        return True
+
+    # Lutron targets can also act on every level alike
+    return get_lutron_event(value) is None
+
+
+def get_values(kind: str, component: str, action: str, value: typing.Any) -> typing.List:
+    """The actions `value` can carry out, one per level if it has levels."""
+
+    if value is None:
+        return []
+
+    if is_level_map(kind, component, action, value):
+        return [v for v in value.values() if v is not None]
+
+    return [value]
+
+
+def get_lutron_event(value: typing.Any) -> typing.Optional[typing.Tuple[str, str]]:
+    """The component and action of the event reported by the bridge after a
+    Lutron target carries out `value`, or None if `value` isn't valid.
+    """
+
+    if not isinstance(value, dict) or not value:
+        return None
+
+    action, arg = next(iter(value.items()))
+
+    if action in OUTPUT_ACTIONS:
+        # Any change to an output is reported as its new level
+        return 'ANY', 'SET_LEVEL'
+
+    if action in COMPONENTS and arg in DEVICE_ACTIONS:
+        return action, arg
+
+    return None
+
+
+def check_value(
+        kind: str,
+        value: typing.Any,
+        action_names: typing.Mapping[str, typing.Collection[str]]
+) -> typing.Optional[str]:
+    if kind == 'lutron':
+        if get_lutron_event(value) is None:
+            return 'expected an output action like {SET_LEVEL: "100"} or a button press ' \
+                'like {BTN_1: PRESS}'
+        return None
+
+    if kind not in action_names:
+        # The backend doesn't say what its targets understand
+        return None
+
+    # Bond actions can take an argument, like {SetSpeed: 3}
+    name = next(iter(value), None) if kind == 'bond' and isinstance(value, dict) else value
+
+    if not isinstance(name, str) or name not in action_names[kind]:
+        return 'unknown {} action {!r}'.format(kind.capitalize(), name)
+
+    return None
+
+
+def check_target(
+        kind: str,
+        target: dict,
+        path: str,
+        action_names: typing.Mapping[str, typing.Collection[str]]
+) -> typing.List[str]:
+    errors = []
+
+    for component, component_actions in target.get('actions', {}).items():
+        if component not in COMPONENTS:
+            errors.append('{}: unknown component {}'.format(path, component))
+            continue
+
+        for action, value in component_actions.items():
+            action_path = '{}: {}.{}'.format(path, component, action)
+
+            if action not in DEVICE_ACTIONS and action not in OUTPUT_ACTIONS:
+                errors.append('{}: unknown action'.format(action_path))
+                continue
+
+            for v in get_values(kind, component, action, value):
+                error = check_value(kind, v, action_names)
+                if error:
+                    errors.append('{}: {}'.format(action_path, error))
+
+    return errors
+
+
+def check_actions(
+        mappings: Mappings,
+        bridges: typing.Dict[int, str],
+        action_names: typing.Mapping[str, typing.Collection[str]]
+) -> typing.List[str]:
+    """Every action in the mappings that can never be carried out, along with
+    Lutron targets on unknown bridges. `bridges` maps bridge numbers to their
+    addresses, and `action_names` the other kinds of target to the actions
+    they understand.
+    """
+
+    errors = []
+
+    for bridge_addr, mapping in mappings:
+        for integration_id, entry in mapping.items():
+            for kind, target in get_targets(entry):
+                path = '{}:{} {} {}'.format(
+                    bridge_addr, integration_id, kind, target.get('name') or target.get('id')
+                )
+
+                if kind == 'lutron' and target.get('bridge', 1) not in bridges:
+                    errors.append('{}: unknown bridge {}'.format(path, target['bridge']))
+
+                errors += check_target(kind, target, path, action_names)
+
+    return errors
+
+
+def get_entries(mappings: Mappings) -> typing.Dict[typing.Tuple[str, int], dict]:
+    return {
+        (bridge_addr, integration_id): entry
+        for bridge_addr, mapping in mappings
+        for integration_id, entry in mapping.items()
+    }
+
+
+def get_states(bridge_addr: str, integration_id: int, entry: dict) -> typing.Set[State]:
+    return {
+        (bridge_addr, integration_id, component, action)
+        for _, target in get_targets(entry)
+        for component, component_actions in target.get('actions', {}).items()
+        for action, value in component_actions.items()
+        if value is not None
+    }
+
+
+def count_commands(entry: dict, component: str, action: str) -> int:
+    """How many commands the targets in `entry` send for one event."""
+
+    return sum(
+        1
+        for _, target in get_targets(entry)
+        if target.get('actions', {}).get(component, {}).get(action) is not None
+    )
+
+
+def build_graph(mappings: Mappings, bridges: typing.Dict[int, str]) -> Graph:
+    """Each event the mappings react to, and the events it leads to through
+    Lutron targets.
+    """
+
+    entries = get_entries(mappings)
+    graph: Graph = {}
+
+    for (bridge_addr, integration_id), entry in entries.items():
+        for state in get_states(bridge_addr, integration_id, entry):
+            caused = graph[state] = set()
+            component, action = state[2:]
+
+            for kind, target in get_targets(entry):
+                if kind != 'lutron':
+                    continue
+
+                value = target['actions'].get(component, {}).get(action)
+                target_addr = bridges.get(target.get('bridge', 1), '')
+                target_entry = entries.get((target_addr, target['id']))
+
+                if target_entry is None:
+                    # Nothing is mapped to the device it controls
+                    continue
+
+                for v in get_values(kind, component, action, value):
+                    event = get_lutron_event(v)
+                    if event is not None and count_commands(target_entry, *event):
+                        caused.add((target_addr, target['id']) + event)
+
+    return graph
+
+
+def find_cycles(graph: Graph) -> typing.List[typing.List[State]]:
+    """Every set of events that keep causing each other, in the order they
+    cause each other.
+    """
+
+    # Tarjan's strongly connected components
+    index: typing.Dict[State, int] = {}
+    lowlink: typing.Dict[State, int] = {}
+    stack: typing.List[State] = []
+    on_stack: typing.Set[State] = set()
+    cycles = []
+
+    def visit(state: State) -> None:
+        index[state] = lowlink[state] = len(index)
+        stack.append(state)
+        on_stack.add(state)
+
+        for caused in sorted(graph.get(state, ())):
+            if caused not in index:
+                visit(caused)
+                lowlink[state] = min(lowlink[state], lowlink[caused])
+            elif caused in on_stack:
+                lowlink[state] = min(lowlink[state], index[caused])
+
+        if lowlink[state] == index[state]:
+            component = []
+            while True:
+                member = stack.pop()
+                on_stack.discard(member)
+                component.append(member)
+                if member == state:
+                    break
+
+            if len(component) > 1 or state in graph.get(state, ()):
+                cycles.append(component[::-1])
+
+    for state in sorted(graph):
+        if state not in index:
+            visit(state)
+
+    return cycles
+
+
+def fan_out(mappings: Mappings, graph: Graph) -> typing.Dict[State, typing.Optional[int]]:
+    """The most commands each event can lead to, counting the ones sent for
+    the events it causes. None if it leads into a loop, so has no limit.
+    """
+
+    entries = get_entries(mappings)
+    in_cycle = {state for cycle in find_cycles(graph) for state in cycle}
+    totals: typing.Dict[State, typing.Optional[int]] = {}
+
+    def total(state: State) -> typing.Optional[int]:
+        if state in totals:
+            return totals[state]
+
+        if state in in_cycle:
+            totals[state] = None
+            return None
+
+        result: typing.Optional[int] = count_commands(entries[state[:2]], *state[2:])
+
+        for caused in graph.get(state, ()):
+            caused_total = total(caused)
+            result = None if result is None or caused_total is None else result + caused_total
+
+        totals[state] = result
+        return result
+
+    for state in graph:
+        total(state)
+
+    return totals
+
+
+def format_state(state: State) -> str:
+    return '{}:{} {} {}'.format(*state)
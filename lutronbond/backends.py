@@ -0,0 +1,156 @@
+"""Kinds of target, each handled by a backend.
+
+A backend is a module, or any other object, with the attributes of `Backend`.
+Its kind is the key its targets go under in the mappings. Bond, Tuya and
+Lutron are built in, and others are found through the `lutronbond.backends`
+entry point group, named by their kind:
+
+    [project.entry-points."lutronbond.backends"]
+    hue = "lutronbond_hue"
+
+Backends can also have any of these, which are used if present:
+
+    ACTION_NAMES        Every action their targets understand, checked
+                        whenever the mappings are loaded
+    compile_target      (target) -> target, for config files, e.g. to turn
+                        strings into the types the handler expects
+    warm_up             async (), run at startup alongside connecting to the
+                        Lutron bridges, or when a reload first maps their
+                        kind, to get ready for the first command
+    start_background    () -> callable, to start anything that runs until
+                        shutdown, returning what stops it
+    reload              async (), run before a reload switches over, to pick up
+                        anything the new mappings may need, e.g. devices
+                        added since startup
+    checkpoint          () -> callable, run before a reload builds its
+                        handlers, returning what undoes anything building
+                        them kept, if the reload fails
+    close               async (), run at shutdown
+    forget_device       (id), when a reload removes the last target with
+                        that ID, to let go of anything kept for it
+
+Backends are only imported when the config has a target of their kind.
+"""
+from __future__ import annotations
+
+import functools
+import importlib
+import importlib.metadata
+import logging
+import sys
+import typing
+
+from . import startup
+
+if typing.TYPE_CHECKING:
+    from . import lutron
+
+
+ENTRY_POINT_GROUP = 'lutronbond.backends'
+BUILTIN = {
+    'bond': '{}.bond'.format(__package__),
+    'tuya': '{}.tuya'.format(__package__),
+    'lutron': '{}.lutron'.format(__package__),
+}
+
+Handler = typing.Callable[['lutron.LutronEvent'], typing.Awaitable[bool]]
+# Each required and optional key of a target, with the types of its value
+Schema = typing.Dict[str, typing.Tuple[bool, typing.Tuple[type, ...]]]
+
+logger = logging.getLogger(__name__)
+
+
+class Backend(typing.Protocol):
+    KEYS: Schema
+
+    def get_handler(self, configmap: dict) -> Handler:
+        ...
+
+
+@functools.cache
+def get_entry_points() -> typing.Dict[str, importlib.metadata.EntryPoint]:
+    return {ep.name: ep for ep in importlib.metadata.entry_points(group=ENTRY_POINT_GROUP)}
+
+
+def get_kinds(entry: dict) -> typing.List[str]:
+    """The kinds of target in a mapping entry, built-in ones first."""
+
+    return [kind for kind in BUILTIN if kind in entry] + sorted(
+        key for key in entry if key not in BUILTIN and key != 'name'
+    )
+
+
+@functools.cache
+def get_backend(kind: str) -> Backend:
+    if kind in BUILTIN:
+        name = BUILTIN[kind]
+
+        if name in sys.modules:
+            return typing.cast(Backend, sys.modules[name])
+
+        with startup.phase('import {}'.format(kind)):
+            return typing.cast(Backend, importlib.import_module(name))
+
+    try:
+        entry_point = get_entry_points()[kind]
+    except KeyError:
+        raise ValueError('Unknown kind of target: {}'.format(kind))
+
+    with startup.phase('import {}'.format(kind)):
+        backend: Backend = entry_point.load()
+
+    logger.info('Loaded %s backend from %s', kind, entry_point.value)
+    return backend
+
+
+def get_hooks(targets: typing.Mapping[str, Backend], name: str) -> typing.Dict[str, typing.Any]:
+    """The optional attribute `name` of each backend in `targets` that has
+    it, by kind.
+    """
+
+    return {
+        kind: getattr(backend, name)
+        for kind, backend in targets.items()
+        if hasattr(backend, name)
+    }
+
+
+def is_output_event(event: lutron.LutronEvent) -> bool:
+    return (
+        event.operation.name == "OUTPUT" and
+        event.component.name == "ANY" and
+        event.action.name == "SET_LEVEL"
+    )
+
+
+def resolve_action(
+        actions: dict,
+        event: lutron.LutronEvent,
+        logger: logging.Logger,
+        by_level: bool = True
+) -> typing.Any:
+    """The action in a target's `actions` for `event`, or None if there is
+    none. Unless `by_level` is False, output events pick the action for the
+    level they were set to. Anything missing is logged to `logger`.
+    """
+
+    try:
+        component = actions[event.component.name]
+    except KeyError:
+        logger.warning('Unknown component: %s', event.component)
+        return None
+
+    try:
+        action = component[event.action.name]
+    except KeyError:
+        logger.warning('Unknown action: %s', event.action)
+        return None
+
+    if action is not None and by_level and is_output_event(event):
+        try:
+            action = action[event.parameters]
+        except KeyError:
+            logger.warning('Unknown action: %s:%s', event.component.name, event.parameters)
+            return None
+
+    return action
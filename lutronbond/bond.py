@@ -1,24 +1,170 @@
 import asyncio
 import functools
+import itertools
 import logging
 import pprint
+import sys
+import time
 import typing
 
 import aiohttp
 import backoff
+import backoff.types
 import bond_async  # type: ignore
+from bond_async import bpup
 
+from . import backends
+from . import breaker
 from . import config
 from . import lutron
+from . import metrics
 
 
 logger = logging.getLogger(__name__)
-logging.getLogger('backoff').addHandler(logging.StreamHandler())
+
+# Errors that are worth retrying. Any other client error (e.g. a 4xx
+# response) will fail the same way again, so it is not retried.
+RETRYABLE_EXCEPTIONS = (
+    aiohttp.ClientConnectionError,
+    asyncio.TimeoutError,
+)
+
+ACTION_RETRIES = metrics.counter(
+    'lutronbond_bond_action_retries_total',
+    'Bond action attempts that failed and were retried',
+    ['device'],
+)
+ACTION_GIVEUPS = metrics.counter(
+    'lutronbond_bond_action_giveups_total',
+    'Bond actions that were abandoned, by reason',
+    ['device', 'reason'],
+)
+
+# How often to check that push updates are still arriving from the bridge
+BPUP_LIVENESS_INTERVAL = 30
+# The longest to wait between attempts to subscribe to push updates
+BPUP_RETRY_MAX_WAIT = 60
+
+# Settings of a Bond target in the mappings
+KEYS: backends.Schema = {
+    'id': (True, (str,)),
+    'actions': (True, (dict,)),
+    'name': (False, (str,)),
+    'bridge': (False, (int,)),
+}
+
+# Every action the Bond API defines, like TurnLightOn
+ACTION_NAMES = frozenset(
+    value
+    for name, value in vars(bond_async.action.Action).items()
+    if name.isupper() and isinstance(value, str)
+)
+
+# Bond action -> test of whether the device state already reflects it
+REDUNDANT_ACTIONS: typing.Dict[str, typing.Callable[[dict, typing.Any], bool]] = {
+    'TurnLightOn': lambda state, arg: state.get('light') == 1,
+    'TurnLightOff': lambda state, arg: state.get('light') == 0,
+    'TurnOn': lambda state, arg: state.get('power') == 1,
+    'TurnOff': lambda state, arg: state.get('power') == 0,
+    'SetSpeed': lambda state, arg: (
+        state.get('power') == 1 and state.get('speed') == arg
+    ),
+    'SetDirection': lambda state, arg: state.get('direction') == arg,
+}
+
+
+class BondState(bpup.BPUPSubscriptions):
+    """Latest known state of every device paired with one Bond bridge, kept
+    current by BPUP from that bridge.
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.devices: typing.Dict[str, dict] = {}
+        # Device ID -> position in `order` of the last update to its state,
+        # and of the last command sent to it
+        self.order = itertools.count()
+        self.updated: typing.Dict[str, int] = {}
+        self.sent: typing.Dict[str, int] = {}
+
+    def notify(self, json_msg: typing.Dict[str, typing.Any]) -> None:
+        super().notify(json_msg)
+
+        if json_msg.get('s') != 200:
+            return
+
+        topic = json_msg.get('t', '').split('/')
+        if len(topic) == 3 and topic[0] == 'devices' and topic[2] == 'state':
+            self.update(topic[1], json_msg.get('b', {}))
+
+    def update(self, device_id: str, state: dict) -> None:
+        logger.debug('Bond device %s state: %s', device_id, state)
+        self.devices.setdefault(device_id, {}).update(state)
+        self.updated[device_id] = next(self.order)
+
+    def command_sent(self, device_id: str) -> None:
+        self.sent[device_id] = next(self.order)
+
+    def is_current(self, device_id: str) -> bool:
+        """Whether the known state of the device came after the last command
+        sent to it, rather than before the command took effect.
+        """
+
+        return self.updated.get(device_id, -1) > self.sent.get(device_id, -1)
+
+    def clear(self) -> None:
+        self.devices.clear()
+        self.updated.clear()
+        self.sent.clear()
+        self.connection_lost()
+
+
+# Bond bridge number -> state of its devices. Each bridge's push updates can
+# stop on their own, so each has its own liveness.
+states: typing.Dict[int, BondState] = {}
+
+
+# Bond bridge host -> pooled HTTP session for that bridge
+sessions: typing.Dict[str, aiohttp.ClientSession] = {}
+
+# Bond device ID -> number of the bridge the device is paired with
+inventory: typing.Dict[str, int] = {}
+
+# Set once the inventory has been built. Events are handled while the bridges
+# are still being checked at startup, and until then a device's bridge is
+# unknown.
+inventory_ready = asyncio.Event()
+
+
+def get_state(bridge: int) -> BondState:
+    try:
+        return states[bridge]
+    except KeyError:
+        pass
+
+    state = BondState()
+    states[bridge] = state
+    return state
+
+
+def get_session(host: str) -> aiohttp.ClientSession:
+    # Each bridge gets its own connection pool, so a bridge with a backed up
+    # RF queue only ties up its own connections.
+    try:
+        return sessions[host]
+    except KeyError:
+        pass
+
+    session = aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(limit=config.BOND_CONNECTION_LIMIT)
+    )
+    sessions[host] = session
+    return session
 
 
 @functools.cache
 def get_bond_connection(host: str, api_token: str) -> bond_async.Bond:
-    return bond_async.Bond(host, api_token)
+    return bond_async.Bond(host, api_token, session=get_session(host))
 
 
 def get_default_bond_connection() -> bond_async.Bond:
@@ -28,98 +174,372 @@ def get_default_bond_connection() -> bond_async.Bond:
     )
 
 
-def is_output_event(event: lutron.LutronEvent) -> bool:
-    return (
-        event.operation.name == "OUTPUT" and
-        event.component.name == "ANY" and
-        event.action.name == "SET_LEVEL"
+def get_bridges() -> typing.List[int]:
+    if getattr(config, 'BOND_BRIDGE2_ADDR', None):
+        return [1, 2]
+    return [1]
+
+
+def get_bridge_addr(bridge: int) -> str:
+    if bridge == 1:
+        return config.BOND_BRIDGE_ADDR
+    elif bridge == 2 and 2 in get_bridges():
+        return config.BOND_BRIDGE2_ADDR
+    else:
+        raise ValueError('Unknown Bond bridge: {}'.format(bridge))
+
+
+def get_bridge_connection(bridge: int) -> bond_async.Bond:
+    if bridge == 1:
+        return get_default_bond_connection()
+
+    return get_bond_connection(
+        get_bridge_addr(bridge),
+        config.BOND_BRIDGE2_API_TOKEN
     )
 
 
-def get_handler(  # noqa: C901
-        configmap: dict
-) -> typing.Callable[[lutron.LutronEvent], typing.Awaitable[bool]]:
+def get_device_bridge(device_id: str, bridge: typing.Optional[int] = None) -> int:
+    if bridge is None:
+        return inventory.get(device_id, 1)
 
-    actions = configmap['actions']
+    return bridge
 
-    async def handler(event: lutron.LutronEvent) -> bool:
-        try:
-            component = actions[event.component.name]
-        except KeyError:
-            logger.warning('Unknown component: %s', event.component)
-            return False
 
-        try:
-            action = component[event.action.name]
-        except KeyError:
-            logger.warning('Unknown action: %s', event.action)
-            return False
+def get_device_connection(
+        device_id: str,
+        bridge: typing.Optional[int] = None
+) -> bond_async.Bond:
+    return get_bridge_connection(get_device_bridge(device_id, bridge))
+
+
+def get_bridge_breaker(bridge: int) -> breaker.CircuitBreaker:
+    return breaker.get_breaker(
+        'bond:{}'.format(get_bridge_addr(bridge)),
+        lambda: get_bridge_connection(bridge).version()
+    )
+
+
+async def build_inventory() -> typing.Dict[int, typing.List[str]]:
+    bridges = get_bridges()
+    results = await asyncio.gather(
+        *[get_bridge_connection(bridge).devices() for bridge in bridges]
+    )
+
+    devices = dict(zip(bridges, results))
+    # Devices removed from a bridge, or moved to the other one, since the
+    # last time are forgotten
+    inventory.clear()
+    for bridge, device_ids in devices.items():
+        for device_id in device_ids:
+            inventory[device_id] = bridge
+
+        logger.debug('Bond Bridge %s has devices: %s', bridge, device_ids)
+
+    inventory_ready.set()
+    return devices
+
+
+def reset_inventory() -> None:
+    global inventory_ready
+    inventory.clear()
+    # A new one, as an event can only be waited on from one event loop
+    inventory_ready = asyncio.Event()
+
+
+async def wait_for_inventory(deadline: typing.Optional[float]) -> None:
+    """Wait until the bridge of every device is known, if it matters."""
+
+    if inventory_ready.is_set() or len(get_bridges()) == 1:
+        return
+
+    logger.debug('Waiting for the Bond device inventory')
+    timeout = None if deadline is None else max(0, time_remaining(deadline))
+
+    try:
+        await asyncio.wait_for(inventory_ready.wait(), timeout)
+    except asyncio.TimeoutError:
+        logger.warning('Bond device inventory is not ready. Assuming Bond Bridge 1')
 
+
+async def reload() -> None:
+    """Find the bridges of devices paired since the inventory was built."""
+
+    try:
+        await build_inventory()
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        logger.warning('Unable to rebuild Bond device inventory, keeping the current one: %s', e)
+
+
+async def close() -> None:
+    for session in sessions.values():
+        await session.close()
+
+    sessions.clear()
+    reset_inventory()
+    get_bond_connection.cache_clear()
+
+
+def is_retryable(e: Exception) -> bool:
+    if isinstance(e, aiohttp.ClientResponseError):
+        return e.status >= 500
+
+    return isinstance(e, RETRYABLE_EXCEPTIONS)
+
+
+def get_deadline(event: lutron.LutronEvent) -> typing.Optional[float]:
+    if not config.BOND_ACTION_DEADLINE:
+        return None
+
+    return event.timestamp + config.BOND_ACTION_DEADLINE
+
+
+def time_remaining(deadline: float) -> float:
+    return deadline - time.monotonic()
+
+
+def is_redundant(device_id: str, action: str, arg: typing.Any, bridge: int = 1) -> bool:
+    state = get_state(bridge)
+    if not state.alive or not state.is_current(device_id):
+        return False
+
+    try:
+        device_state = state.devices[device_id]
+        test = REDUNDANT_ACTIONS[action]
+    except KeyError:
+        return False
+
+    return test(device_state, arg)
+
+
+def get_handler(configmap: dict) -> backends.Handler:  # noqa: C901
+
+    actions = configmap['actions']
+    bridge = configmap.get('bridge')
+
+    if bridge is not None:
+        # Fail fast on a bad bridge number, rather than on the first event
+        get_bridge_addr(bridge)
+
+    async def handler(event: lutron.LutronEvent) -> bool:
+        action = backends.resolve_action(actions, event, logger)
         if action is None:
             return False
 
-        if is_output_event(event):
-            try:
-                action = action[event.parameters]
-            except KeyError:
-                logger.warning('Unknown action: %s:%s', event.component.name, event.parameters)
-                return False
-
         arg = None
         if isinstance(action, dict):
             action, arg = list(action.items())[0]
 
+        device_id = configmap['id']
+        deadline = get_deadline(event)
+
+        if bridge is None:
+            await wait_for_inventory(deadline)
+
+        device_bridge = get_device_bridge(device_id, bridge)
+
+        if is_redundant(device_id, action, arg, device_bridge):
+            logger.info(
+                'Skipping %s for %s: Bond device %s is already in that state',
+                action,
+                configmap.get('name', 'Unnamed'),
+                device_id
+            )
+            return True
+
         bond_action = bond_async.action.Action(action, argument=arg)
 
-        logger.debug(
-            'Translated event into bond action: %s with argument: %s',
-            bond_action,
-            arg
-        )
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(
+                'Translated event into bond action: %s with argument: %s',
+                bond_action,
+                arg
+            )
+
+        circuit = get_bridge_breaker(device_bridge)
+
+        if not circuit.allow():
+            logger.warning(
+                'Bond Bridge %s is unreachable. Skipping %s request to %s',
+                device_bridge,
+                action,
+                device_id
+            )
+            ACTION_GIVEUPS.inc(device_id, 'circuit_open')
+            return False
 
         @backoff.on_exception(
             backoff.expo,
-            aiohttp.client_exceptions.ClientConnectorError,
+            (aiohttp.ClientError, asyncio.TimeoutError),
+            giveup=lambda e: not is_retryable(e),
             max_tries=config.BOND_RETRY_COUNT,
-            jitter=backoff.full_jitter
+            max_time=None if deadline is None else functools.partial(time_remaining, deadline),
+            jitter=backoff.full_jitter,
+            on_backoff=lambda details: ACTION_RETRIES.inc(device_id)
         )
         async def do_action() -> bool:
-            logger.debug(
-                'Starting %s request to Bond Bridge %s',
-                action,
-                configmap['id']
-            )
-            await get_default_bond_connection().action(
-                configmap['id'],
-                bond_action
+            timeout = None if deadline is None else time_remaining(deadline)
+            if timeout is not None and timeout <= 0:
+                # The moment has passed. Acting now would only surprise
+                # whoever pressed the button.
+                logger.warning(
+                    'Abandoning %s request to Bond Bridge %s: event is %.1f seconds old',
+                    action,
+                    device_id,
+                    time.monotonic() - event.timestamp
+                )
+                ACTION_GIVEUPS.inc(device_id, 'stale')
+                return False
+
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(
+                    'Starting %s request to Bond Bridge %s',
+                    action,
+                    device_id
+                )
+            # Until the bridge reports the result, the known state is out of date
+            get_state(device_bridge).command_sent(device_id)
+            await asyncio.wait_for(
+                get_bridge_connection(device_bridge).action(
+                    device_id,
+                    bond_action
+                ),
+                timeout
             )
             logger.info(
                 '%s for %s request sent to Bond Bridge %s',
                 action,
                 configmap.get('name', 'Unnamed'),
-                configmap['id']
+                device_id
             )
             return True
 
         try:
-            return await do_action()
-        except aiohttp.client_exceptions.ClientConnectorError:
+            result = await do_action()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.error(
+                '%s request to Bond Bridge %s failed: %r',
+                action,
+                device_id,
+                e
+            )
+            ACTION_GIVEUPS.inc(device_id, 'error')
+
+            if is_retryable(e):
+                circuit.record_failure()
+
             return False
 
+        if result:
+            circuit.record_success()
+
+        return result
+
     return handler
 
 
 async def verify_connection() -> None:
-    logger.debug('Verifying Bond Bridge connection...')
-    result = await get_default_bond_connection().version()
-    logger.info(
-        'Connected to Bond Bridge. Model {model}. Version {fw_ver}'.format(
-            **result
+    async def verify(bridge: int) -> None:
+        logger.debug('Verifying Bond Bridge %s connection...', bridge)
+        result = await get_bridge_connection(bridge).version()
+        logger.info(
+            'Connected to Bond Bridge. Model {model}. Version {fw_ver}'.format(
+                **result
+            )
+        )
+
+    await asyncio.gather(*[verify(bridge) for bridge in get_bridges()])
+    await build_inventory()
+
+
+async def prime_state() -> None:
+    devices = await build_inventory()
+
+    async def fetch(bridge: int, device_ids: typing.List[str]) -> None:
+        bond = get_bridge_connection(bridge)
+        states = await asyncio.gather(
+            *[bond.device_state(device_id) for device_id in device_ids]
+        )
+        for device_id, device_state in zip(device_ids, states):
+            get_state(bridge).update(device_id, device_state)
+
+    await asyncio.gather(
+        *[fetch(bridge, device_ids) for bridge, device_ids in devices.items()]
+    )
+
+
+def listen() -> typing.Callable:
+    def log_retry(details: backoff.types.Details) -> None:
+        # Called while the error is being handled
+        logger.warning(
+            'Unable to subscribe to push updates from Bond Bridge %s, '
+            'retrying in %.1f seconds: %r',
+            details['args'][0],
+            details['wait'],
+            sys.exc_info()[1]
         )
+
+    @backoff.on_exception(
+        backoff.expo,
+        OSError,
+        max_value=BPUP_RETRY_MAX_WAIT,
+        jitter=backoff.full_jitter,
+        on_backoff=log_retry
     )
+    async def start_bpup(bridge: int) -> typing.Callable:
+        stop: typing.Callable = await bpup.start_bpup(get_bridge_addr(bridge), get_state(bridge))
+        return stop
+
+    async def subscribe() -> None:
+        bridges = get_bridges()
+        stops: typing.List[typing.Callable] = []
+
+        try:
+            for bridge in bridges:
+                stops.append(await start_bpup(bridge))
+            logger.info('Subscribed to Bond Bridge push updates')
+
+            try:
+                await prime_state()
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                logger.warning('Unable to fetch Bond device state: %s', e)
+
+            alive = dict.fromkeys(bridges, True)
+            while True:
+                await asyncio.sleep(BPUP_LIVENESS_INTERVAL)
+                for bridge in bridges:
+                    state = get_state(bridge)
+                    if alive[bridge] and not state.alive:
+                        logger.warning('No push updates received from Bond Bridge %s', bridge)
+                    elif state.alive and not alive[bridge]:
+                        logger.info('Push updates from Bond Bridge %s resumed', bridge)
+                    alive[bridge] = state.alive
+        finally:
+            for stop in stops:
+                stop()
+            for bridge in bridges:
+                get_state(bridge).clear()
+
+    loop = asyncio.get_event_loop()
+    task = loop.create_task(subscribe())
+
+    return lambda: task.cancel()
+
+
+async def warm_up() -> None:
+    await verify_connection()
+
+
+def start_background() -> typing.Callable:
+    return keepalive()
 
 
 def keepalive() -> typing.Callable:
+    if config.BOND_BPUP:
+        # The BPUP subscription keeps the route to the bridge warm on its own,
+        # and its message stream doubles as a liveness signal.
+        return listen()
+
     if config.BOND_KEEPALIVE_INTERVAL == 0:
         return lambda: True
 
@@ -127,7 +547,9 @@ def keepalive() -> typing.Callable:
         while True:
             await asyncio.sleep(config.BOND_KEEPALIVE_INTERVAL)
             logger.debug('Starting Bond keepalive check')
-            await get_default_bond_connection().version()
+            await asyncio.gather(
+                *[get_bridge_connection(bridge).version() for bridge in get_bridges()]
+            )
             logger.debug('Bond keepalive check successful')
 
     loop = asyncio.get_event_loop()
@@ -139,33 +561,38 @@ def keepalive() -> typing.Callable:
 async def main() -> None:
     """Example of library usage."""
 
-    bond = get_default_bond_connection()
+    for bridge in get_bridges():
+        bond = get_bridge_connection(bridge)
 
-    print("\nVersion:")
-    print(await bond.version())
+        print("\nBridge {}: {}".format(bridge, get_bridge_addr(bridge)))
 
-    print("\nDevice IDs:")
-    device_ids = await bond.devices()
-    pprint.pprint(device_ids)
+        print("\nVersion:")
+        print(await bond.version())
 
-    print("\nDevices:")
-    devices = await asyncio.gather(
-        *[bond.device(device_id) for device_id in device_ids]
-    )
-    pprint.pprint(dict(zip(device_ids, devices)))
-    device_names = [device['name'] for device in devices]
+        print("\nDevice IDs:")
+        device_ids = await bond.devices()
+        pprint.pprint(device_ids)
 
-    print("\nDevices Properties:")
-    properties = await asyncio.gather(
-        *[bond.device_properties(device_id) for device_id in device_ids]
-    )
-    pprint.pprint(dict(zip(device_names, properties)))
+        print("\nDevices:")
+        devices = await asyncio.gather(
+            *[bond.device(device_id) for device_id in device_ids]
+        )
+        pprint.pprint(dict(zip(device_ids, devices)))
+        device_names = [device['name'] for device in devices]
 
-    print("\nDevices State:")
-    state = await asyncio.gather(
-        *[bond.device_state(device_id) for device_id in device_ids]
-    )
-    pprint.pprint(dict(zip(device_names, state)))
+        print("\nDevices Properties:")
+        properties = await asyncio.gather(
+            *[bond.device_properties(device_id) for device_id in device_ids]
+        )
+        pprint.pprint(dict(zip(device_names, properties)))
+
+        print("\nDevices State:")
+        device_states = await asyncio.gather(
+            *[bond.device_state(device_id) for device_id in device_ids]
+        )
+        pprint.pprint(dict(zip(device_names, device_states)))
+
+    await close()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,129 @@
+import asyncio
+import logging
+import typing
+
+from . import config
+from . import metrics
+
+
+# The longest a single recovery probe may take
+PROBE_TIMEOUT = 5
+
+Probe = typing.Callable[[], typing.Awaitable[typing.Any]]
+
+CIRCUIT_OPEN = metrics.gauge(
+    'lutronbond_circuit_open',
+    'Whether the circuit breaker for a target is open (1) or closed (0)',
+    ['target'],
+)
+CIRCUIT_REJECTED = metrics.counter(
+    'lutronbond_circuit_rejected_total',
+    'Requests failed fast because the circuit breaker for a target was open',
+    ['target'],
+)
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitBreaker:
+    """Stops sending requests to a target that keeps failing.
+
+    After `config.BREAKER_FAILURE_THRESHOLD` consecutive failures the circuit
+    opens, and requests fail immediately instead of paying for retries and
+    timeouts. While open, `probe` is called in the background every
+    `config.BREAKER_PROBE_INTERVAL` seconds, and the circuit closes again as
+    soon as a probe succeeds.
+    """
+
+    def __init__(self, target: str, probe: Probe) -> None:
+        self.target = target
+        self.probe = probe
+        self.failures = 0
+        self.is_open = False
+        self._probe_task: typing.Optional[asyncio.Task] = None
+        self.logger = logger.getChild('CircuitBreaker<{}>'.format(target))
+        CIRCUIT_OPEN.set(0, target)
+
+    def allow(self) -> bool:
+        if self.is_open:
+            CIRCUIT_REJECTED.inc(self.target)
+            return False
+
+        return True
+
+    def record_success(self) -> None:
+        self.failures = 0
+
+        if self.is_open:
+            self.close()
+
+    def record_failure(self) -> None:
+        self.failures += 1
+
+        if (
+                not self.is_open and
+                config.BREAKER_FAILURE_THRESHOLD and
+                self.failures >= config.BREAKER_FAILURE_THRESHOLD
+        ):
+            self.open()
+
+    def open(self) -> None:
+        self.logger.warning(
+            'Opening circuit after %s consecutive failures', self.failures
+        )
+        self.is_open = True
+        CIRCUIT_OPEN.set(1, self.target)
+        self._probe_task = asyncio.get_event_loop().create_task(self._probe())
+
+    def close(self) -> None:
+        self.logger.info('Target recovered. Closing circuit')
+        self.is_open = False
+        self.failures = 0
+        CIRCUIT_OPEN.set(0, self.target)
+
+        if self._probe_task is not None and self._probe_task is not asyncio.current_task():
+            self._probe_task.cancel()
+        self._probe_task = None
+
+    def cancel(self) -> None:
+        if self._probe_task is not None:
+            self._probe_task.cancel()
+            self._probe_task = None
+
+    async def _probe(self) -> None:
+        while self.is_open:
+            await asyncio.sleep(config.BREAKER_PROBE_INTERVAL)
+            self.logger.debug('Probing target')
+
+            try:
+                await asyncio.wait_for(self.probe(), PROBE_TIMEOUT)
+            except Exception as e:
+                self.logger.debug('Probe failed: %r', e)
+            else:
+                self.close()
+
+
+breakers: typing.Dict[str, CircuitBreaker] = {}
+
+
+def get_breaker(target: str, probe: Probe) -> CircuitBreaker:
+    try:
+        return breakers[target]
+    except KeyError:
+        pass
+
+    breaker = breakers[target] = CircuitBreaker(target, probe)
+    return breaker
+
+
+def remove(target: str) -> None:
+    breaker = breakers.pop(target, None)
+    if breaker is not None:
+        breaker.cancel()
+
+
+def reset() -> None:
+    for breaker in breakers.values():
+        breaker.cancel()
+
+    breakers.clear()
@@ -0,0 +1,131 @@
+"""Recording raw Lutron bridge traffic for replay (see lutronbond.replay).
+
+A capture file starts with MAGIC, followed by one record per line received:
+
+    timestamp    8 bytes, big-endian double (monotonic seconds)
+    bridge size  1 byte
+    line size    2 bytes, big-endian
+    bridge       ASCII bridge address
+    line         the raw line, as read off the socket
+
+Captures are only ever appended to, so one file can span many runs of the
+program. Timestamps restart from an arbitrary point in each run.
+"""
+import functools
+import logging
+import queue
+import struct
+import threading
+import typing
+
+from . import config
+
+
+MAGIC = b'LBCAP\x01'
+RECORD_HEADER = struct.Struct('>dBH')
+
+logger = logging.getLogger(__name__)
+
+
+class Record(typing.NamedTuple):
+    timestamp: float
+    bridge: str
+    data: bytes
+
+
+class CaptureWriter:
+    """Appends records to a capture file from a background thread, as a
+    write can block the event loop (see lutronbond.logs).
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._file = open(path, 'ab')
+
+        if self._file.tell() == 0:
+            self._file.write(MAGIC)
+            self._file.flush()
+
+        # Encoded records, then None to stop
+        self._records: queue.SimpleQueue = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self._run, name='capture', daemon=True)
+        self._thread.start()
+
+    def write(self, bridge: str, data: bytes, timestamp: float) -> None:
+        encoded = bridge.encode('ascii')
+        self._records.put(
+            RECORD_HEADER.pack(timestamp, len(encoded), len(data)) + encoded + data
+        )
+
+    def _run(self) -> None:
+        while True:
+            record = self._records.get()
+
+            # Everything queued up meanwhile goes out in one flush
+            while record is not None:
+                self._file.write(record)
+                try:
+                    record = self._records.get_nowait()
+                except queue.Empty:
+                    break
+
+            # Flushed straight away, so little is lost if the program is killed
+            self._file.flush()
+
+            if record is None:
+                return
+
+    def close(self) -> None:
+        """Write out any records still queued and close the file."""
+
+        self._records.put(None)
+        self._thread.join()
+        self._file.close()
+
+
+@functools.cache
+def get_writer() -> typing.Optional[CaptureWriter]:
+    path = getattr(config, 'CAPTURE_FILE', None)
+
+    if not path:
+        return None
+
+    logger.info('Capturing Lutron bridge traffic to %s', path)
+    return CaptureWriter(path)
+
+
+def close() -> None:
+    if get_writer.cache_info().currsize:
+        writer = get_writer()
+        if writer is not None:
+            writer.close()
+    get_writer.cache_clear()
+
+
+def read(path: str) -> typing.Iterator[Record]:
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError('Not a capture file: {}'.format(path))
+
+        while True:
+            offset = f.tell()
+            header = f.read(RECORD_HEADER.size)
+            if not header:
+                return
+
+            try:
+                timestamp, bridge_size, data_size = RECORD_HEADER.unpack(header)
+                bridge = f.read(bridge_size)
+                data = f.read(data_size)
+                if len(bridge) != bridge_size or len(data) != data_size:
+                    raise struct.error('Record is truncated')
+            except struct.error:
+                # The program stopped part way through writing a record
+                logger.warning(
+                    'Ignoring truncated record at the end of %s (offset %s)',
+                    path,
+                    offset
+                )
+                return
+
+            yield Record(timestamp, bridge.decode('ascii'), data)
@@ -1,5 +1,7 @@
 import os
-from typing import Dict
+from typing import Any, Dict
+
+from . import flyweight
 
 
 def get_env(name: str, default: str = '') -> str:
@@ -18,6 +20,7 @@ def get_env(name: str, default: str = '') -> str:
 
 
 LUTRON_BRIDGE_ADDR = get_env('LB_LUTRON_BRIDGE_ADDR')
+LUTRON_BRIDGE_PORT = int(get_env('LB_LUTRON_BRIDGE_PORT', '23'), 10)
 
 try:
     LUTRON_BRIDGE2_ADDR = get_env('LB_LUTRON_BRIDGE2_ADDR')
@@ -27,12 +30,48 @@ except ValueError:
 BOND_BRIDGE_ADDR = get_env('LB_BOND_BRIDGE_ADDR')
 BOND_BRIDGE_API_TOKEN = get_env('LB_BOND_BRIDGE_API_TOKEN')
 
+try:
+    BOND_BRIDGE2_ADDR = get_env('LB_BOND_BRIDGE2_ADDR')
+except ValueError:
+    pass
+else:
+    # Required along with the address, rather than quietly going without the
+    # second bridge
+    BOND_BRIDGE2_API_TOKEN = get_env('LB_BOND_BRIDGE2_API_TOKEN')
+
+BOND_CONNECTION_LIMIT = int(get_env('LB_BOND_CONNECTION_LIMIT', '4'), 10)
+
 BOND_KEEPALIVE_INTERVAL = int(get_env('LB_BOND_KEEPALIVE_INTERVAL', '0'), 10)
 BOND_RETRY_COUNT = int(get_env('LB_BOND_RETRY_COUNT', '5'), 10)
+BOND_ACTION_DEADLINE = float(get_env('LB_BOND_ACTION_DEADLINE', '10'))
+BOND_BPUP = bool(int(get_env('LB_BOND_BPUP', '0'), 10))
 LOG_LEVEL = get_env('LB_LOG_LEVEL', 'INFO')
+LOG_FORMAT = get_env('LB_LOG_FORMAT', 'text')
+LOG_QUEUE = bool(int(get_env('LB_LOG_QUEUE', '1'), 10))
+EVENT_LOOP = get_env('LB_EVENT_LOOP', 'auto')
+LOOP_MONITOR = float(get_env('LB_LOOP_MONITOR', '0'))
+PROFILE_DIR = get_env('LB_PROFILE_DIR', '.')
+
+try:
+    CAPTURE_FILE = get_env('LB_CAPTURE_FILE')
+except ValueError:
+    pass
+
+METRICS_ADDR = get_env('LB_METRICS_ADDR', '0.0.0.0')
+METRICS_PORT = int(get_env('LB_METRICS_PORT', '0'), 10)
+
+BREAKER_FAILURE_THRESHOLD = int(get_env('LB_BREAKER_FAILURE_THRESHOLD', '3'), 10)
+BREAKER_PROBE_INTERVAL = int(get_env('LB_BREAKER_PROBE_INTERVAL', '15'), 10)
+
+STORM_LIMIT = int(get_env('LB_STORM_LIMIT', '10'), 10)
+STORM_WINDOW = float(get_env('LB_STORM_WINDOW', '1'))
+
+SHUTDOWN_TIMEOUT = float(get_env('LB_SHUTDOWN_TIMEOUT', '10'))
 
 TUYA_RETRY_COUNT = int(get_env('LB_TUYA_RETRY_COUNT', '3'), 10)
 TUYA_CONNECTION_TIMEOUT = int(get_env('LB_TUYA_CONNECTION_TIMEOUT', '3'), 10)
+TUYA_DISCOVERY = bool(int(get_env('LB_TUYA_DISCOVERY', '0'), 10))
+TUYA_ADDRESS_CACHE = get_env('LB_TUYA_ADDRESS_CACHE', 'tuya_addresses.json')
 
 FAN_LIGHT_CONFIG = {
     'BTN_1': {
@@ -295,3 +334,27 @@ LUTRON2_MAPPING: Dict[int, Dict] = {
         ],
     },
 }
+
+# Devices mapped alike share their tables
+LUTRON_MAPPING, LUTRON2_MAPPING = flyweight.intern_all(LUTRON_MAPPING, LUTRON2_MAPPING)
+
+# A config file, if given, replaces the mappings above
+CONFIG_CACHE_DIR = get_env('LB_CONFIG_CACHE_DIR', 'config_cache')
+
+try:
+    CONFIG_FILE = get_env('LB_CONFIG_FILE')
+except ValueError:
+    pass
+else:
+    # Loaded when first used rather than here, as checking the file needs the
+    # lutron module, which imports this one
+    del LUTRON_MAPPING, LUTRON2_MAPPING
+
+    def __getattr__(name: str) -> Any:
+        if name not in ('LUTRON_MAPPING', 'LUTRON2_MAPPING'):
+            raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
+
+        from . import configfile
+
+        globals().update(configfile.load(CONFIG_FILE, CONFIG_CACHE_DIR))
+        return globals()[name]
@@ -0,0 +1,323 @@
+"""Loading the Lutron mappings from a JSON, TOML or YAML file.
+
+The file has the same shape as LUTRON_MAPPING and LUTRON2_MAPPING in
+config.py, under the keys `lutron_mapping` and `lutron2_mapping`. It is
+validated, then compiled into the form the controller uses: integration IDs
+as ints, every target as a list, and output levels as strings like '100.00'.
+
+The compiled form is cached in LB_CONFIG_CACHE_DIR under a hash of the file's
+contents, so later starts with the same file skip all of that.
+"""
+import hashlib
+import json
+import logging
+import marshal
+import math
+import os
+import sys
+import typing
+
+from . import analysis
+from . import backends
+from . import flyweight
+
+
+# Bump whenever the compiled form changes, so old caches are not used
+COMPILER_VERSION = 3
+CACHE_SUFFIX = '.marshal'
+SECTIONS = {'lutron_mapping': 'LUTRON_MAPPING', 'lutron2_mapping': 'LUTRON2_MAPPING'}
+COMPONENTS = analysis.COMPONENTS
+ACTIONS = analysis.DEVICE_ACTIONS | analysis.OUTPUT_ACTIONS
+
+Mapping = typing.Dict[int, typing.Dict[str, typing.Any]]
+
+logger = logging.getLogger(__name__)
+
+
+def parse(path: str, data: bytes) -> typing.Any:
+    extension = os.path.splitext(path)[1].lower()
+
+    if extension == '.json':
+        return json.loads(data)
+
+    if extension == '.toml':
+        if sys.version_info >= (3, 11):
+            import tomllib
+        else:
+            try:
+                import tomli as tomllib
+            except ImportError:
+                raise ValueError('Reading TOML config files needs tomli: pip install tomli')
+        return tomllib.loads(data.decode('utf-8'))
+
+    if extension in ('.yaml', '.yml'):
+        try:
+            import yaml  # type: ignore
+        except ImportError:
+            raise ValueError('Reading YAML config files needs PyYAML: pip install pyyaml')
+        return yaml.safe_load(data)
+
+    raise ValueError('Unknown config file type: {} (use .json, .toml or .yaml)'.format(path))
+
+
+def is_integration_id(value: typing.Any) -> bool:
+    if isinstance(value, bool):
+        return False
+    if isinstance(value, int):
+        return True
+    return isinstance(value, str) and value.isdigit()
+
+
+def is_level(value: typing.Any) -> bool:
+    if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+        return False
+
+    try:
+        return math.isfinite(float(value))
+    except ValueError:
+        return False
+
+
+def is_target_kind(kind: str) -> bool:
+    try:
+        backends.get_backend(kind)
+    except ValueError:
+        return False
+    return True
+
+
+def validate_actions(kind: str, actions: dict, path: str) -> typing.List[str]:
+    errors = []
+
+    for component, component_actions in actions.items():
+        if component not in COMPONENTS:
+            errors.append('{}.{}: unknown component'.format(path, component))
+            continue
+
+        if not isinstance(component_actions, dict):
+            errors.append('{}.{}: expected a table of actions'.format(path, component))
+            continue
+
+        for action, value in component_actions.items():
+            action_path = '{}.{}.{}'.format(path, component, action)
+
+            if action not in ACTIONS:
+                errors.append('{}: unknown action'.format(action_path))
+            elif kind == 'lutron' and isinstance(value, str):
+                errors.append('{}: expected a table like {{SET_LEVEL: "100"}}'.format(action_path))
+            elif value is not None and not isinstance(value, (str, dict)):
+                errors.append('{}: expected a string, a table or null'.format(action_path))
+            elif component == 'ANY' and action == 'SET_LEVEL' and isinstance(value, dict):
+                errors += [
+                    '{}.{}: expected a level like 100 or "100.00"'.format(action_path, level)
+                    for level in value
+                    if not is_level(level)
+                ]
+
+    return errors
+
+
+def validate_target(kind: str, target: typing.Any, path: str) -> typing.List[str]:
+    if not isinstance(target, dict):
+        return ['{}: expected a table'.format(path)]
+
+    errors = []
+    keys = backends.get_backend(kind).KEYS
+
+    for key, (required, types) in keys.items():
+        if key not in target:
+            if required:
+                errors.append('{}: missing {}'.format(path, key))
+        elif isinstance(target[key], bool) or not isinstance(target[key], types):
+            errors.append('{}.{}: expected {}'.format(
+                path, key, ' or '.join(t.__name__ for t in types)
+            ))
+
+    for key in target:
+        if key not in keys:
+            errors.append('{}.{}: unknown setting'.format(path, key))
+
+    if isinstance(target.get('actions'), dict):
+        errors += validate_actions(kind, target['actions'], path + '.actions')
+
+    return errors
+
+
+def validate_mapping(mapping: typing.Any, path: str) -> typing.List[str]:
+    if not isinstance(mapping, dict):
+        return ['{}: expected a table of Lutron integration IDs'.format(path)]
+
+    errors = []
+
+    for integration_id, entry in mapping.items():
+        entry_path = '{}.{}'.format(path, integration_id)
+
+        if not is_integration_id(integration_id):
+            errors.append('{}: expected a Lutron integration ID'.format(entry_path))
+            continue
+
+        if not isinstance(entry, dict):
+            errors.append('{}: expected a table'.format(entry_path))
+            continue
+
+        for key, value in entry.items():
+            if key == 'name':
+                if not isinstance(value, str):
+                    errors.append('{}.name: expected str'.format(entry_path))
+            elif not is_target_kind(key):
+                errors.append('{}.{}: unknown target kind'.format(entry_path, key))
+            elif isinstance(value, list):
+                for i, target in enumerate(value):
+                    errors += validate_target(key, target, '{}.{}[{}]'.format(entry_path, key, i))
+            else:
+                errors += validate_target(key, value, '{}.{}'.format(entry_path, key))
+
+    return errors
+
+
+def validate(document: typing.Any) -> typing.List[str]:
+    """Everything wrong with a parsed config file."""
+
+    if not isinstance(document, dict):
+        return ['expected a table with lutron_mapping and optionally lutron2_mapping']
+
+    errors = []
+
+    for section, value in document.items():
+        if section not in SECTIONS:
+            errors.append('{}: unknown section'.format(section))
+        else:
+            errors += validate_mapping(value, section)
+
+    if 'lutron_mapping' not in document:
+        errors.append('missing lutron_mapping')
+
+    return errors
+
+
+def compile_level(level: typing.Any) -> str:
+    # Lutron reports levels with two decimal places. Keys in JSON and TOML are
+    # always strings, so "100" is normalised too.
+    return '{:.2f}'.format(float(level))
+
+
+def compile_actions(actions: dict) -> dict:
+    compiled: typing.Dict[str, dict] = {}
+
+    for component, component_actions in actions.items():
+        compiled[component] = {}
+
+        for action, value in component_actions.items():
+            if component == 'ANY' and action == 'SET_LEVEL' and isinstance(value, dict):
+                value = {compile_level(level): v for level, v in value.items()}
+            compiled[component][action] = value
+
+    return compiled
+
+
+def compile_target(kind: str, target: dict) -> dict:
+    compiled = dict(target, actions=compile_actions(target['actions']))
+    compile_hook = getattr(backends.get_backend(kind), 'compile_target', None)
+
+    if compile_hook is not None:
+        compiled = compile_hook(compiled)
+
+    return compiled
+
+
+def compile_mapping(mapping: dict) -> Mapping:
+    compiled: Mapping = {}
+
+    for integration_id, entry in mapping.items():
+        compiled_entry: typing.Dict[str, typing.Any] = {}
+
+        for key, value in entry.items():
+            if key != 'name':
+                targets = value if isinstance(value, list) else [value]
+                value = [compile_target(key, target) for target in targets]
+            compiled_entry[key] = value
+
+        compiled[int(integration_id)] = compiled_entry
+
+    return compiled
+
+
+def compile_config(document: dict) -> typing.Dict[str, Mapping]:
+    """The mappings in a valid config file, as config.py would have them."""
+
+    compiled = {
+        name: compile_mapping(document.get(section) or {})
+        for section, name in SECTIONS.items()
+    }
+    # The cache keeps the sharing, so it only has to be done once
+    interned: typing.Dict[str, Mapping] = flyweight.intern(compiled)
+    return interned
+
+
+def cache_key(data: bytes) -> str:
+    digest = hashlib.sha256(data)
+    # The cache format is specific to the Python version
+    digest.update('{}:{}:{}'.format(COMPILER_VERSION, marshal.version, sys.version).encode())
+    return digest.hexdigest()
+
+
+def read_cache(path: str) -> typing.Optional[typing.Dict[str, Mapping]]:
+    try:
+        with open(path, 'rb') as f:
+            compiled: typing.Dict[str, Mapping] = marshal.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, EOFError, ValueError, TypeError) as e:
+        logger.warning('Ignoring unreadable config cache %s: %r', path, e)
+        return None
+
+    return compiled
+
+
+def write_cache(cache_dir: str, path: str, compiled: typing.Dict[str, Mapping]) -> None:
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+
+        # Written elsewhere and moved into place, so a reader never sees half
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            marshal.dump(compiled, f)
+        os.replace(tmp_path, path)
+
+        # Only the latest config is worth keeping
+        for name in os.listdir(cache_dir):
+            old_path = os.path.join(cache_dir, name)
+            if name.endswith(CACHE_SUFFIX) and old_path != path:
+                os.remove(old_path)
+    except OSError as e:
+        logger.warning('Unable to cache config in %s: %r', cache_dir, e)
+
+
+def load(path: str, cache_dir: str = '') -> typing.Dict[str, Mapping]:
+    """LUTRON_MAPPING and LUTRON2_MAPPING from a config file, from the
+    cache in `cache_dir` if the file hasn't changed since it was cached.
+    """
+
+    with open(path, 'rb') as f:
+        data = f.read()
+
+    cache_path = os.path.join(cache_dir, cache_key(data) + CACHE_SUFFIX) if cache_dir else ''
+
+    if cache_path:
+        compiled = read_cache(cache_path)
+        if compiled is not None:
+            logger.debug('Loaded compiled config for %s from %s', path, cache_path)
+            return compiled
+
+    document = parse(path, data)
+    errors = validate(document)
+
+    if errors:
+        raise ValueError('Invalid config file {}:\n  {}'.format(path, '\n  '.join(errors)))
+
+    compiled = compile_config(document)
+
+    if cache_path:
+        write_cache(cache_dir, cache_path, compiled)
+
+    return compiled
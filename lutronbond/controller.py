@@ -1,13 +1,24 @@
 import asyncio
+import importlib
 import logging
 import signal
 import typing
 
-from . import bond
+from . import analysis
+from . import backends
+from . import breaker
+from . import capture
 from . import config
+from . import configfile
 from . import eventbus
+from . import eventloop
+from . import flyweight
+from . import latency
+from . import loopmonitor
 from . import lutron
-from . import tuya
+from . import metrics
+from . import profiler
+from . import startup
 
 
 EVENT_OPERATION: list[lutron.Operation] = [
@@ -15,23 +26,197 @@ EVENT_OPERATION: list[lutron.Operation] = [
     lutron.Operation.OUTPUT,
 ]
 
+EVENTS = metrics.counter(
+    'lutronbond_lutron_events_total',
+    'Lutron events published to handlers',
+    ['bridge', 'device', 'component', 'action'],
+)
+
+MAPPING_BYTES = metrics.gauge(
+    'lutronbond_mapping_bytes',
+    'Memory used by the mappings, counting shared tables once',
+)
+DROPPED = metrics.counter(
+    'lutronbond_shutdown_dropped_total',
+    'Lutron events ignored and commands cancelled while shutting down',
+    ['kind'],
+)
+RELOADS = metrics.counter(
+    'lutronbond_config_reloads_total',
+    'Attempts to reload the mappings, by result',
+    ['result'],
+)
+
+# Reloads run one at a time, in the order they were asked for
+reload_lock = asyncio.Lock()
+
+shutting_down: bool = False
+
+# The backend of each kind of target that has been started. Kinds first mapped
+# by a reload are started then, and every one is closed at shutdown.
+targets: typing.Dict[str, backends.Backend] = {}
+# What stops the background work of the started backends
+stop_background: typing.List[typing.Callable] = []
+
 logger = logging.getLogger(__name__)
 
 
 def handler(lutron_event: lutron.LutronEvent) -> None:
     if lutron_event.operation not in EVENT_OPERATION:
-        logger.debug('Skipping Lutron event: %s', lutron_event)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug('Skipping Lutron event: %s', lutron_event)
+        return
+
+    if shutting_down:
+        logger.warning('Ignoring Lutron event while shutting down: %s', lutron_event)
+        DROPPED.inc('event')
         return
 
     logger.info('Handling Lutron event: %s', lutron_event)
 
+    EVENTS.inc(
+        lutron_event.bridge,
+        str(lutron_event.device),
+        lutron_event.component.name,
+        lutron_event.action.name
+    )
+    latency.record_dispatch(lutron_event)
     eventbus.get_bus().pub(
         '{}:{}'.format(lutron_event.bridge, lutron_event.device),
         lutron_event
     )
 
 
-def add_listeners_for_bridge(bridge_addr: str, config_map: typing.Dict) -> None:
+def get_mappings() -> typing.List[typing.Tuple[str, typing.Dict]]:
+    mappings = [(config.LUTRON_BRIDGE_ADDR, config.LUTRON_MAPPING)]
+
+    if (
+            getattr(config, 'LUTRON_BRIDGE2_ADDR', None) and
+            getattr(config, 'LUTRON2_MAPPING', None)
+    ):
+        mappings.append((config.LUTRON_BRIDGE2_ADDR, config.LUTRON2_MAPPING))
+
+    return mappings
+
+
+def get_lutron_bridges() -> typing.Dict[int, str]:
+    """The address of each Lutron bridge, by its number in the config."""
+
+    bridges = {1: config.LUTRON_BRIDGE_ADDR}
+
+    if getattr(config, 'LUTRON_BRIDGE2_ADDR', None):
+        bridges[2] = config.LUTRON_BRIDGE2_ADDR
+
+    return bridges
+
+
+def get_target_kinds() -> typing.List[str]:
+    """The kinds of target in the config, built-in ones first."""
+
+    kinds: typing.Dict[str, None] = {}
+
+    for _, config_map in get_mappings():
+        for subconfig in config_map.values():
+            kinds.update(dict.fromkeys(backends.get_kinds(subconfig)))
+
+    return backends.get_kinds(kinds)
+
+
+def get_backends() -> typing.Dict[str, backends.Backend]:
+    """The backend for each kind of target in the config."""
+
+    return {kind: backends.get_backend(kind) for kind in get_target_kinds()}
+
+
+def check_mappings() -> None:
+    """Raise ValueError if any action in the mappings can't be carried out,
+    and warn about mappings that trigger each other in a loop.
+    """
+
+    mappings = get_mappings()
+    bridges = get_lutron_bridges()
+    action_names = backends.get_hooks(get_backends(), 'ACTION_NAMES')
+
+    errors = analysis.check_actions(mappings, bridges, action_names)
+    if errors:
+        raise ValueError('Invalid mappings:\n  {}'.format('\n  '.join(errors)))
+
+    graph = analysis.build_graph(mappings, bridges)
+
+    for cycle in analysis.find_cycles(graph):
+        logger.warning(
+            'Mappings trigger each other in a loop: %s. Repeats are cut short by the '
+            'storm guard (LB_STORM_LIMIT)',
+            ' -> '.join(analysis.format_state(state) for state in cycle + cycle[:1])
+        )
+
+    fan_out = {
+        state: commands
+        for state, commands in analysis.fan_out(mappings, graph).items()
+        if commands is not None
+    }
+
+    for state, commands in sorted(fan_out.items()):
+        logger.debug('%s leads to at most %s commands', analysis.format_state(state), commands)
+
+    if fan_out:
+        worst = max(sorted(fan_out), key=lambda state: fan_out[state])
+        logger.info(
+            'Each event leads to at most %s commands (%s)',
+            fan_out[worst],
+            analysis.format_state(worst)
+        )
+
+
+def get_target_ids() -> typing.Set[typing.Tuple[str, typing.Any]]:
+    """The kind and ID of every target in the config."""
+
+    return {
+        (kind, target['id'])
+        for _, config_map in get_mappings()
+        for subconfig in config_map.values()
+        for kind, target in analysis.get_targets(subconfig)
+    }
+
+
+# (kind, id of target) -> its handler, so a target mapped to several devices
+# gets one handler
+Handlers = typing.Dict[typing.Tuple[str, int], typing.Callable]
+
+
+def get_target_name(kind: str, target: dict) -> str:
+    """Like bond:6409d2a2, or lutron:2:40 for a target on a second bridge."""
+
+    if target.get('bridge', 1) != 1:
+        return '{}:{}:{}'.format(kind, target['bridge'], target.get('id'))
+
+    return '{}:{}'.format(kind, target.get('id'))
+
+
+def get_handler(kind: str, target: dict, handlers: Handlers) -> typing.Callable:
+    try:
+        return handlers[kind, id(target)]
+    except KeyError:
+        handler: typing.Callable = latency.instrument(
+            get_target_name(kind, target),
+            backends.get_backend(kind).get_handler(target)
+        )
+        handlers[kind, id(target)] = handler
+        return handler
+
+
+def add_listeners_for_bridge(
+        bridge_addr: str,
+        config_map: typing.Dict,
+        bus: typing.Optional[eventbus.EventBus] = None,
+        handlers: typing.Optional[Handlers] = None
+) -> None:
+    if bus is None:
+        bus = eventbus.get_bus()
+
+    if handlers is None:
+        handlers = {}
+
     for lutron_id, subconfig in config_map.items():
         logger.debug(
             'Subscribing to %s:%s -> %s',
@@ -40,82 +225,286 @@ def add_listeners_for_bridge(bridge_addr: str, config_map: typing.Dict) -> None:
 
         key = '{}:{}'.format(bridge_addr, lutron_id)
 
-        if 'bond' in subconfig:
-            if type(subconfig['bond']) is list:
-                for config_item in subconfig['bond']:
-                    eventbus.get_bus().sub(key, bond.get_handler(config_item))
-            else:
-                eventbus.get_bus().sub(key, bond.get_handler(subconfig['bond']))
+        for kind in backends.get_kinds(subconfig):
+            config_items = subconfig[kind]
+            if type(config_items) is not list:
+                config_items = [config_items]
 
-        if 'tuya' in subconfig:
-            if type(subconfig['tuya']) is list:
-                for config_item in subconfig['tuya']:
-                    eventbus.get_bus().sub(key, tuya.get_handler(config_item))
-            else:
-                eventbus.get_bus().sub(key, tuya.get_handler(subconfig['tuya']))
+            for config_item in config_items:
+                bus.sub(
+                    key,
+                    get_handler(kind, config_item, handlers),
+                    get_target_name(kind, config_item)
+                )
 
-        if 'lutron' in subconfig:
-            if type(subconfig['lutron']) is list:
-                for config_item in subconfig['lutron']:
-                    eventbus.get_bus().sub(key, lutron.get_handler(config_item))
-            else:
-                eventbus.get_bus().sub(key, lutron.get_handler(subconfig['lutron']))
 
+def add_listeners(bus: typing.Optional[eventbus.EventBus] = None) -> None:
+    # Shared by both bridges, which can have targets in common
+    handlers: Handlers = {}
 
-def add_listeners() -> None:
-    add_listeners_for_bridge(config.LUTRON_BRIDGE_ADDR, config.LUTRON_MAPPING)
+    for bridge_addr, config_map in get_mappings():
+        add_listeners_for_bridge(bridge_addr, config_map, bus, handlers)
 
-    if (
-            getattr(config, 'LUTRON_BRIDGE2_ADDR', None) and
-            getattr(config, 'LUTRON2_MAPPING', None)
-    ):
-        add_listeners_for_bridge(config.LUTRON_BRIDGE2_ADDR, config.LUTRON2_MAPPING)
+
+def report_footprint() -> None:
+    used, unshared = flyweight.footprint(get_mappings())
+    MAPPING_BYTES.set(used)
+    logger.info(
+        'Mappings use %.1f KB of memory (%.1f KB without sharing)',
+        used / 1024,
+        unshared / 1024
+    )
 
 
-shutting_down: bool = False
+async def read_config() -> None:
+    """Re-read the mappings into config."""
+
+    if getattr(config, 'CONFIG_FILE', None):
+        # Checking and compiling a changed file is slow enough to hold up
+        # events, so it's done in a worker thread
+        mappings = await asyncio.to_thread(
+            configfile.load, config.CONFIG_FILE, config.CONFIG_CACHE_DIR
+        )
+        config.LUTRON_MAPPING = mappings['LUTRON_MAPPING']
+        config.LUTRON2_MAPPING = mappings['LUTRON2_MAPPING']
+    else:
+        importlib.reload(config)
+
+
+async def reload() -> bool:
+    """Re-read the mappings and switch the event bus over to them between two
+    events. Lutron connections and warm Bond and Tuya connections are kept.
+    Kinds of target mapped for the first time are warmed up before the switch
+    and started after it, and backends already started run their reload hook.
+    If the new config is rejected, backends with a checkpoint hook undo what
+    building its handlers kept.
+    Backends with a forget_device hook are told which of their targets were
+    removed, once the handlers that were running at the switch have finished.
+    """
+
+    async with reload_lock:
+        logger.info('Reloading config...')
+        saved = dict(vars(config))
+        target_ids = get_target_ids()
+        new_targets: typing.Dict[str, backends.Backend] = {}
+        rollbacks: typing.List[typing.Callable[[], None]] = []
+
+        try:
+            await read_config()
+            check_mappings()
+            mapped = get_backends()
+            new_targets = {
+                kind: backend
+                for kind, backend in mapped.items()
+                if kind not in targets
+            }
+            rollbacks = [
+                checkpoint()
+                for checkpoint in backends.get_hooks({**targets, **mapped}, 'checkpoint').values()
+            ]
+            new_bus = eventbus.EventBus()
+            add_listeners(new_bus)
+            await asyncio.gather(
+                warm_up(new_targets),
+                *[hook() for hook in backends.get_hooks(targets, 'reload').values()]
+            )
+        except Exception as e:
+            # Carry on with the config as it was
+            vars(config).update(saved)
+            for rollback in rollbacks:
+                rollback()
+            for close in backends.get_hooks(new_targets, 'close').values():
+                await close()
+            logger.error('Unable to reload config, keeping the current one: %s', e)
+            RELOADS.inc('failure')
+            return False
+
+        bus = eventbus.get_bus()
+        bus.replace(new_bus)
+        if new_targets:
+            start_targets(new_targets)
+            logger.info('Started handling %s targets', ', '.join(new_targets))
+        RELOADS.inc('success')
+        report_footprint()
+        logger.info(
+            'Reloaded config with %s mapped Lutron devices',
+            sum(len(config_map) for _, config_map in get_mappings())
+        )
+
+        removed = target_ids - get_target_ids()
+        forget = backends.get_hooks(
+            {kind: backends.get_backend(kind) for kind, _ in removed}, 'forget_device'
+        )
+        removed = {(kind, target_id) for kind, target_id in removed if kind in forget}
+
+        if removed:
+            await bus.await_running_handlers(return_exceptions=True)
+            for kind, target_id in sorted(removed):
+                forget[kind](target_id)
+            logger.info(
+                'Removed targets: %s',
+                ', '.join('{}:{}'.format(kind, target_id) for kind, target_id in sorted(removed))
+            )
+
+    return True
 
 
 async def shutdown() -> None:
+    """Stop handling new events, give the commands already on their way up to
+    SHUTDOWN_TIMEOUT seconds to finish, then close the Lutron connections,
+    which ends start(). Commands still running by then are cancelled.
+    """
+
     global shutting_down
+    if shutting_down:
+        return
+
     shutting_down = True
+    logger.info('Shutting down...')
+
+    cancelled = await eventbus.get_bus().drain(config.SHUTDOWN_TIMEOUT)
+    if cancelled:
+        logger.warning(
+            'Cancelled %s commands still running after %s seconds',
+            len(cancelled),
+            config.SHUTDOWN_TIMEOUT
+        )
+        for task, args in cancelled:
+            logger.warning(
+                'Cancelled command to %s for %s',
+                task.get_name(),
+                ', '.join(str(arg) for arg in args)
+            )
+        DROPPED.inc('command', amount=len(cancelled))
+
     for c in lutron.connections:
         await c.close()
     logger.info('Exiting...')
 
 
+async def open_connections() -> bool:
+    return all(await asyncio.gather(*[c.open() for c in lutron.connections]))
+
+
+async def stream(opened: asyncio.Event) -> None:
+    """Handle events from the Lutron bridges until shutdown, reconnecting
+    whenever a connection drops. `opened` is set once the first attempt to
+    open them is over.
+    """
+
+    try:
+        while not shutting_down:
+            try:
+                if opened.is_set():
+                    ready = await open_connections()
+                else:
+                    try:
+                        ready = await startup.timed('open lutron', open_connections())
+                    finally:
+                        opened.set()
+
+                if ready:
+                    await asyncio.gather(*[c.stream(handler) for c in lutron.connections])
+                else:
+                    break
+            except asyncio.exceptions.IncompleteReadError:
+                if not shutting_down:
+                    logger.warning('Connection closed unexpectedly. Retrying...')
+            finally:
+                await asyncio.gather(*[c.close() for c in lutron.connections])
+    finally:
+        opened.set()
+
+
+async def warm_up(targets: typing.Dict[str, backends.Backend]) -> None:
+    """Get targets ready for their first command, all at once."""
+
+    await asyncio.gather(*[
+        startup.timed('warm up {}'.format(kind), hook())
+        for kind, hook in backends.get_hooks(targets, 'warm_up').items()
+    ])
+
+
+def start_targets(new_targets: typing.Dict[str, backends.Backend]) -> None:
+    """Start the background work of backends that were not started yet."""
+
+    for start_background in backends.get_hooks(new_targets, 'start_background').values():
+        stop_background.append(start_background())
+
+    targets.update(new_targets)
+
+
+async def close_targets() -> None:
+    """Stop the background work of every started backend, then close them."""
+
+    for stop in reversed(stop_background):
+        stop()
+    stop_background.clear()
+
+    for close in backends.get_hooks(targets, 'close').values():
+        await close()
+    targets.clear()
+
+
 async def start() -> None:
     logger.info('Starting up...')
     loop = asyncio.get_running_loop()
+    profiler.install(loop)
     loop.add_signal_handler(
-        signal.SIGINT,
-        lambda: loop.create_task(shutdown())
+        signal.SIGHUP,
+        lambda: loop.create_task(reload())
     )
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(
+            signum,
+            lambda: loop.create_task(shutdown())
+        )
+
+    new_targets = get_backends()
 
-    await bond.verify_connection()
-    cancel_bond_keepalive = bond.keepalive()
+    with startup.phase('check config'):
+        check_mappings()
 
-    add_listeners()
+    # Undoes everything started below, in reverse order
+    cancels = [metrics.serve(), loopmonitor.start()]
+
+    with startup.phase('add listeners'):
+        add_listeners()
+    report_footprint()
+
+    start_targets(new_targets)
 
     lutron.get_default_lutron_connection()
 
     if (getattr(config, 'LUTRON_BRIDGE2_ADDR', None)):
         lutron.get_lutron_connection(config.LUTRON_BRIDGE2_ADDR)
 
-    while not shutting_down:
-        try:
-            if all(await asyncio.gather(*[c.open() for c in lutron.connections])):
-                await asyncio.gather(*[c.stream(handler) for c in lutron.connections])
-            else:
-                break
-        except asyncio.exceptions.IncompleteReadError:
-            if not shutting_down:
-                logger.warning('Connection closed unexpectedly. Retrying...')
-        finally:
-            await asyncio.gather(*[c.close() for c in lutron.connections])
+    # Events are handled as soon as the Lutron bridges are open, while the
+    # targets are still warming up
+    opened = asyncio.Event()
+    streaming = asyncio.create_task(stream(opened))
+
+    try:
+        await asyncio.gather(warm_up(new_targets), opened.wait())
+        startup.report()
+        await streaming
+    finally:
+        if not streaming.done():
+            # Startup failed, e.g. the Bond Bridge could not be reached
+            streaming.cancel()
+            await asyncio.gather(streaming, return_exceptions=True)
+
+        await close_targets()
+        for cancel in reversed(cancels):
+            cancel()
+
+        breaker.reset()
+        lutron.reset_connection_cache()
+        capture.close()
 
-    cancel_bond_keepalive()
-    lutron.reset_connection_cache()
+        if profiler.profile is not None:
+            profiler.stop_profiling()
 
 
 if __name__ == '__main__':
-    asyncio.run(start())
+    eventloop.run(start, loopmonitor.choose_loop(config.EVENT_LOOP))
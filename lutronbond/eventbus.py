@@ -3,11 +3,22 @@ from collections import defaultdict
 import functools
 import typing
 
+from . import metrics
+
+
+IN_FLIGHT = metrics.gauge(
+    'lutronbond_eventbus_inflight_handlers',
+    'Event handlers that have been started and not yet finished',
+)
+
 
 class EventBus:
     def __init__(self) -> None:
         self._bus: defaultdict = defaultdict(list)
-        self._running_handlers: typing.Set[typing.Awaitable[typing.Any]] = set()
+        # Handler -> name its tasks are given
+        self._names: typing.Dict[typing.Callable, str] = {}
+        # Running task -> the arguments it was published with
+        self._running_handlers: typing.Dict[asyncio.Task, tuple] = {}
 
     def pub(
             self,
@@ -19,19 +30,54 @@ class EventBus:
             return
 
         for action in self._bus[key]:
-            task = asyncio.create_task(action(*args, **kwargs))
-            self._running_handlers.add(task)
-            task.add_done_callback(self._running_handlers.discard)
+            task = asyncio.create_task(action(*args, **kwargs), name=self._names.get(action))
+            self._running_handlers[task] = args
+            IN_FLIGHT.inc()
+            task.add_done_callback(self._handler_done)
+
+    def _handler_done(self, task: asyncio.Task) -> None:
+        self._running_handlers.pop(task, None)
+        IN_FLIGHT.dec()
 
     def sub(
             self,
             key: typing.Hashable,
-            action: typing.Callable[[typing.Any], typing.Awaitable[typing.Any]]
+            action: typing.Callable[[typing.Any], typing.Awaitable[typing.Any]],
+            name: typing.Optional[str] = None
     ) -> None:
         self._bus[key].append(action)
+        if name is not None:
+            self._names[action] = name
+
+    def replace(self, other: 'EventBus') -> None:
+        """Take over the subscriptions of `other` in one step, so each event
+        is handled either entirely by the old ones or entirely by the new.
+        Handlers that are already running are left to finish.
+        """
+        self._bus = other._bus
+        self._names = other._names
+
+    async def await_running_handlers(self, return_exceptions: bool = False) -> None:
+        # Only the handlers running now, not any started while waiting
+        await asyncio.gather(*list(self._running_handlers), return_exceptions=return_exceptions)
+
+    async def drain(self, timeout: float) -> typing.List[typing.Tuple[asyncio.Task, tuple]]:
+        """Give the running handlers up to `timeout` seconds to finish, then
+        cancel the rest. Returns the cancelled tasks, each with the arguments
+        it was published with.
+        """
+
+        running = dict(self._running_handlers)
+        if not running:
+            return []
+
+        _, pending = await asyncio.wait(running, timeout=timeout)
+
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
 
-    async def await_running_handlers(self) -> None:
-        await asyncio.gather(*list(self._running_handlers))
+        return [(task, args) for task, args in running.items() if task in pending]
 
 
 @functools.cache
@@ -0,0 +1,72 @@
+"""Choosing the event loop implementation.
+
+uvloop, a replacement for asyncio's own loop built on libuv, is faster at
+socket I/O and scheduling callbacks, which shows most on small hosts like a
+Raspberry Pi. It is used when it is installed (pip install uvloop), and
+asyncio's loop otherwise. LB_EVENT_LOOP can ask for either one.
+"""
+import asyncio
+import logging
+import sys
+import typing
+
+
+LOOPS = ('auto', 'uvloop', 'asyncio')
+
+LoopFactory = typing.Callable[[], asyncio.AbstractEventLoop]
+T = typing.TypeVar('T')
+
+logger = logging.getLogger(__name__)
+
+
+def get_loop_factory(name: str = 'auto') -> typing.Tuple[str, LoopFactory]:
+    """The implementation `name` stands for, and what makes its loops."""
+
+    if name not in LOOPS:
+        raise ValueError('Unknown event loop: {} (use {})'.format(name, ', '.join(LOOPS)))
+
+    if name != 'asyncio':
+        try:
+            import uvloop  # type: ignore
+        except ImportError:
+            if name == 'uvloop':
+                raise ValueError('The uvloop event loop needs uvloop: pip install uvloop')
+        else:
+            return 'uvloop', uvloop.new_event_loop
+
+    return 'asyncio', asyncio.new_event_loop
+
+
+def current() -> str:
+    """The implementation of the running loop."""
+
+    module = type(asyncio.get_running_loop()).__module__
+    return 'uvloop' if module.split('.')[0] == 'uvloop' else 'asyncio'
+
+
+class LoopPolicy(asyncio.DefaultEventLoopPolicy):
+
+    def __init__(self, loop_factory: LoopFactory) -> None:
+        super().__init__()
+        self.loop_factory = loop_factory
+
+    def new_event_loop(self) -> asyncio.AbstractEventLoop:
+        return self.loop_factory()
+
+
+def run(main: typing.Callable[[], typing.Awaitable[T]], name: str = 'auto') -> T:
+    """Run `main()` to completion in a new loop of the implementation `name`."""
+
+    implementation, loop_factory = get_loop_factory(name)
+    logger.info('Using the %s event loop', implementation)
+
+    async def wrapper() -> T:
+        return await main()
+
+    if sys.version_info >= (3, 11):
+        with asyncio.Runner(loop_factory=loop_factory) as runner:
+            return runner.run(wrapper())
+
+    # Before 3.11, the loop can only be chosen through the policy
+    asyncio.set_event_loop_policy(LoopPolicy(loop_factory))
+    return asyncio.run(wrapper())
@@ -0,0 +1,82 @@
+"""Sharing the parts of the mappings that repeat.
+
+Many Lutron devices are mapped with the same action tables, and often to the
+same targets. `intern` makes every equal table the same object, so each one
+is kept in memory once however many devices use it, and the controller makes
+one handler per distinct target rather than one per mapping.
+
+Shared tables must not be changed in place, which nothing does once the
+mappings are loaded.
+"""
+import sys
+import typing
+
+
+# The first of each distinct dict and list seen, by its frozen contents
+Table = typing.Dict[typing.Hashable, typing.Any]
+
+
+def freeze(value: typing.Any) -> typing.Hashable:
+    """A hashable stand-in for `value`, equal only for equal values of the
+    same types. 1, 1.0 and True are all equal in Python, but not as actions.
+    """
+
+    if isinstance(value, dict):
+        return (dict, tuple((freeze(k), freeze(v)) for k, v in value.items()))
+    if isinstance(value, list):
+        return (list, tuple(freeze(v) for v in value))
+    return (type(value), value)
+
+
+def intern(value: typing.Any, table: typing.Optional[Table] = None) -> typing.Any:
+    """A copy of `value` in which equal dicts and lists are the same object,
+    shared with everything else interned with the same `table`.
+    """
+
+    if table is None:
+        table = {}
+
+    if isinstance(value, dict):
+        value = {k: intern(v, table) for k, v in value.items()}
+    elif isinstance(value, list):
+        value = [intern(v, table) for v in value]
+    else:
+        return value
+
+    return table.setdefault(freeze(value), value)
+
+
+def intern_all(*values: typing.Any) -> typing.Tuple[typing.Any, ...]:
+    """`intern` each of `values`, sharing between them too."""
+
+    table: Table = {}
+    return tuple(intern(value, table) for value in values)
+
+
+def footprint(value: typing.Any) -> typing.Tuple[int, int]:
+    """Bytes used by `value` and everything in it, counting shared objects
+    once, and what it would be if nothing were shared.
+    """
+
+    seen: typing.Set[int] = set()
+
+    def size(value: typing.Any) -> typing.Tuple[int, int]:
+        shared = id(value) in seen
+        seen.add(id(value))
+        total = own = sys.getsizeof(value)
+
+        if isinstance(value, dict):
+            children: typing.Iterable = [*value.keys(), *value.values()]
+        elif isinstance(value, (list, tuple)):
+            children = value
+        else:
+            children = []
+
+        for child in children:
+            child_size, child_total = size(child)
+            own += child_size
+            total += child_total
+
+        return (0 if shared else own), total
+
+    return size(value)
@@ -0,0 +1,80 @@
+"""Press-to-action latency, broken down by stage.
+
+Every `LutronEvent` carries the monotonic time it was read off the socket
+(`timestamp`) and the time it was handed to the event bus (`dispatched_at`).
+From those, each stage is recorded:
+
+    parse     line received -> event parsed           (per Lutron bridge)
+    dispatch  line received -> event published        (per Lutron bridge)
+    queue     event published -> handler running      (per target)
+    handler   handler running -> target acknowledged  (per target)
+    total     line received -> target acknowledged    (per target)
+
+The target stages are recorded by `instrument`, around every handler, so
+backends don't record anything themselves. A handler that returns False did
+not get through to its target, and only its queue time is recorded.
+"""
+import functools
+import time
+import typing
+
+from . import metrics
+
+if typing.TYPE_CHECKING:
+    from .backends import Handler
+    from .lutron import LutronEvent
+
+
+EVENT_LATENCY = metrics.latency_histogram(
+    'lutronbond_event_latency_seconds',
+    'Time spent by Lutron events in each stage before reaching a handler',
+    ['bridge', 'stage'],
+)
+HANDLER_LATENCY = metrics.latency_histogram(
+    'lutronbond_handler_latency_seconds',
+    'Time spent by Lutron events in each stage of a target handler',
+    ['target', 'stage'],
+)
+
+
+def record_parse(event: 'LutronEvent') -> None:
+    EVENT_LATENCY.observe(time.monotonic() - event.timestamp, event.bridge, 'parse')
+
+
+def record_dispatch(event: 'LutronEvent') -> None:
+    event.dispatched_at = time.monotonic()
+    EVENT_LATENCY.observe(event.dispatched_at - event.timestamp, event.bridge, 'dispatch')
+
+
+def record_queue(target: str, event: 'LutronEvent') -> None:
+    if event.dispatched_at is None:
+        return
+
+    HANDLER_LATENCY.observe(time.monotonic() - event.dispatched_at, target, 'queue')
+
+
+def record_handler(target: str, started: float) -> None:
+    HANDLER_LATENCY.observe(time.monotonic() - started, target, 'handler')
+
+
+def record_total(target: str, event: 'LutronEvent') -> None:
+    HANDLER_LATENCY.observe(time.monotonic() - event.timestamp, target, 'total')
+
+
+def instrument(target: str, handler: 'Handler') -> 'Handler':
+    """`handler`, recording its stages under `target`."""
+
+    @functools.wraps(handler)
+    async def instrumented(event: 'LutronEvent') -> bool:
+        record_queue(target, event)
+        started = time.monotonic()
+
+        result = await handler(event)
+
+        if result:
+            record_handler(target, started)
+            record_total(target, event)
+
+        return result
+
+    return instrumented
@@ -0,0 +1,103 @@
+"""Writing logs from a background thread.
+
+A write to stderr blocks when whatever reads it falls behind, as journald can
+under load, and a blocked write in the event loop holds up every button press.
+Instead, records are put on a queue in the loop and written out by a thread.
+
+With LB_LOG_FORMAT=json, each record is written as a JSON object on one line.
+Records about a Lutron event or command carry its fields under "lutron", so
+everything that happened to one button press can be picked out.
+"""
+import json
+import logging
+import logging.handlers
+import queue
+import typing
+
+
+FORMATS = ('text', 'json')
+
+
+def get_fields(record: logging.LogRecord) -> typing.Optional[typing.Dict[str, typing.Any]]:
+    """The fields of the first argument of `record` that has any."""
+
+    args = record.args if isinstance(record.args, tuple) else ()
+
+    for arg in args:
+        log_fields = getattr(arg, 'log_fields', None)
+        if log_fields is not None:
+            fields: typing.Dict[str, typing.Any] = log_fields()
+            return fields
+
+    return None
+
+
+class QueueHandler(logging.handlers.QueueHandler):
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # The arguments are dropped once the message is formatted
+        fields = get_fields(record)
+        prepared: logging.LogRecord = super().prepare(record)
+
+        if fields is not None:
+            setattr(prepared, 'lutron', fields)
+
+        return prepared
+
+
+class JSONFormatter(logging.Formatter):
+
+    def format(self, record: logging.LogRecord) -> str:
+        data: typing.Dict[str, typing.Any] = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+
+        if record.exc_info:
+            data['exception'] = self.formatException(record.exc_info)
+
+        # Records written without the queue still have their arguments
+        fields = getattr(record, 'lutron', None) or get_fields(record)
+        if fields is not None:
+            data['lutron'] = fields
+
+        return json.dumps(data, default=str)
+
+
+def get_formatter(log_format: str) -> logging.Formatter:
+    if log_format == 'text':
+        return logging.Formatter(logging.BASIC_FORMAT)
+    if log_format == 'json':
+        return JSONFormatter()
+    raise ValueError('Unknown log format: {} (use {})'.format(log_format, ', '.join(FORMATS)))
+
+
+def setup(
+        level: typing.Union[int, str],
+        log_format: str = 'text',
+        use_queue: bool = True,
+        stream: typing.Optional[typing.TextIO] = None
+) -> typing.Callable[[], None]:
+    """Send every log record to stderr (or `stream`), from a background
+    thread unless `use_queue` is False. Returns what writes out any records
+    still queued and stops the thread.
+    """
+
+    handler = logging.StreamHandler(stream)
+    handler.setFormatter(get_formatter(log_format))
+
+    root = logging.getLogger()
+    root.setLevel(level)
+
+    if not use_queue:
+        root.addHandler(handler)
+        return lambda: None
+
+    records: queue.SimpleQueue = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(records, handler)
+    root.addHandler(QueueHandler(records))
+    listener.start()
+
+    return listener.stop
@@ -0,0 +1,147 @@
+import asyncio
+import logging
+import time
+import typing
+
+from . import config
+from . import eventloop
+from . import metrics
+
+
+# Seconds between event loop lag samples
+SAMPLE_INTERVAL = 0.5
+
+LOOP_LAG = metrics.gauge(
+    'lutronbond_event_loop_lag_seconds',
+    'How late the most recent scheduled event loop wake-up ran',
+)
+LOOP_LAG_HISTOGRAM = metrics.latency_histogram(
+    'lutronbond_event_loop_lag_distribution_seconds',
+    'How late scheduled event loop wake-ups ran',
+)
+SLOW_CALLBACKS = metrics.counter(
+    'lutronbond_event_loop_slow_callbacks_total',
+    'Event loop callbacks that ran longer than LB_LOOP_MONITOR',
+)
+
+logger = logging.getLogger(__name__)
+
+
+def get_threshold() -> float:
+    """The slow callback threshold, in seconds."""
+
+    return config.LOOP_MONITOR / 1000
+
+
+def choose_loop(name: str) -> str:
+    """The event loop to run for LB_EVENT_LOOP `name`. uvloop runs callbacks
+    without `Handle._run`, so slow callbacks can only be found on asyncio's
+    loop, which `auto` picks while LB_LOOP_MONITOR is on.
+    """
+
+    if name == 'auto' and get_threshold():
+        return 'asyncio'
+
+    return name
+
+
+def describe(handle: asyncio.Handle) -> str:
+    callback = handle._callback  # type: ignore
+    task = getattr(callback, '__self__', None)
+
+    if not isinstance(task, asyncio.Task):
+        return repr(handle)
+
+    coro = task.get_coro()
+    description = 'task {} ({})'.format(
+        task.get_name(),
+        getattr(coro, '__qualname__', coro)
+    )
+
+    # A task that is still pending is suspended at the await that followed
+    # the blocking code, which is usually enough to find it.
+    frame = getattr(coro, 'cr_frame', None)
+    if frame is not None:
+        description += ' at {}:{}'.format(frame.f_code.co_filename, frame.f_lineno)
+
+    return description
+
+
+def install_slow_callback_detector(threshold: float) -> typing.Callable:
+    """Time every callback the event loop runs.
+
+    Every callback, including each step of every task, goes through
+    `Handle._run`, so wrapping it catches anything that blocks the loop. The
+    cost is two clock reads per callback, which is why this is opt-in.
+    """
+
+    original_run = asyncio.events.Handle._run
+
+    def _run(handle: asyncio.Handle) -> None:
+        start = time.perf_counter()
+        original_run(handle)
+        duration = time.perf_counter() - start
+
+        if duration >= threshold:
+            SLOW_CALLBACKS.inc()
+            logger.warning(
+                'Event loop blocked for %.1f ms by %s',
+                duration * 1000,
+                describe(handle)
+            )
+
+    asyncio.events.Handle._run = _run  # type: ignore
+
+    def uninstall() -> bool:
+        asyncio.events.Handle._run = original_run  # type: ignore
+        return True
+
+    return uninstall
+
+
+async def sample_lag() -> None:
+    loop = asyncio.get_running_loop()
+    threshold = get_threshold()
+
+    while True:
+        start = loop.time()
+        await asyncio.sleep(SAMPLE_INTERVAL)
+        lag = max(0.0, loop.time() - start - SAMPLE_INTERVAL)
+
+        LOOP_LAG.set(lag)
+        LOOP_LAG_HISTOGRAM.observe(lag)
+
+        if threshold and lag >= threshold:
+            logger.warning('Event loop lag of %.1f ms', lag * 1000)
+
+
+def start() -> typing.Callable:
+    threshold = get_threshold()
+
+    if not config.METRICS_PORT and not threshold:
+        return lambda: True
+
+    loop = asyncio.get_event_loop()
+    task = loop.create_task(sample_lag())
+
+    if not threshold:
+        return lambda: task.cancel()
+
+    if eventloop.current() == 'uvloop':
+        logger.warning(
+            'Slow callbacks cannot be detected on uvloop, so only event loop lag is '
+            'monitored. Set LB_EVENT_LOOP=asyncio to find them'
+        )
+        return lambda: task.cancel()
+
+    logger.info(
+        'Monitoring event loop for callbacks slower than %s ms',
+        config.LOOP_MONITOR
+    )
+    uninstall = install_slow_callback_detector(threshold)
+
+    def cancel() -> bool:
+        uninstall()
+        return task.cancel()
+
+    return cancel
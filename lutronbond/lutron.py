@@ -1,12 +1,18 @@
 from __future__ import annotations
 import asyncio
+import collections
 import enum
 import functools
 import logging
 import signal
+import time
 import typing
 
+from . import backends
+from . import capture
 from . import config
+from . import latency
+from . import metrics
 
 
 LOGIN_PROMPT = b'login: '
@@ -16,6 +22,25 @@ USERNAME = b'lutron'
 PASSWORD = b'integration'
 LINE_TERM = b'\r\n'
 
+# Settings of a Lutron target in the mappings
+KEYS: backends.Schema = {
+    'id': (True, (int,)),
+    'actions': (True, (dict,)),
+    'name': (False, (str,)),
+    'bridge': (False, (int,)),
+}
+
+RECONNECTS = metrics.counter(
+    'lutronbond_lutron_reconnects_total',
+    'Connections made to a Lutron bridge after the first',
+    ['bridge'],
+)
+STORM_SUPPRESSED = metrics.counter(
+    'lutronbond_lutron_storm_suppressed_total',
+    'Lutron commands not sent because they were repeating too quickly',
+    ['target'],
+)
+
 logger = logging.getLogger(__name__)
 
 
@@ -75,17 +100,25 @@ class LutronEvent:
             component: Component,
             action: Action,
             parameters: str,
-            bridge: str):
+            bridge: str,
+            timestamp: typing.Optional[float] = None):
         self.operation = operation
         self.device = device
         self.component = component
         self.action = action
         self.parameters = parameters
         self.bridge = bridge
+        # Monotonic time at which the event was received
+        self.timestamp = time.monotonic() if timestamp is None else timestamp
+        # Monotonic time at which the event was published to handlers
+        self.dispatched_at: typing.Optional[float] = None
 
     @classmethod
     def parse(cls, raw: bytes, bridge: str) -> LutronEvent:  # noqa: C901
-        logger.debug('Parsing: %s', raw)
+        # Debug logs on the path every event takes are checked for first, so
+        # they cost nothing when they are off
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug('Parsing: %s', raw)
 
         # Just good practice
         raw = raw.strip()
@@ -159,6 +192,19 @@ class LutronEvent:
             )
         )
 
+    def log_fields(self) -> typing.Dict[str, typing.Any]:
+        """The event as fields of a structured log record."""
+
+        return {
+            'type': self.__class__.__name__,
+            'bridge': self.bridge,
+            'operation': self.operation.name,
+            'device': self.device,
+            'component': self.component.name,
+            'action': self.action.name,
+            'parameters': self.parameters or None,
+        }
+
     def __str__(self) -> str:
         return (
             '{}(BRIDGE:{} {}:{} {}:{}:{})'.format(
@@ -206,6 +252,7 @@ class LutronConnection:
         self.port = port
         self.is_connected: bool = False
         self.is_logged_in: bool = False
+        self.connect_count = 0
         self._reader: asyncio.StreamReader
         self._writer: asyncio.StreamWriter
         self.logger = logger.getChild('LutronConnection<{}>'.format(self.host))
@@ -223,6 +270,11 @@ class LutronConnection:
         )
         self.is_connected = True
         self.logger.info('Connected to Lutron Bridge')
+
+        if self.connect_count:
+            RECONNECTS.inc(self.host)
+        self.connect_count += 1
+
         return True
 
     async def close(self) -> bool:
@@ -284,10 +336,16 @@ class LutronConnection:
             callback: typing.Callable[[LutronEvent], None]
     ) -> None:
         self.logger.info('Listening for events...')
+        capture_writer = capture.get_writer()
 
         while self.is_logged_in and self.is_connected:
             data = await self._reader.readuntil(LINE_TERM)
-            self.logger.debug('Got data: %s', data)
+            received = time.monotonic()
+            if self.logger.isEnabledFor(logging.DEBUG):
+                self.logger.debug('Got data: %s', data)
+
+            if capture_writer is not None:
+                capture_writer.write(self.host, data, received)
 
             try:
                 evt = LutronEvent.parse(data, self.host)
@@ -295,6 +353,8 @@ class LutronConnection:
                 self.logger.error('Error parsing event: %s', e)
                 continue
             else:
+                evt.timestamp = received
+                latency.record_parse(evt)
                 callback(evt)
 
     async def send(self, command: LutronCommand) -> None:
@@ -316,7 +376,7 @@ connections: typing.List[LutronConnection] = []
 
 @functools.cache
 def get_lutron_connection(host: str) -> LutronConnection:
-    c = LutronConnection(host, 23)
+    c = LutronConnection(host, config.LUTRON_BRIDGE_PORT)
     connections.append(c)
     return c
 
@@ -330,9 +390,36 @@ def reset_connection_cache() -> None:
     get_lutron_connection.cache_clear()
 
 
+# Command -> when it was recently sent
+recent_commands: typing.Dict[str, typing.Deque[float]] = {}
+
+
+def is_storm(command: LutronCommand) -> bool:
+    """Whether `command` was already sent STORM_LIMIT times in the last
+    STORM_WINDOW seconds. A person can't press buttons that fast, but mappings
+    that trigger each other in a loop can.
+    """
+
+    if not config.STORM_LIMIT:
+        return False
+
+    key = '{}:{}'.format(command.bridge, str(command).strip())
+    now = time.monotonic()
+    sent = recent_commands.setdefault(key, collections.deque())
+
+    while sent and now - sent[0] > config.STORM_WINDOW:
+        sent.popleft()
+
+    if len(sent) >= config.STORM_LIMIT:
+        return True
+
+    sent.append(now)
+    return False
+
+
 def get_handler(  # noqa: C901
         configmap: dict
-) -> typing.Callable[[LutronEvent], typing.Awaitable[bool]]:
+) -> backends.Handler:
 
     actions = configmap['actions']
 
@@ -347,28 +434,20 @@ def get_handler(  # noqa: C901
             raise ValueError('Unknown Lutron bridge: {}'.format(configmap['bridge']))
 
     integration_id = configmap['id']
+    target = 'lutron:{}:{}'.format(bridge_addr, integration_id)
 
     async def handler(event: LutronEvent) -> bool:
-        try:
-            component = actions[event.component.name]
-        except KeyError:
-            logger.warning('Unknown component: %s', event.component)
-            return False
-
-        try:
-            action = component[event.action.name]
-        except KeyError:
-            logger.warning('Unknown action: %s', event.action)
-            return False
-
-        if action is None:
+        # Output events are matched to their level below, as a Lutron action
+        # can also be the same for every level
+        declared = backends.resolve_action(actions, event, logger, by_level=False)
+        if declared is None:
             return False
 
         arg = None
-        if isinstance(action, dict):
-            action, arg = list(action.items())[0]
+        if isinstance(declared, dict):
+            action, arg = list(declared.items())[0]
         else:
-            raise ValueError('Invalid action declaration: {}'.format(action))
+            raise ValueError('Invalid action declaration: {}'.format(declared))
 
         # There are 4 cases that must be parsed slightly differently:
         #
@@ -409,7 +488,7 @@ def get_handler(  # noqa: C901
                 # Check if this is an OUTPUT event with an OUTPUT action
                 try:
                     try:
-                        action_spec = component[event.action.name][event.parameters]
+                        action_spec = declared[event.parameters]
                     except KeyError:
                         logger.warning(
                             'Action not specified in config: %s:%s',
@@ -445,9 +524,22 @@ def get_handler(  # noqa: C901
             bridge_addr
         )
 
-        logger.debug(
-            'Translated event into Lutron command: %s', lutron_command
-        )
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(
+                'Translated event into Lutron command: %s', lutron_command
+            )
+
+        if is_storm(lutron_command):
+            # Not sending it breaks the loop
+            logger.warning(
+                'Suppressing %s: sent %s times in %s seconds, so the mappings are '
+                'probably triggering each other',
+                str(lutron_command).strip(),
+                config.STORM_LIMIT,
+                config.STORM_WINDOW
+            )
+            STORM_SUPPRESSED.inc(target)
+            return False
 
         await get_lutron_connection(bridge_addr).send(lutron_command)
         return True
@@ -0,0 +1,442 @@
+import abc
+import asyncio
+import bisect
+from collections import defaultdict
+import logging
+import math
+import typing
+
+from . import config
+
+
+DEFAULT_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, float('inf')
+)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# The longest a client may take to send its request to the metrics endpoint
+REQUEST_TIMEOUT = 5
+
+Labels = typing.Tuple[str, ...]
+
+logger = logging.getLogger(__name__)
+
+
+class Metric(abc.ABC):
+    kind = 'untyped'
+
+    def __init__(
+            self,
+            name: str,
+            documentation: str,
+            labelnames: typing.Sequence[str] = ()
+    ) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+    @abc.abstractmethod
+    def reset(self) -> None:
+        ...
+
+    @abc.abstractmethod
+    def samples(self) -> typing.Iterator[str]:
+        ...
+
+    def render(self) -> typing.Iterator[str]:
+        yield '# HELP {} {}'.format(self.name, self.documentation)
+        yield '# TYPE {} {}'.format(self.name, self.kind)
+        yield from self.samples()
+
+
+class ValueMetric(Metric):
+    values: typing.Mapping[Labels, float]
+
+    def samples(self) -> typing.Iterator[str]:
+        for labelvalues, value in sorted(self.values.items()):
+            yield '{}{} {}'.format(
+                self.name,
+                format_labels(self.labelnames, labelvalues),
+                format_value(value)
+            )
+
+
+class BucketMetric(Metric):
+    buckets: typing.Tuple[float, ...]
+    sums: typing.Mapping[Labels, float]
+
+    @abc.abstractmethod
+    def cumulative(self, *labelvalues: str) -> typing.List[int]:
+        ...
+
+    def samples(self) -> typing.Iterator[str]:
+        labelnames = self.labelnames + ('le',)
+
+        for labelvalues in sorted(self.sums):
+            cumulative = self.cumulative(*labelvalues)
+
+            for bucket, count in zip(self.buckets, cumulative):
+                yield '{}_bucket{} {}'.format(
+                    self.name,
+                    format_labels(labelnames, labelvalues + (format_value(bucket),)),
+                    count
+                )
+
+            labels = format_labels(self.labelnames, labelvalues)
+            yield '{}_sum{} {}'.format(self.name, labels, format_value(self.sums[labelvalues]))
+            yield '{}_count{} {}'.format(self.name, labels, cumulative[-1])
+
+
+def format_value(value: float) -> str:
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+
+    if value == int(value):
+        return str(int(value))
+
+    return repr(value)
+
+
+def format_labels(
+        labelnames: typing.Sequence[str],
+        labelvalues: typing.Sequence[str]
+) -> str:
+    if not labelnames:
+        return ''
+
+    return '{{{}}}'.format(','.join(
+        '{}="{}"'.format(
+            name,
+            str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        )
+        for name, value in zip(labelnames, labelvalues)
+    ))
+
+
+class Counter(ValueMetric):
+    """A monotonically increasing value per label set.
+
+    Updates are plain dict operations on the event loop thread, so there is no
+    locking and the cost per increment is a hash lookup and an add.
+    """
+
+    kind = 'counter'
+
+    def __init__(
+            self,
+            name: str,
+            documentation: str,
+            labelnames: typing.Sequence[str] = ()
+    ) -> None:
+        super().__init__(name, documentation, labelnames)
+        self.values: typing.DefaultDict[Labels, float] = defaultdict(float)
+
+    def inc(self, *labelvalues: str, amount: float = 1.0) -> None:
+        self.values[labelvalues] += amount
+
+    def get(self, *labelvalues: str) -> float:
+        return self.values.get(labelvalues, 0.0)
+
+    def reset(self) -> None:
+        self.values.clear()
+
+
+class Gauge(ValueMetric):
+    kind = 'gauge'
+
+    def __init__(
+            self,
+            name: str,
+            documentation: str,
+            labelnames: typing.Sequence[str] = ()
+    ) -> None:
+        super().__init__(name, documentation, labelnames)
+        self.values: typing.Dict[Labels, float] = {}
+
+    def set(self, value: float, *labelvalues: str) -> None:
+        self.values[labelvalues] = value
+
+    def inc(self, *labelvalues: str, amount: float = 1.0) -> None:
+        self.values[labelvalues] = self.values.get(labelvalues, 0.0) + amount
+
+    def dec(self, *labelvalues: str, amount: float = 1.0) -> None:
+        self.inc(*labelvalues, amount=-amount)
+
+    def get(self, *labelvalues: str) -> float:
+        return self.values.get(labelvalues, 0.0)
+
+    def reset(self) -> None:
+        self.values.clear()
+
+
+class Histogram(BucketMetric):
+    kind = 'histogram'
+
+    def __init__(
+            self,
+            name: str,
+            documentation: str,
+            labelnames: typing.Sequence[str] = (),
+            buckets: typing.Sequence[float] = DEFAULT_BUCKETS
+    ) -> None:
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+        self.counts: typing.Dict[Labels, typing.List[int]] = {}
+        self.sums: typing.DefaultDict[Labels, float] = defaultdict(float)
+
+    def observe(self, value: float, *labelvalues: str) -> None:
+        try:
+            counts = self.counts[labelvalues]
+        except KeyError:
+            counts = self.counts[labelvalues] = [0] * len(self.buckets)
+
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sums[labelvalues] += value
+
+    def count(self, *labelvalues: str) -> int:
+        return sum(self.counts.get(labelvalues, ()))
+
+    def cumulative(self, *labelvalues: str) -> typing.List[int]:
+        result = list(self.counts.get(labelvalues, [0] * len(self.buckets)))
+
+        for i in range(1, len(result)):
+            result[i] += result[i - 1]
+
+        return result
+
+    def reset(self) -> None:
+        self.counts.clear()
+        self.sums.clear()
+
+
+class LatencyHistogram(BucketMetric):
+    """HDR-style histogram of durations, in seconds.
+
+    Values are recorded at microsecond resolution into log-linear buckets:
+    below `2 ** significant_bits` microseconds every value has its own bucket,
+    and above that each power of two is split into `2 ** (significant_bits - 1)`
+    buckets. The relative error of any percentile is therefore bounded by
+    `2 ** -(significant_bits - 1)` (about 3% by default) no matter how wide the
+    range of values is, while memory only grows with the number of distinct
+    buckets actually hit.
+    """
+
+    kind = 'histogram'
+    unit = 1e-6
+
+    def __init__(
+            self,
+            name: str,
+            documentation: str,
+            labelnames: typing.Sequence[str] = (),
+            significant_bits: int = 6,
+            buckets: typing.Sequence[float] = DEFAULT_BUCKETS
+    ) -> None:
+        super().__init__(name, documentation, labelnames)
+        self.sub_bucket_count = 1 << significant_bits
+        self.half_count = self.sub_bucket_count >> 1
+        self.significant_bits = significant_bits
+        # Only used to summarize the distribution for export
+        self.buckets = tuple(buckets)
+        self.counts: typing.Dict[Labels, typing.DefaultDict[int, int]] = {}
+        self.sums: typing.DefaultDict[Labels, float] = defaultdict(float)
+
+    def _index(self, value: int) -> int:
+        if value < self.sub_bucket_count:
+            return value
+
+        exponent = value.bit_length() - self.significant_bits
+        return (
+            self.sub_bucket_count +
+            (exponent - 1) * self.half_count +
+            (value >> exponent) - self.half_count
+        )
+
+    def _upper_bound(self, index: int) -> int:
+        """Largest value, in microseconds, that lands in the bucket."""
+
+        if index < self.sub_bucket_count:
+            return index
+
+        exponent, offset = divmod(index - self.sub_bucket_count, self.half_count)
+        exponent += 1
+        return ((offset + self.half_count + 1) << exponent) - 1
+
+    def observe(self, value: float, *labelvalues: str) -> None:
+        try:
+            counts = self.counts[labelvalues]
+        except KeyError:
+            counts = self.counts[labelvalues] = defaultdict(int)
+
+        counts[self._index(max(0, int(value / self.unit)))] += 1
+        self.sums[labelvalues] += value
+
+    def count(self, *labelvalues: str) -> int:
+        return sum(self.counts.get(labelvalues, {}).values())
+
+    def percentile(self, percent: float, *labelvalues: str) -> float:
+        counts = self.counts.get(labelvalues)
+        if not counts:
+            return 0.0
+
+        target = max(1, percent / 100 * sum(counts.values()))
+        seen = 0
+        for index in sorted(counts):
+            seen += counts[index]
+            if seen >= target:
+                break
+
+        return self._upper_bound(index) * self.unit
+
+    def cumulative(self, *labelvalues: str) -> typing.List[int]:
+        """Observation counts at or below each of `self.buckets`."""
+
+        counts: typing.Mapping[int, int] = self.counts.get(labelvalues, {})
+        result = [0] * len(self.buckets)
+
+        for index, count in counts.items():
+            value = self._upper_bound(index) * self.unit
+            result[bisect.bisect_left(self.buckets, value)] += count
+
+        for i in range(1, len(result)):
+            result[i] += result[i - 1]
+
+        return result
+
+    def reset(self) -> None:
+        self.counts.clear()
+        self.sums.clear()
+
+
+registry: typing.Dict[str, Metric] = {}
+
+M = typing.TypeVar('M', bound=Metric)
+
+
+def register(metric: M) -> M:
+    if metric.name in registry:
+        raise ValueError('Duplicate metric: {}'.format(metric.name))
+
+    registry[metric.name] = metric
+    return metric
+
+
+def counter(
+        name: str,
+        documentation: str,
+        labelnames: typing.Sequence[str] = ()
+) -> Counter:
+    return register(Counter(name, documentation, labelnames))
+
+
+def gauge(
+        name: str,
+        documentation: str,
+        labelnames: typing.Sequence[str] = ()
+) -> Gauge:
+    return register(Gauge(name, documentation, labelnames))
+
+
+def histogram(
+        name: str,
+        documentation: str,
+        labelnames: typing.Sequence[str] = (),
+        buckets: typing.Sequence[float] = DEFAULT_BUCKETS
+) -> Histogram:
+    return register(Histogram(name, documentation, labelnames, buckets))
+
+
+def latency_histogram(
+        name: str,
+        documentation: str,
+        labelnames: typing.Sequence[str] = ()
+) -> LatencyHistogram:
+    return register(LatencyHistogram(name, documentation, labelnames))
+
+
+def reset() -> None:
+    for metric in registry.values():
+        metric.reset()
+
+
+def render() -> str:
+    lines: typing.List[str] = []
+
+    for metric in registry.values():
+        lines.extend(metric.render())
+
+    lines.append('')
+    return '\n'.join(lines)
+
+
+async def read_request(reader: asyncio.StreamReader) -> bytes:
+    request_line = await reader.readline()
+
+    # Discard the headers. Nothing in them changes the response.
+    while (await reader.readline()).strip():
+        pass
+
+    return request_line
+
+
+async def handle_request(
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter
+) -> None:
+    try:
+        request_line = await asyncio.wait_for(read_request(reader), REQUEST_TIMEOUT)
+
+        try:
+            method, path, _ = request_line.decode('ascii').split(' ', 2)
+        except ValueError:
+            status, body = '400 Bad Request', ''
+        else:
+            if method != 'GET':
+                status, body = '405 Method Not Allowed', ''
+            elif path.split('?', 1)[0] != '/metrics':
+                status, body = '404 Not Found', ''
+            else:
+                status, body = '200 OK', render()
+
+        payload = body.encode('utf-8')
+        writer.write(
+            'HTTP/1.1 {}\r\n'
+            'Content-Type: {}\r\n'
+            'Content-Length: {}\r\n'
+            'Connection: close\r\n'
+            '\r\n'.format(status, CONTENT_TYPE, len(payload)).encode('ascii')
+        )
+        writer.write(payload)
+        await writer.drain()
+    except asyncio.TimeoutError:
+        logger.debug('Metrics request timed out')
+    except (ConnectionError, asyncio.IncompleteReadError) as e:
+        logger.debug('Metrics request failed: %r', e)
+    finally:
+        writer.close()
+
+
+def serve() -> typing.Callable:
+    if not config.METRICS_PORT:
+        return lambda: True
+
+    async def run() -> None:
+        server = await asyncio.start_server(
+            handle_request,
+            config.METRICS_ADDR,
+            config.METRICS_PORT
+        )
+        logger.info(
+            'Serving metrics on http://%s:%s/metrics',
+            config.METRICS_ADDR,
+            config.METRICS_PORT
+        )
+
+        async with server:
+            await server.serve_forever()
+
+    loop = asyncio.get_event_loop()
+    task = loop.create_task(run())
+
+    return lambda: task.cancel()
@@ -0,0 +1,62 @@
+import asyncio
+import cProfile
+import logging
+import os
+import signal
+import time
+import typing
+
+from . import config
+
+
+logger = logging.getLogger(__name__)
+
+profile: typing.Optional[cProfile.Profile] = None
+
+
+def start_profiling() -> bool:
+    """Profile everything run on the event loop thread until stopped.
+
+    Work offloaded to other threads (e.g. Tuya requests) is not included.
+    """
+
+    global profile
+
+    if profile is not None:
+        logger.warning('Profiler is already running')
+        return False
+
+    profile = cProfile.Profile()
+    profile.enable()
+    logger.info('Profiler started')
+    return True
+
+
+def stop_profiling() -> typing.Optional[str]:
+    global profile
+
+    if profile is None:
+        logger.warning('Profiler is not running')
+        return None
+
+    profile.disable()
+    path = os.path.join(
+        config.PROFILE_DIR,
+        'lutronbond-{}.prof'.format(time.strftime('%Y%m%d-%H%M%S'))
+    )
+
+    try:
+        profile.dump_stats(path)
+    except OSError as e:
+        logger.error('Could not write profile to %s: %r', path, e)
+        return None
+    finally:
+        profile = None
+
+    logger.info('Profiler stopped. Results written to %s', path)
+    return path
+
+
+def install(loop: asyncio.AbstractEventLoop) -> None:
+    loop.add_signal_handler(signal.SIGUSR1, start_profiling)
+    loop.add_signal_handler(signal.SIGUSR2, stop_profiling)
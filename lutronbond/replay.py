@@ -0,0 +1,242 @@
+"""Replay captured Lutron bridge traffic through the controller.
+
+Lines recorded with LB_CAPTURE_FILE are parsed and handled as if they had just
+been read off the bridge, at the speed they were captured, some multiple of
+it, or as fast as possible. Targets are either the ones in the config (point
+it at the stand-ins in lutronbond.sim rather than real devices) or, with
+--stub, replaced with no-ops that just count commands.
+
+Run with `python -m lutronbond.replay --help`.
+"""
+import argparse
+import asyncio
+import collections
+import logging
+import sys
+import threading
+import time
+import typing
+
+from . import bond
+from . import capture
+from . import config
+from . import controller
+from . import eventbus
+from . import lutron
+from . import tuya
+
+
+logger = logging.getLogger(__name__)
+
+
+def parse_speed(value: str) -> typing.Optional[float]:
+    if value == 'max':
+        return None
+
+    speed = float(value)
+    if speed <= 0:
+        raise argparse.ArgumentTypeError('Speed must be positive, or "max"')
+    return speed
+
+
+def parse_bridge(value: str) -> typing.Tuple[str, str]:
+    captured, _, replayed = value.partition('=')
+    if not captured or not replayed:
+        raise argparse.ArgumentTypeError('Expected CAPTURED=REPLAYED, got {}'.format(value))
+    return captured, replayed
+
+
+def get_bridge_addrs() -> typing.List[str]:
+    addrs = [config.LUTRON_BRIDGE_ADDR]
+    if getattr(config, 'LUTRON_BRIDGE2_ADDR', None):
+        addrs.append(config.LUTRON_BRIDGE2_ADDR)
+    return addrs
+
+
+def stub_targets() -> typing.Counter[str]:
+    """Replace every target with a no-op. Returns the count of commands to
+    each kind of target, which is updated as they are sent.
+    """
+
+    commands: typing.Counter[str] = collections.Counter()
+    # Tuya requests run in worker threads
+    lock = threading.Lock()
+
+    async def bond_action(device_id: str, action: typing.Any) -> None:
+        commands['bond'] += 1
+
+    def tuya_action() -> typing.Dict:
+        with lock:
+            commands['tuya'] += 1
+        return {}
+
+    async def lutron_send(command: lutron.LutronCommand) -> None:
+        commands['lutron'] += 1
+
+    for bridge in bond.get_bridges():
+        bond.get_bridge_connection(bridge).action = bond_action
+    # Which bridge a device is on makes no difference once they are all no-ops
+    bond.inventory_ready.set()
+
+    # Devices are created along with their handlers
+    for device in tuya.devices.values():
+        for method_name in tuya.ACTIONS.values():
+            setattr(device, method_name, tuya_action)
+
+    for addr in get_bridge_addrs():
+        lutron.get_lutron_connection(addr).send = lutron_send  # type: ignore
+
+    return commands
+
+
+async def replay(
+        records: typing.Iterable[capture.Record],
+        speed: typing.Optional[float] = 1.0,
+        max_gap: typing.Optional[float] = None,
+        bridges: typing.Optional[typing.Dict[str, str]] = None
+) -> typing.Dict[str, typing.Any]:
+    """Hand every captured line to the controller, keeping the gaps between
+    them divided by `speed` (or none at all if `speed` is None), and wait for
+    the resulting handlers to finish.
+    """
+
+    bridges = bridges or {}
+    known_bridges = set(get_bridge_addrs())
+    unknown_bridges: typing.Set[str] = set()
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    cpu_start = time.process_time()
+    # Seconds into the capture of the current line
+    offset = 0.0
+    previous: typing.Optional[float] = None
+    lines = events = unparsed = 0
+
+    for record in records:
+        if previous is not None:
+            # The clock starts over whenever the program was restarted
+            gap = max(0.0, record.timestamp - previous)
+            offset += gap if max_gap is None else min(gap, max_gap)
+        previous = record.timestamp
+
+        if speed is None:
+            # Still let the handlers run as we go
+            await asyncio.sleep(0)
+        else:
+            await asyncio.sleep(max(0.0, start + offset / speed - loop.time()))
+
+        lines += 1
+        bridge = bridges.get(record.bridge, record.bridge)
+
+        if bridge not in known_bridges and bridge not in unknown_bridges:
+            logger.warning(
+                'Captured bridge %s is not in the config. Use --bridge to map it to one that is',
+                bridge
+            )
+            unknown_bridges.add(bridge)
+
+        try:
+            event = lutron.LutronEvent.parse(record.data, bridge)
+        except ValueError as e:
+            logger.debug('Skipping captured line: %s', e)
+            unparsed += 1
+            continue
+
+        controller.handler(event)
+        events += 1
+
+    await eventbus.get_bus().await_running_handlers()
+    elapsed = loop.time() - start
+
+    return {
+        'lines': lines,
+        'events': events,
+        'unparsed': unparsed,
+        'captured_seconds': offset,
+        'elapsed_seconds': elapsed,
+        'cpu_seconds': time.process_time() - cpu_start,
+    }
+
+
+def parse_args(argv: typing.Optional[typing.Sequence[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('capture', help='A file written with LB_CAPTURE_FILE')
+    parser.add_argument(
+        '--speed', type=parse_speed, default=1.0,
+        help='Multiple of the captured speed, or "max" for no gaps at all (default: 1)'
+    )
+    parser.add_argument(
+        '--max-gap', type=float,
+        help='Cap the time between two lines to this many captured seconds'
+    )
+    parser.add_argument(
+        '--bridge', type=parse_bridge, action='append', default=[],
+        metavar='CAPTURED=REPLAYED',
+        help='Replay lines captured from one Lutron bridge address as another'
+    )
+    parser.add_argument(
+        '--stub', action='store_true',
+        help='Count commands instead of sending them to the configured targets'
+    )
+    parser.add_argument(
+        '--storm-limit', type=int, default=0,
+        help='Same as LB_STORM_LIMIT. Replays sped up or of repeated presses '
+        'would trip it, so it is off by default (default: 0)'
+    )
+    parser.add_argument('--log-level', default='WARNING')
+    return parser.parse_args(argv)
+
+
+async def main(argv: typing.Optional[typing.Sequence[str]] = None) -> int:
+    args = parse_args(argv)
+    logging.basicConfig(level=args.log_level)
+    config.STORM_LIMIT = args.storm_limit
+
+    controller.add_listeners()
+    targets = controller.get_backends()
+
+    commands: typing.Optional[typing.Counter[str]] = None
+
+    try:
+        if args.stub:
+            commands = stub_targets()
+            # Closed on exit like the real ones, but nothing is started
+            controller.targets.update(targets)
+        else:
+            for addr in get_bridge_addrs():
+                lutron.get_lutron_connection(addr)
+            # As at startup, e.g. so Bond commands go to the right bridge
+            controller.start_targets(targets)
+            opened, _ = await asyncio.gather(
+                controller.open_connections(),
+                controller.warm_up(targets)
+            )
+            if not opened:
+                logger.error('Unable to log in to the Lutron bridge')
+                return 1
+
+        result = await replay(
+            capture.read(args.capture),
+            args.speed,
+            args.max_gap,
+            dict(args.bridge)
+        )
+    finally:
+        await asyncio.gather(*[c.close() for c in lutron.connections])
+        await controller.close_targets()
+        lutron.reset_connection_cache()
+
+    print(
+        'Replayed {lines} lines ({events} events, {unparsed} unparsed) spanning '
+        '{captured_seconds:.1f}s in {elapsed_seconds:.1f}s, '
+        'using {cpu_seconds:.1f}s of CPU'.format(**result)
+    )
+    if commands is not None:
+        print('Commands: {}'.format(', '.join(
+            '{} {}'.format(count, kind) for kind, count in sorted(commands.items())
+        ) or 'none'))
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(asyncio.run(main()))
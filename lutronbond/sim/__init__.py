@@ -0,0 +1,5 @@
+"""Stand-ins for the devices lutronbond talks to, for testing without hardware.
+
+These deliberately do not import the rest of the package (or its config), so
+they can run standalone and don't share the protocol code they are testing.
+"""
@@ -0,0 +1,349 @@
+"""A stand-in for the Bond Bridge local HTTP API.
+
+Run standalone with `python -m lutronbond.sim.bond --help`.
+"""
+from __future__ import annotations
+import argparse
+import asyncio
+import json
+import logging
+import math
+import random
+import time
+import typing
+
+from aiohttp import web
+
+
+DEFAULT_TOKEN = 'simtoken'
+
+# How each action changes device state, as (state key, value). A value of
+# None means the action's argument is used.
+ACTION_STATE: typing.Dict[str, typing.Tuple[str, typing.Any]] = {
+    'TurnOn': ('power', 1),
+    'TurnOff': ('power', 0),
+    'TurnLightOn': ('light', 1),
+    'TurnLightOff': ('light', 0),
+    'SetSpeed': ('speed', None),
+    'SetBrightness': ('brightness', None),
+    'SetDirection': ('direction', None),
+    'Open': ('open', 1),
+    'Close': ('open', 0),
+}
+
+Latency = typing.Callable[[random.Random], float]
+
+logger = logging.getLogger(__name__)
+
+
+def constant(seconds: float) -> Latency:
+    return lambda rng: seconds
+
+
+def uniform(low: float, high: float) -> Latency:
+    return lambda rng: rng.uniform(low, high)
+
+
+def lognormal(median: float, sigma: float) -> Latency:
+    """Mostly close to `median`, with a long tail, like a real Wi-Fi device."""
+
+    if median <= 0:
+        return constant(0.0)
+
+    mu = math.log(median)
+    return lambda rng: rng.lognormvariate(mu, sigma)
+
+
+def parse_latency(spec: str) -> Latency:
+    """Parse `0.05`, `uniform:0.01,0.1` or `lognormal:0.05,0.5`."""
+
+    kind, _, args = spec.partition(':')
+    if not args:
+        return constant(float(kind))
+
+    params = [float(a) for a in args.split(',')]
+    if kind == 'uniform':
+        return uniform(*params)
+    if kind == 'lognormal':
+        return lognormal(*params)
+
+    raise ValueError('Unknown latency distribution: {}'.format(kind))
+
+
+class Faults:
+    """Misbehavior to inject into requests, as a fraction of requests."""
+
+    def __init__(
+            self,
+            latency: Latency = constant(0.0),
+            reset_rate: float = 0.0,
+            error_rate: float = 0.0
+    ) -> None:
+        self.latency = latency
+        self.reset_rate = reset_rate
+        self.error_rate = error_rate
+
+
+class RecordedRequest:
+
+    def __init__(self, sequence: int, method: str, path: str, arrived: float) -> None:
+        self.sequence = sequence
+        self.method = method
+        self.path = path
+        # Monotonic times
+        self.arrived = arrived
+        self.completed: typing.Optional[float] = None
+        self.body: typing.Any = None
+        # None if the connection was reset instead of answered, in which
+        # case `completed` is None as well
+        self.status: typing.Optional[int] = None
+
+    def __repr__(self) -> str:
+        return '<RecordedRequest #{} {} {} {}>'.format(
+            self.sequence, self.method, self.path, self.status
+        )
+
+
+def make_devices(count: int) -> typing.Dict[str, typing.Dict]:
+    return {
+        'sim{:04d}'.format(i): {
+            'name': 'Fan {}'.format(i),
+            'type': 'CF',
+            'location': 'Room {}'.format(i),
+            'actions': sorted(ACTION_STATE),
+        }
+        for i in range(1, count + 1)
+    }
+
+
+class BondSimulator:
+
+    def __init__(
+            self,
+            host: str = '127.0.0.1',
+            port: int = 0,
+            token: str = DEFAULT_TOKEN,
+            devices: typing.Optional[typing.Dict[str, typing.Dict]] = None,
+            concurrency: int = 0,
+            faults: typing.Optional[Faults] = None,
+            seed: typing.Optional[int] = None
+    ) -> None:
+        """`concurrency` limits how many requests are worked on at once (0
+        for no limit); the rest wait their turn, like on the real bridge.
+        """
+
+        self.host = host
+        self.port = port
+        self.token = token
+        self.devices = make_devices(4) if devices is None else devices
+        self.state: typing.Dict[str, typing.Dict[str, typing.Any]] = {
+            device_id: {'power': 0, 'light': 0, 'speed': 1, 'direction': 1}
+            for device_id in self.devices
+        }
+        self.faults = faults or Faults()
+        self.random = random.Random(seed)
+        self.requests: typing.List[RecordedRequest] = []
+        self._semaphore = asyncio.Semaphore(concurrency) if concurrency else None
+        self._runner: typing.Optional[web.AppRunner] = None
+
+        self.app = web.Application(middlewares=[self.middleware])
+        self.app.add_routes([
+            web.get('/v2/sys/version', self.version),
+            web.get('/v2/devices', self.list_devices),
+            web.get('/v2/devices/{device_id}', self.device),
+            web.get('/v2/devices/{device_id}/properties', self.properties),
+            web.get('/v2/devices/{device_id}/state', self.get_state),
+            web.patch('/v2/devices/{device_id}/state', self.patch_state),
+            web.put('/v2/devices/{device_id}/actions/{action}', self.action),
+        ])
+
+    @property
+    def address(self) -> str:
+        """What to use as the Bond Bridge address."""
+
+        return '{}:{}'.format(self.host, self.port)
+
+    async def start(self) -> None:
+        self._runner = web.AppRunner(self.app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        self.port = self._runner.addresses[0][1]
+        logger.info('Simulated Bond Bridge listening on %s', self.address)
+
+    async def close(self) -> None:
+        if self._runner:
+            await self._runner.cleanup()
+
+    async def __aenter__(self) -> BondSimulator:
+        await self.start()
+        return self
+
+    async def __aexit__(self, *args: typing.Any) -> None:
+        await self.close()
+
+    def actions(self, device_id: typing.Optional[str] = None) -> typing.List[RecordedRequest]:
+        """Action requests that were answered successfully, in arrival order."""
+
+        return [
+            r for r in self.requests
+            if r.method == 'PUT' and r.status == 200 and '/actions/' in r.path and (
+                device_id is None or r.path.split('/')[3] == device_id
+            )
+        ]
+
+    @web.middleware
+    async def middleware(
+            self,
+            request: web.Request,
+            handler: typing.Callable[[web.Request], typing.Awaitable[web.StreamResponse]]
+    ) -> web.StreamResponse:
+        record = RecordedRequest(
+            len(self.requests) + 1,
+            request.method,
+            request.path,
+            time.monotonic()
+        )
+        self.requests.append(record)
+
+        if request.can_read_body:
+            try:
+                record.body = await request.json()
+            except json.JSONDecodeError:
+                record.body = await request.text()
+
+        if self._semaphore:
+            async with self._semaphore:
+                response = await self.respond(request, handler, record)
+        else:
+            response = await self.respond(request, handler, record)
+
+        record.completed = time.monotonic()
+        return response
+
+    async def respond(
+            self,
+            request: web.Request,
+            handler: typing.Callable[[web.Request], typing.Awaitable[web.StreamResponse]],
+            record: RecordedRequest
+    ) -> web.StreamResponse:
+        delay = self.faults.latency(self.random)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+        if self.random.random() < self.faults.reset_rate:
+            if request.transport:
+                request.transport.abort()
+            raise asyncio.CancelledError()
+
+        if self.random.random() < self.faults.error_rate:
+            response: web.StreamResponse = web.json_response({'_error_msg': 'sim'}, status=500)
+        elif request.headers.get('BOND-Token') != self.token:
+            response = web.json_response({'_error_msg': 'Unauthorized'}, status=401)
+        else:
+            try:
+                response = await handler(request)
+            except web.HTTPException as e:
+                record.status = e.status
+                raise
+
+        record.status = response.status
+        return response
+
+    def get_device_id(self, request: web.Request) -> str:
+        device_id = request.match_info['device_id']
+        if device_id not in self.devices:
+            raise web.HTTPNotFound()
+        return device_id
+
+    async def version(self, request: web.Request) -> web.Response:
+        return web.json_response({
+            'target': 'sim',
+            'make': 'Olibra',
+            'model': 'BD-SIM',
+            'fw_ver': 'v3.0.0-sim',
+            'bondid': 'ZZSIM{}'.format(self.port),
+            'api': 2,
+        })
+
+    async def list_devices(self, request: web.Request) -> web.Response:
+        result: typing.Dict[str, typing.Any] = {'_': 'sim'}
+        result.update({device_id: {'_': 'sim'} for device_id in self.devices})
+        return web.json_response(result)
+
+    async def device(self, request: web.Request) -> web.Response:
+        return web.json_response(self.devices[self.get_device_id(request)])
+
+    async def properties(self, request: web.Request) -> web.Response:
+        self.get_device_id(request)
+        return web.json_response({'max_speed': 6})
+
+    async def get_state(self, request: web.Request) -> web.Response:
+        return web.json_response(self.state[self.get_device_id(request)])
+
+    async def patch_state(self, request: web.Request) -> web.Response:
+        device_id = self.get_device_id(request)
+        self.state[device_id].update(await request.json())
+        return web.json_response({})
+
+    async def action(self, request: web.Request) -> web.Response:
+        device_id = self.get_device_id(request)
+        action = request.match_info['action']
+
+        if action not in self.devices[device_id].get('actions', ACTION_STATE):
+            raise web.HTTPBadRequest()
+
+        if action in ACTION_STATE:
+            key, value = ACTION_STATE[action]
+            if value is None:
+                value = (await request.json() or {}).get('argument')
+            self.state[device_id][key] = value
+
+            if action == 'SetSpeed':
+                self.state[device_id]['power'] = 1
+
+        return web.json_response({})
+
+
+def parse_args(argv: typing.Optional[typing.Sequence[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--token', default=DEFAULT_TOKEN)
+    parser.add_argument('--devices', type=int, default=4, help='Number of devices')
+    parser.add_argument('--concurrency', type=int, default=0, help='Requests at once')
+    parser.add_argument(
+        '--latency', type=parse_latency, default=constant(0.0),
+        help='e.g. 0.05, uniform:0.01,0.1 or lognormal:0.05,0.5 (seconds)'
+    )
+    parser.add_argument('--reset-rate', type=float, default=0.0, help='Fraction reset')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction failed')
+    parser.add_argument('--seed', type=int)
+    return parser.parse_args(argv)
+
+
+async def main() -> None:
+    logging.basicConfig(level=logging.INFO)
+    args = parse_args()
+
+    simulator = BondSimulator(
+        args.host,
+        args.port,
+        token=args.token,
+        devices=make_devices(args.devices),
+        concurrency=args.concurrency,
+        seed=args.seed,
+        faults=Faults(
+            latency=args.latency,
+            reset_rate=args.reset_rate,
+            error_rate=args.error_rate
+        )
+    )
+
+    async with simulator:
+        logger.info('Devices: %s', ', '.join(simulator.devices))
+        await asyncio.Event().wait()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,311 @@
+"""A stand-in for a Lutron Caseta SmartBridge Pro telnet integration server.
+
+Run standalone with `python -m lutronbond.sim.lutron --help`.
+"""
+from __future__ import annotations
+import argparse
+import asyncio
+import logging
+import random
+import time
+import typing
+
+
+LOGIN_PROMPT = b'login: '
+PASSWORD_PROMPT = b'password: '
+READY_PROMPT = b'GNET> '
+USERNAME = b'lutron'
+PASSWORD = b'integration'
+LINE_TERM = b'\r\n'
+
+# Pico remote button 1 press and release
+DEFAULT_EVENTS = ('~DEVICE,5,2,3', '~DEVICE,5,2,4')
+
+logger = logging.getLogger(__name__)
+
+
+class Faults:
+    """Misbehavior to inject into every connection.
+
+    `disconnect_after` and `half_open_after` count the events sent on a
+    connection. A half-open connection stays open but the server never sends
+    or reads anything on it again, like a bridge that lost power mid-stream.
+    """
+
+    def __init__(
+            self,
+            disconnect_after: typing.Optional[int] = None,
+            half_open_after: typing.Optional[int] = None,
+            read_delay: float = 0.0,
+            chunk_delay: float = 0.0,
+            reject_login: bool = False
+    ) -> None:
+        self.disconnect_after = disconnect_after
+        self.half_open_after = half_open_after
+        self.read_delay = read_delay
+        self.chunk_delay = chunk_delay
+        self.reject_login = reject_login
+
+
+class Client:
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self.reader = reader
+        self.writer = writer
+        self.lock = asyncio.Lock()
+        self.events_sent = 0
+        self.half_open = False
+        self.closed = False
+
+
+class LutronSimulator:
+
+    def __init__(
+            self,
+            host: str = '127.0.0.1',
+            port: int = 0,
+            events: typing.Sequence[str] = DEFAULT_EVENTS,
+            rate: float = 0.0,
+            count: typing.Optional[int] = None,
+            max_chunk: int = 0,
+            faults: typing.Optional[Faults] = None,
+            seed: typing.Optional[int] = None
+    ) -> None:
+        """`rate` is events per second streamed to each logged-in client
+        (0 for none, use `emit`), up to `count` events per connection.
+        Event and response lines are split into writes of 1 to `max_chunk`
+        bytes (0 to not split), the way a busy bridge's lines arrive in
+        pieces. Login prompts are always sent whole.
+        """
+
+        self.host = host
+        self.port = port
+        self.events = [e.encode('ascii') for e in events]
+        self.rate = rate
+        self.count = count
+        self.max_chunk = max_chunk
+        self.faults = faults or Faults()
+        self.random = random.Random(seed)
+        self.clients: typing.List[Client] = []
+        self.connection_count = 0
+        # Monotonic send time and line of every event sent
+        self.sent: typing.List[typing.Tuple[float, bytes]] = []
+        # Monotonic receive time and line of every command received
+        self.commands: typing.List[typing.Tuple[float, bytes]] = []
+        self.output_levels: typing.Dict[int, str] = {}
+        self._server: typing.Optional[asyncio.AbstractServer] = None
+        self._tasks: typing.Set[asyncio.Task] = set()
+        self._half_open: typing.List[Client] = []
+
+    async def start(self) -> None:
+        self._server = await asyncio.start_server(self.handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        logger.info('Simulated Lutron bridge listening on %s:%s', self.host, self.port)
+
+    async def close(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+
+        for client in self.clients + self._half_open:
+            client.writer.close()
+
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+
+    async def __aenter__(self) -> LutronSimulator:
+        await self.start()
+        return self
+
+    async def __aexit__(self, *args: typing.Any) -> None:
+        await self.close()
+
+    def chunks(self, data: bytes) -> typing.Iterator[bytes]:
+        if not self.max_chunk:
+            yield data
+            return
+
+        while data:
+            size = self.random.randint(1, self.max_chunk)
+            yield data[:size]
+            data = data[size:]
+
+    async def write(self, client: Client, data: bytes, chunked: bool = True) -> None:
+        async with client.lock:
+            if client.closed or client.half_open:
+                return
+
+            for chunk in self.chunks(data) if chunked else [data]:
+                client.writer.write(chunk)
+                await client.writer.drain()
+
+                if self.faults.chunk_delay:
+                    await asyncio.sleep(self.faults.chunk_delay)
+
+    async def send_event(self, client: Client, line: bytes) -> None:
+        if client.closed or client.half_open:
+            return
+
+        self.sent.append((time.monotonic(), line))
+        await self.write(client, line + LINE_TERM)
+        client.events_sent += 1
+
+        if client.events_sent == self.faults.disconnect_after:
+            logger.info('Fault: disconnecting client')
+            client.closed = True
+            client.writer.close()
+        elif client.events_sent == self.faults.half_open_after:
+            logger.info('Fault: leaving client connection half-open')
+            client.half_open = True
+
+    async def emit(self, line: str) -> None:
+        """Send an event to every logged-in client now."""
+
+        await asyncio.gather(*[
+            self.send_event(client, line.encode('ascii')) for client in self.clients
+        ])
+
+    async def login(self, client: Client) -> bool:
+        await self.write(client, LOGIN_PROMPT, chunked=False)
+        username = (await client.reader.readuntil(LINE_TERM)).strip()
+        await self.write(client, PASSWORD_PROMPT, chunked=False)
+        password = (await client.reader.readuntil(LINE_TERM)).strip()
+
+        if self.faults.reject_login or (username, password) != (USERNAME, PASSWORD):
+            await self.write(client, b'bad login' + LINE_TERM, chunked=False)
+            return False
+
+        await self.write(client, READY_PROMPT, chunked=False)
+        return True
+
+    def respond(self, command: bytes) -> bytes:
+        parts = command.strip().split(b',')
+        operation = parts[0]
+
+        if operation == b'#OUTPUT' and len(parts) >= 4:
+            self.output_levels[int(parts[1])] = parts[3].decode('ascii')
+            return b'~' + command[1:]
+
+        if operation == b'?OUTPUT' and len(parts) >= 3:
+            level = self.output_levels.get(int(parts[1]), '0.00')
+            return b'~OUTPUT,' + parts[1] + b',' + parts[2] + b',' + level.encode('ascii')
+
+        if operation == b'#DEVICE' and len(parts) >= 4:
+            return b'~' + command[1:]
+
+        return b'~ERROR,1'
+
+    async def read_commands(self, client: Client) -> None:
+        while not client.closed:
+            if self.faults.read_delay:
+                await asyncio.sleep(self.faults.read_delay)
+
+            command = (await client.reader.readuntil(LINE_TERM)).strip()
+
+            if client.closed or client.half_open:
+                return
+
+            self.commands.append((time.monotonic(), command))
+
+            try:
+                response = self.respond(command)
+            except ValueError:
+                response = b'~ERROR,1'
+
+            # The bridge echoes a prompt after every response, so the next
+            # line the client reads starts with it.
+            await self.write(client, response + LINE_TERM + READY_PROMPT)
+
+    async def stream_events(self, client: Client) -> None:
+        loop = asyncio.get_running_loop()
+        interval = 1 / self.rate
+        start = loop.time()
+        sent = 0
+
+        while not client.closed and not client.half_open:
+            if self.count is not None and sent >= self.count:
+                return
+
+            sent += 1
+            # Scheduled from the start time so the rate doesn't drift
+            await asyncio.sleep(max(0.0, start + sent * interval - loop.time()))
+            await self.send_event(client, self.events[(sent - 1) % len(self.events)])
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        client = Client(reader, writer)
+        self.connection_count += 1
+        logger.info('Client connected (%s total)', self.connection_count)
+
+        try:
+            if not await self.login(client):
+                return
+
+            self.clients.append(client)
+
+            if self.rate and self.events:
+                task = asyncio.create_task(self.stream_events(client))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+
+            await self.read_commands(client)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            logger.info('Client disconnected')
+        finally:
+            if client in self.clients:
+                self.clients.remove(client)
+
+            if client.half_open:
+                # Left open until the server is closed
+                self._half_open.append(client)
+            else:
+                client.closed = True
+                writer.close()
+
+
+def parse_args(argv: typing.Optional[typing.Sequence[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=2323)
+    parser.add_argument(
+        '--event', action='append', dest='events',
+        help='Event line to stream, e.g. ~DEVICE,5,2,3 (repeatable)'
+    )
+    parser.add_argument('--rate', type=float, default=1.0, help='Events per second')
+    parser.add_argument('--count', type=int, help='Events per connection')
+    parser.add_argument('--max-chunk', type=int, default=0, help='Largest write, in bytes')
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--disconnect-after', type=int, help='Events before disconnecting')
+    parser.add_argument('--half-open-after', type=int, help='Events before going silent')
+    parser.add_argument('--read-delay', type=float, default=0.0, help='Seconds per read')
+    parser.add_argument('--chunk-delay', type=float, default=0.0, help='Seconds per write')
+    parser.add_argument('--reject-login', action='store_true')
+    return parser.parse_args(argv)
+
+
+async def main() -> None:
+    logging.basicConfig(level=logging.INFO)
+    args = parse_args()
+
+    simulator = LutronSimulator(
+        args.host,
+        args.port,
+        events=args.events or DEFAULT_EVENTS,
+        rate=args.rate,
+        count=args.count,
+        max_chunk=args.max_chunk,
+        seed=args.seed,
+        faults=Faults(
+            disconnect_after=args.disconnect_after,
+            half_open_after=args.half_open_after,
+            read_delay=args.read_delay,
+            chunk_delay=args.chunk_delay,
+            reject_login=args.reject_login
+        )
+    )
+
+    async with simulator:
+        await asyncio.Event().wait()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
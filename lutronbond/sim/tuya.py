@@ -0,0 +1,277 @@
+"""An emulator for Tuya smart plugs speaking the 3.1 or 3.3 local protocol.
+
+Every virtual device listens on its own address, so many can be run in one
+process by giving each a different loopback address (127.0.0.2, 127.0.0.3...)
+on the standard port.
+
+Run standalone with `python -m lutronbond.sim.tuya --help`.
+"""
+from __future__ import annotations
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import struct
+import time
+import typing
+
+import tinytuya  # type: ignore
+
+
+HEADER_SIZE = struct.calcsize(tinytuya.MESSAGE_HEADER_FMT)
+
+logger = logging.getLogger(__name__)
+
+
+class VirtualDevice:
+
+    def __init__(
+            self,
+            dev_id: str,
+            local_key: str,
+            version: float = 3.3,
+            address: str = '127.0.0.1',
+            port: int = tinytuya.TCPPORT,
+            dps: typing.Optional[typing.Dict[str, typing.Any]] = None
+    ) -> None:
+        if version not in (3.1, 3.3):
+            raise ValueError('Unsupported Tuya protocol version: {}'.format(version))
+
+        self.id = dev_id
+        self.key = local_key.encode('latin1')
+        self.version = version
+        self.address = address
+        self.port = port
+        self.dps = {'1': False} if dps is None else dps
+        # Seconds to wait before answering each request, like a device with
+        # a weak Wi-Fi signal
+        self.response_delay = 0.0
+        # Accept connections but never answer, like a hung device
+        self.silent = False
+        # Monotonic receive time, command and decoded payload of every request
+        self.requests: typing.List[typing.Tuple[float, int, typing.Any]] = []
+        self._writers: typing.Set[asyncio.StreamWriter] = set()
+        self._server: typing.Optional[asyncio.AbstractServer] = None
+        self._seqno = 0
+
+    @property
+    def config(self) -> typing.Dict[str, typing.Any]:
+        """A tuya config entry that points at this device."""
+
+        return {
+            'id': self.id,
+            'addr': self.address,
+            'port': self.port,
+            'key': self.key.decode('latin1'),
+            'version': self.version,
+        }
+
+    async def start(self) -> None:
+        self._server = await asyncio.start_server(self.handle, self.address, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        logger.info('Virtual Tuya device %s listening on %s:%s', self.id, self.address, self.port)
+
+    async def stop(self) -> None:
+        """Stop listening and drop all connections, like a device losing power."""
+
+        for writer in list(self._writers):
+            writer.close()
+
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    def decode(self, msg: tinytuya.TuyaMessage) -> typing.Any:
+        payload = msg.payload
+        cipher = tinytuya.AESCipher(self.key)
+
+        if payload.startswith(tinytuya.PROTOCOL_VERSION_BYTES_31):
+            # 3.1 CONTROL: version, 16 bytes of MD5 hex digest, base64 data
+            payload = cipher.decrypt(payload[len(tinytuya.PROTOCOL_VERSION_BYTES_31) + 16:])
+        elif self.version == 3.3:
+            if payload.startswith(tinytuya.PROTOCOL_33_HEADER):
+                payload = payload[len(tinytuya.PROTOCOL_33_HEADER):]
+            payload = cipher.decrypt(payload, False)
+
+        return json.loads(payload) if payload else None
+
+    def encode(self, cmd: int, data: typing.Optional[typing.Dict] = None) -> bytes:
+        payload = b''
+
+        if data is not None:
+            payload = json.dumps(data, separators=(',', ':')).encode('utf-8')
+            cipher = tinytuya.AESCipher(self.key)
+
+            if self.version == 3.3:
+                payload = cipher.encrypt(payload, False)
+                if cmd not in tinytuya.NO_PROTOCOL_HEADER_CMDS:
+                    payload = tinytuya.PROTOCOL_33_HEADER + payload
+            elif cmd == tinytuya.STATUS:
+                payload = cipher.encrypt(payload)
+                digest = hashlib.md5(
+                    b'data=' + payload + b'||lpv=' + tinytuya.PROTOCOL_VERSION_BYTES_31 +
+                    b'||' + self.key
+                ).hexdigest()
+                payload = (
+                    tinytuya.PROTOCOL_VERSION_BYTES_31 +
+                    digest[8:][:16].encode('latin1') +
+                    payload
+                )
+
+        self._seqno += 1
+        # Messages from a device carry a return code ahead of the payload
+        frame: bytes = tinytuya.pack_message(tinytuya.TuyaMessage(
+            self._seqno, cmd, 0, struct.pack(tinytuya.MESSAGE_RETCODE_FMT, 0) + payload, 0
+        ))
+        return frame
+
+    def status(self) -> typing.Dict[str, typing.Any]:
+        return {'devId': self.id, 'dps': dict(self.dps), 't': int(time.time())}
+
+    async def push(self, dps: typing.Optional[typing.Dict[str, typing.Any]] = None) -> None:
+        """Send a status frame to every connected client."""
+
+        if dps:
+            self.dps.update(dps)
+
+        frame = self.encode(tinytuya.STATUS, self.status())
+        for writer in list(self._writers):
+            writer.write(frame)
+            await writer.drain()
+
+    async def read_message(self, reader: asyncio.StreamReader) -> tinytuya.TuyaMessage:
+        header = await reader.readexactly(HEADER_SIZE)
+        _, _, _, length = struct.unpack(tinytuya.MESSAGE_HEADER_FMT, header)
+        body = await reader.readexactly(length)
+        return tinytuya.unpack_message(header + body, no_retcode=True)
+
+    async def respond(self, msg: tinytuya.TuyaMessage, writer: asyncio.StreamWriter) -> None:
+        data = self.decode(msg)
+        self.requests.append((time.monotonic(), msg.cmd, data))
+
+        if self.silent:
+            return
+
+        if self.response_delay:
+            await asyncio.sleep(self.response_delay)
+
+        if msg.cmd in (tinytuya.CONTROL, tinytuya.CONTROL_NEW):
+            # An empty acknowledgement, then the new state to everyone
+            writer.write(self.encode(msg.cmd))
+            await writer.drain()
+            await self.push((data or {}).get('dps'))
+        elif msg.cmd in (tinytuya.DP_QUERY, tinytuya.DP_QUERY_NEW):
+            writer.write(self.encode(msg.cmd, self.status()))
+            await writer.drain()
+        else:
+            writer.write(self.encode(msg.cmd))
+            await writer.drain()
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self._writers.add(writer)
+
+        try:
+            while True:
+                msg = await self.read_message(reader)
+                await self.respond(msg, writer)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        except (ValueError, tinytuya.DecodeError) as e:
+            logger.warning('Virtual Tuya device %s got a bad request: %r', self.id, e)
+        finally:
+            self._writers.discard(writer)
+            writer.close()
+
+
+class TuyaEmulator:
+
+    def __init__(self, devices: typing.Iterable[VirtualDevice]) -> None:
+        self.devices = {device.id: device for device in devices}
+
+    async def start(self) -> None:
+        await asyncio.gather(*[device.start() for device in self.devices.values()])
+
+    async def close(self) -> None:
+        await asyncio.gather(*[device.stop() for device in self.devices.values()])
+
+    async def __aenter__(self) -> TuyaEmulator:
+        await self.start()
+        return self
+
+    async def __aexit__(self, *args: typing.Any) -> None:
+        await self.close()
+
+
+def devices_from_mapping(mapping: typing.Dict) -> typing.List[VirtualDevice]:
+    """Virtual devices for every Tuya device in a LUTRON_MAPPING."""
+
+    result = {}
+
+    for subconfig in mapping.values():
+        entries = subconfig.get('tuya', [])
+        for entry in entries if isinstance(entries, list) else [entries]:
+            result[entry['id']] = VirtualDevice(
+                entry['id'],
+                entry['key'],
+                float(entry['version']),
+                entry['addr'],
+                entry.get('port', tinytuya.TCPPORT)
+            )
+
+    return list(result.values())
+
+
+def make_devices(count: int, version: float = 3.3) -> typing.List[VirtualDevice]:
+    """`count` devices on 127.0.0.2, 127.0.0.3 and so on."""
+
+    return [
+        VirtualDevice(
+            'simtuya{:04d}'.format(i),
+            '{:016d}'.format(i),
+            version,
+            '127.0.{}.{}'.format(*divmod(i + 1, 256))
+        )
+        for i in range(1, count + 1)
+    ]
+
+
+def parse_args(argv: typing.Optional[typing.Sequence[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        '--from-config', action='store_true',
+        help='Emulate the Tuya devices in the lutronbond config (needs LB_* set)'
+    )
+    parser.add_argument('--devices', type=int, default=1, help='Number of devices')
+    parser.add_argument('--version', type=float, default=3.3, choices=(3.1, 3.3))
+    parser.add_argument('--port', type=int, default=tinytuya.TCPPORT)
+    parser.add_argument('--response-delay', type=float, default=0.0, help='Seconds')
+    return parser.parse_args(argv)
+
+
+async def main() -> None:
+    logging.basicConfig(level=logging.INFO)
+    args = parse_args()
+
+    if args.from_config:
+        from .. import config
+
+        devices = devices_from_mapping(config.LUTRON_MAPPING)
+        devices += devices_from_mapping(getattr(config, 'LUTRON2_MAPPING', {}))
+    else:
+        devices = make_devices(args.devices, args.version)
+        for device in devices:
+            device.port = args.port
+
+    for device in devices:
+        device.response_delay = args.response_delay
+
+    async with TuyaEmulator(devices):
+        for device in devices:
+            logger.info('Device config: %s', device.config)
+        await asyncio.Event().wait()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
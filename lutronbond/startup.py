@@ -0,0 +1,78 @@
+"""Where the time and memory taken by startup go.
+
+Each part of startup is wrapped in `phase`, and `report` logs the breakdown
+once the program is ready to handle events. Phases can overlap, so the total
+is the time from the start of the first phase to the report. Memory is the
+growth in peak resident set size, which is mostly what imports cost.
+"""
+import contextlib
+import logging
+import resource
+import sys
+import time
+import typing
+
+from . import metrics
+
+
+STARTUP_SECONDS = metrics.gauge(
+    'lutronbond_startup_seconds',
+    'Time taken by each phase of startup',
+    ['phase'],
+)
+
+T = typing.TypeVar('T')
+
+logger = logging.getLogger(__name__)
+
+# Name, seconds and peak RSS growth in megabytes of each finished phase
+phases: typing.List[typing.Tuple[str, float, float]] = []
+# When the first phase started
+started: typing.Optional[float] = None
+
+
+def peak_rss_mb() -> float:
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return rss / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+
+@contextlib.contextmanager
+def phase(name: str) -> typing.Iterator[None]:
+    global started
+
+    rss = peak_rss_mb()
+    start = time.perf_counter()
+    if started is None:
+        started = start
+
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        phases.append((name, elapsed, peak_rss_mb() - rss))
+        STARTUP_SECONDS.set(elapsed, name)
+
+
+async def timed(name: str, awaitable: typing.Awaitable[T]) -> T:
+    with phase(name):
+        return await awaitable
+
+
+def report() -> None:
+    logger.info(
+        'Started in %.0f ms with %.1f MB peak RSS: %s',
+        (time.perf_counter() - (started or time.perf_counter())) * 1000,
+        peak_rss_mb(),
+        ', '.join(
+            '{} {:.0f} ms (+{:.1f} MB)'.format(name, elapsed * 1000, rss)
+            for name, elapsed, rss in phases
+        ) or 'no phases recorded'
+    )
+
+
+def reset() -> None:
+    global started
+
+    phases.clear()
+    started = None
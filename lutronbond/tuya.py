@@ -1,71 +1,344 @@
 import asyncio
+import json
 import logging
+import os
 import typing
 
 import tinytuya  # type: ignore
 
-from . import config, lutron
+from . import backends, breaker, config, lutron, metrics
 
 
 logger = logging.getLogger(__name__)
 
+# Settings of a Tuya target in the mappings
+KEYS: backends.Schema = {
+    'id': (True, (str,)),
+    'key': (True, (str,)),
+    'addr': (True, (str,)),
+    'version': (True, (int, float, str)),
+    'actions': (True, (dict,)),
+    'name': (False, (str,)),
+    'port': (False, (int,)),
+}
+
 ACTIONS = {
     'TurnOn': 'turn_on',
     'TurnOff': 'turn_off',
 }
+ACTION_NAMES = frozenset(ACTIONS)
+
+# Tuya devices announce themselves on these UDP ports every few seconds.
+# Protocol 3.1 devices broadcast in plaintext on 6666, while 3.3 devices
+# encrypt their broadcasts and use 6667.
+DISCOVERY_PORTS = (tinytuya.UDPPORT, tinytuya.UDPPORTS)
+
+# Error codes meaning the device could not be reached at all, as opposed to
+# the device rejecting the request
+UNREACHABLE_ERRORS = {
+    str(tinytuya.ERR_CONNECT),
+    str(tinytuya.ERR_TIMEOUT),
+    str(tinytuya.ERR_OFFLINE),
+}
+
+ACTION_FAILURES = metrics.counter(
+    'lutronbond_tuya_action_failures_total',
+    'Tuya requests that failed, by reason',
+    ['device', 'reason'],
+)
+
+# Device ID -> last IP address seen in a discovery broadcast
+device_addresses: typing.Dict[str, str] = {}
+# Whether device_addresses has been read from TUYA_ADDRESS_CACHE yet
+address_cache_loaded = False
+
+# Device ID -> shared device instance
+devices: typing.Dict[str, tinytuya.OutletDevice] = {}
+
+# Device ID -> the settings its shared instance was created with
+device_settings: typing.Dict[str, typing.Tuple] = {}
+
+
+def compile_target(target: dict) -> dict:
+    # Config files can give the protocol version as a string, like "3.3"
+    return dict(target, version=float(target['version']))
+
+
+def get_settings(configmap: dict) -> typing.Tuple:
+    return (configmap['addr'], configmap['key'], configmap['version'], configmap.get('port'))
+
+
+def get_device(configmap: dict) -> tinytuya.OutletDevice:
+    dev_id = configmap['id']
+    settings = get_settings(configmap)
+
+    if dev_id in devices:
+        if device_settings.get(dev_id, settings) == settings:
+            return devices[dev_id]
+
+        # The config was reloaded with new settings for this device
+        forget_device(dev_id)
+
+    if config.TUYA_DISCOVERY:
+        # Handlers are built before discovery starts, and a device should
+        # start out where it was last seen rather than at its configured address
+        load_address_cache()
+
+    device = tinytuya.OutletDevice(
+        dev_id=dev_id,
+        address=device_addresses.get(dev_id, configmap['addr']),
+        local_key=configmap['key'],
+        version=configmap['version']
+    )
+    device.port = configmap.get('port', device.port)
+    device.set_socketRetryLimit(config.TUYA_RETRY_COUNT)
+    device.set_socketTimeout(config.TUYA_CONNECTION_TIMEOUT)
+
+    devices[dev_id] = device
+    device_settings[dev_id] = settings
+    return device
+
+
+def forget_device(dev_id: str) -> None:
+    """Drop the shared instance of a device that is no longer in the config.
+    Handlers that already have it keep working.
+    """
+
+    devices.pop(dev_id, None)
+    device_settings.pop(dev_id, None)
+    breaker.remove('tuya:{}'.format(dev_id))
+
+
+def checkpoint() -> typing.Callable[[], None]:
+    """Note the shared devices, returning what goes back to them. Devices
+    added or replaced since lose their breaker, as its probe is bound to them.
+    """
 
+    saved_devices = dict(devices)
+    saved_settings = dict(device_settings)
 
-def is_output_event(event: lutron.LutronEvent) -> bool:
-    return (
-        event.operation.name == "OUTPUT" and
-        event.component.name == "ANY" and
-        event.action.name == "SET_LEVEL"
+    def rollback() -> None:
+        for dev_id, device in devices.items():
+            if saved_devices.get(dev_id) is not device:
+                breaker.remove('tuya:{}'.format(dev_id))
+
+        devices.clear()
+        devices.update(saved_devices)
+        device_settings.clear()
+        device_settings.update(saved_settings)
+
+    return rollback
+
+
+def reset_device_cache() -> None:
+    devices.clear()
+    device_settings.clear()
+
+
+async def close() -> None:
+    # Requests abandoned at shutdown may still be running in worker threads,
+    # and closing their sockets makes them give up rather than retry
+    for device in devices.values():
+        device.close()
+
+    reset_device_cache()
+
+
+async def probe_device(device: tinytuya.OutletDevice) -> None:
+    _, writer = await asyncio.open_connection(device.address, device.port)
+    writer.close()
+    await writer.wait_closed()
+
+
+async def warm_up() -> None:
+    """Connect to every device once, so the first command to each doesn't also
+    wait on address resolution, and unreachable devices show up at startup.
+
+    tinytuya opens a new connection for every request, so there is no
+    connection to keep.
+    """
+
+    async def probe(dev_id: str, device: tinytuya.OutletDevice) -> None:
+        try:
+            await asyncio.wait_for(probe_device(device), config.TUYA_CONNECTION_TIMEOUT)
+        except (OSError, asyncio.TimeoutError) as e:
+            logger.warning('Tuya device %s at %s is unreachable: %r', dev_id, device.address, e)
+
+    await asyncio.gather(*[probe(dev_id, device) for dev_id, device in devices.items()])
+
+
+def get_device_breaker(
+        dev_id: str,
+        device: tinytuya.OutletDevice
+) -> breaker.CircuitBreaker:
+    return breaker.get_breaker(
+        'tuya:{}'.format(dev_id),
+        lambda: probe_device(device)
     )
 
 
-def get_handler(  # noqa: C901
-        configmap: dict
-) -> typing.Callable[[lutron.LutronEvent], typing.Awaitable[bool]]:
+def parse_broadcast(data: bytes) -> typing.Dict[str, typing.Any]:
+    # Strip the 20 byte header (prefix, seqno, cmd, length, retcode) and the
+    # 8 byte footer (crc, suffix).
+    payload = data[20:-8]
+
+    try:
+        decoded = tinytuya.decrypt_udp(payload)
+    except Exception:
+        try:
+            decoded = payload.decode()
+        except UnicodeDecodeError:
+            raise ValueError('Undecodable broadcast: {!r}'.format(data))
+
+    try:
+        result = json.loads(decoded)
+    except json.JSONDecodeError:
+        raise ValueError('Invalid broadcast: {!r}'.format(decoded))
+
+    if not isinstance(result, dict) or 'gwId' not in result or 'ip' not in result:
+        raise ValueError('Incomplete broadcast: {!r}'.format(result))
+
+    return result
+
+
+def load_address_cache() -> None:
+    global address_cache_loaded
+    if address_cache_loaded:
+        return
+
+    address_cache_loaded = True
 
     try:
-        device = tinytuya.OutletDevice(
-            dev_id=configmap['id'],
-            address=configmap['addr'],
-            local_key=configmap['key'],
-            version=configmap['version']
+        with open(config.TUYA_ADDRESS_CACHE) as f:
+            cached = json.load(f)
+    except FileNotFoundError:
+        return
+    except (OSError, json.JSONDecodeError) as e:
+        logger.warning('Unable to read Tuya address cache: %s', e)
+        return
+
+    device_addresses.update(cached)
+    logger.debug('Loaded %s Tuya addresses from cache', len(cached))
+
+
+def save_address_cache() -> None:
+    tmp = '{}.tmp'.format(config.TUYA_ADDRESS_CACHE)
+
+    try:
+        with open(tmp, 'w') as f:
+            json.dump(device_addresses, f, indent=2, sort_keys=True)
+        os.replace(tmp, config.TUYA_ADDRESS_CACHE)
+    except OSError as e:
+        logger.warning('Unable to write Tuya address cache: %s', e)
+
+
+def update_address(dev_id: str, address: str) -> bool:
+    """Move the device to `address` if it is somewhere else. Returns whether
+    the address is new to the cache.
+    """
+
+    device = devices.get(dev_id)
+    # Checked against the device itself, which may still be on its configured
+    # address when the cache already has the new one
+    if device is not None and device.address != address:
+        logger.info(
+            'Tuya device %s moved from %s to %s',
+            dev_id,
+            device.address,
+            address
         )
+        device.address = address
+
+    if device_addresses.get(dev_id) == address:
+        return False
+
+    device_addresses[dev_id] = address
+    save_address_cache()
+    return True
+
+
+class DiscoveryProtocol(asyncio.DatagramProtocol):
+
+    def datagram_received(self, data: bytes, addr: typing.Tuple[str, int]) -> None:
+        try:
+            broadcast = parse_broadcast(data)
+        except ValueError as e:
+            logger.debug('Ignoring Tuya broadcast from %s: %s', addr[0], e)
+            return
+
+        if update_address(broadcast['gwId'], broadcast['ip']):
+            logger.debug(
+                'Discovered Tuya device %s at %s',
+                broadcast['gwId'],
+                broadcast['ip']
+            )
+
+
+async def listen() -> None:
+    loop = asyncio.get_running_loop()
+    transports = []
+
+    ports = []
+
+    try:
+        for port in DISCOVERY_PORTS:
+            try:
+                transport, _ = await loop.create_datagram_endpoint(
+                    DiscoveryProtocol,
+                    local_addr=('0.0.0.0', port),
+                    reuse_port=True,
+                    allow_broadcast=True
+                )
+            except OSError as e:
+                # e.g. another program has the port
+                logger.error('Unable to listen for Tuya broadcasts on port %s: %s', port, e)
+                continue
+
+            transports.append(transport)
+            ports.append(port)
+
+        if not ports:
+            logger.warning('Tuya discovery is off. Devices are only found at known addresses')
+            return
+
+        logger.info('Listening for Tuya broadcasts on ports %s', ports)
+        await loop.create_future()
+    finally:
+        for transport in transports:
+            transport.close()
+
+
+def start_background() -> typing.Callable:
+    return discover()
+
+
+def discover() -> typing.Callable:
+    if not config.TUYA_DISCOVERY:
+        return lambda: True
+
+    load_address_cache()
+
+    loop = asyncio.get_event_loop()
+    task = loop.create_task(listen())
+
+    return lambda: task.cancel()
+
+
+def get_handler(configmap: dict) -> backends.Handler:
+
+    try:
+        device = get_device(configmap)
     except KeyError:
         logger.error('Invalid Tuya device: %s', configmap)
         raise
 
-    device.set_socketRetryLimit(config.TUYA_RETRY_COUNT)
-    device.set_socketTimeout(config.TUYA_CONNECTION_TIMEOUT)
-
     actions = configmap['actions']
 
     async def handler(event: lutron.LutronEvent) -> bool:
-        try:
-            component = actions[event.component.name]
-        except KeyError:
-            logger.warning('Unknown component: %s', event.component)
-            return False
-
-        try:
-            action = component[event.action.name]
-        except KeyError:
-            logger.warning('Unknown action: %s', event.action)
-            return False
-
+        action = backends.resolve_action(actions, event, logger)
         if action is None:
             return False
 
-        if is_output_event(event):
-            try:
-                action = action[event.parameters]
-            except KeyError:
-                logger.warning('Unknown action: %s:%s', event.component.name, event.parameters)
-                return False
-
         try:
             method_name = ACTIONS[action]
         except KeyError:
@@ -73,33 +346,50 @@ def get_handler(  # noqa: C901
             return False
 
         method = getattr(device, method_name)
+        circuit = get_device_breaker(configmap['id'], device)
 
-        def do_action() -> bool:
-            result = method()
-            if 'Error' in result:
-                logger.error(
-                    '%s request to Tuya device %s (%s) failed: %s',
-                    action,
-                    configmap['id'],
-                    configmap.get('name', 'Unnamed'),
-                    result['Error']
-                )
-                return False
+        if not circuit.allow():
+            logger.warning(
+                'Tuya device %s (%s) is unreachable. Skipping %s request',
+                configmap['id'],
+                configmap.get('name', 'Unnamed'),
+                action
+            )
+            ACTION_FAILURES.inc(configmap['id'], 'circuit_open')
+            return False
+
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(
+                'Starting %s request to Tuya device %s',
+                action,
+                configmap['id']
+            )
+        result = await asyncio.to_thread(method)
+
+        if result and 'Error' in result:
+            logger.error(
+                '%s request to Tuya device %s (%s) failed: %s',
+                action,
+                configmap['id'],
+                configmap.get('name', 'Unnamed'),
+                result['Error']
+            )
+
+            if result.get('Err') in UNREACHABLE_ERRORS:
+                ACTION_FAILURES.inc(configmap['id'], 'unreachable')
+                circuit.record_failure()
             else:
-                logger.info(
-                    '%s request sent to Tuya device %s (%s)',
-                    action,
-                    configmap['id'],
-                    configmap.get('name', 'Unnamed')
-                )
+                ACTION_FAILURES.inc(configmap['id'], 'error')
 
-                return True
+            return False
 
-        logger.debug(
-            'Starting %s request to Tuya device %s',
+        logger.info(
+            '%s request sent to Tuya device %s (%s)',
             action,
-            configmap['id']
+            configmap['id'],
+            configmap.get('name', 'Unnamed')
         )
-        return await asyncio.to_thread(do_action)
+        circuit.record_success()
+        return True
 
     return handler
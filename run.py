@@ -1,12 +1,12 @@
-import asyncio
-import logging
+from lutronbond import startup
 
-from lutronbond import config, controller
+with startup.phase('import'):
+    from lutronbond import config, controller, eventloop, logs, loopmonitor
 
 
-logging.basicConfig(
-    level=config.LOG_LEVEL
-)
+stop_logging = logs.setup(config.LOG_LEVEL, config.LOG_FORMAT, config.LOG_QUEUE)
 
-
-asyncio.run(controller.start())
+try:
+    eventloop.run(controller.start, loopmonitor.choose_loop(config.EVENT_LOOP))
+finally:
+    stop_logging()
@@ -1,5 +1,6 @@
 import importlib
 import os
+import typing
 from unittest.mock import Mock
 
 import pytest
@@ -27,10 +28,11 @@ def amock():
 
 @pytest.fixture
 def env():
-    kv = {}
+    kv: typing.Dict[str, typing.Optional[str]] = {}
 
     def setenv(key, value):
-        kv[key] = os.environ.get(key)
+        # Restored to what it was before the first change
+        kv.setdefault(key, os.environ.get(key))
 
         if value is None:
             try:
@@ -0,0 +1,162 @@
+from lutronbond import analysis
+
+
+BRIDGE1 = '10.0.0.10'
+BRIDGE2 = '10.0.0.20'
+BRIDGES = {1: BRIDGE1, 2: BRIDGE2}
+ACTION_NAMES = {'bond': {'TurnLightOn', 'SetSpeed'}, 'tuya': {'TurnOn', 'TurnOff'}}
+
+
+def lutron_target(integration_id, actions, bridge=1):
+    return {'id': integration_id, 'bridge': bridge, 'actions': actions}
+
+
+def test_check_actions__valid():
+    mappings = [(BRIDGE1, {
+        21: {
+            'bond': {'id': 'a', 'actions': {
+                'BTN_1': {'PRESS': 'TurnLightOn', 'RELEASE': None},
+                'BTN_2': {'PRESS': {'SetSpeed': 3}},
+            }},
+            'tuya': [{'id': 'b', 'actions': {
+                'ANY': {'SET_LEVEL': {'100.00': 'TurnOn', '0.00': 'TurnOff'}},
+            }}],
+            'lutron': lutron_target(50, {
+                'BTN_1': {'PRESS': {'SET_LEVEL': '100'}, 'RELEASE': {'BTN_3': 'PRESS'}},
+                'ANY': {'SET_LEVEL': {'100.00': {'SET_LEVEL': '0'}}},
+            }, bridge=2),
+        },
+    })]
+
+    assert analysis.check_actions(mappings, BRIDGES, ACTION_NAMES) == []
+
+
+def test_check_actions__invalid():
+    mappings = [(BRIDGE1, {
+        21: {
+            'bond': {'id': 'a', 'actions': {
+                'BTN_1': {'PRESS': 'TurnLightOnn', 'HOLDING': 'TurnLightOn'},
+                'BTN_9': {'PRESS': 'TurnLightOn'},
+            }},
+            'tuya': {'id': 'b', 'name': 'Lamp', 'actions': {
+                'ANY': {'SET_LEVEL': {'100.00': 'TurnOnn'}},
+            }},
+            'lutron': lutron_target(50, {
+                'BTN_1': {'PRESS': {'SET_LEVELS': '100'}, 'RELEASE': {'BTN_3': 'PUSH'}},
+            }, bridge=3),
+        },
+    })]
+
+    assert analysis.check_actions(mappings, BRIDGES, ACTION_NAMES) == [
+        "10.0.0.10:21 bond a: BTN_1.PRESS: unknown Bond action 'TurnLightOnn'",
+        '10.0.0.10:21 bond a: BTN_1.HOLDING: unknown action',
+        '10.0.0.10:21 bond a: unknown component BTN_9',
+        "10.0.0.10:21 tuya Lamp: ANY.SET_LEVEL: unknown Tuya action 'TurnOnn'",
+        '10.0.0.10:21 lutron 50: unknown bridge 3',
+        '10.0.0.10:21 lutron 50: BTN_1.PRESS: expected an output action like '
+        '{SET_LEVEL: "100"} or a button press like {BTN_1: PRESS}',
+        '10.0.0.10:21 lutron 50: BTN_1.RELEASE: expected an output action like '
+        '{SET_LEVEL: "100"} or a button press like {BTN_1: PRESS}',
+    ]
+
+
+def test_build_graph():
+    mappings = [(BRIDGE1, {
+        60: {'lutron': lutron_target(50, {
+            'BTN_1': {'PRESS': {'SET_LEVEL': '100'}, 'RELEASE': {'BTN_2': 'PRESS'}},
+        })},
+        50: {
+            'tuya': {'id': 'b', 'actions': {'ANY': {'SET_LEVEL': {'100.00': 'TurnOn'}}}},
+        },
+        # Nothing is mapped to 51
+        70: {'lutron': lutron_target(51, {'BTN_1': {'PRESS': {'SET_LEVEL': '100'}}})},
+    })]
+
+    graph = analysis.build_graph(mappings, BRIDGES)
+
+    assert graph == {
+        (BRIDGE1, 60, 'BTN_1', 'PRESS'): {(BRIDGE1, 50, 'ANY', 'SET_LEVEL')},
+        # 50 doesn't react to BTN_2 PRESS
+        (BRIDGE1, 60, 'BTN_1', 'RELEASE'): set(),
+        (BRIDGE1, 50, 'ANY', 'SET_LEVEL'): set(),
+        (BRIDGE1, 70, 'BTN_1', 'PRESS'): set(),
+    }
+
+
+def test_find_cycles__across_bridges():
+    mappings = [
+        (BRIDGE1, {60: {'lutron': lutron_target(50, {
+            'ANY': {'SET_LEVEL': {'100.00': {'SET_LEVEL': '100'}}},
+        }, bridge=2)}}),
+        (BRIDGE2, {50: {'lutron': lutron_target(60, {
+            'ANY': {'SET_LEVEL': {'SET_LEVEL': '100'}},
+        })}}),
+    ]
+
+    cycles = analysis.find_cycles(analysis.build_graph(mappings, BRIDGES))
+
+    assert cycles == [[
+        (BRIDGE1, 60, 'ANY', 'SET_LEVEL'),
+        (BRIDGE2, 50, 'ANY', 'SET_LEVEL'),
+    ]]
+
+
+def test_find_cycles__self():
+    mappings = [(BRIDGE1, {60: {'lutron': lutron_target(60, {
+        'BTN_1': {'PRESS': {'BTN_1': 'PRESS'}},
+    })}})]
+
+    cycles = analysis.find_cycles(analysis.build_graph(mappings, BRIDGES))
+
+    assert cycles == [[(BRIDGE1, 60, 'BTN_1', 'PRESS')]]
+
+
+def test_find_cycles__none():
+    mappings = [(BRIDGE1, {60: {'lutron': lutron_target(60, {
+        'BTN_1': {'PRESS': {'BTN_2': 'PRESS'}},
+    })}})]
+
+    assert analysis.find_cycles(analysis.build_graph(mappings, BRIDGES)) == []
+
+
+def test_fan_out():
+    tuya = {'id': 'b', 'actions': {'ANY': {'SET_LEVEL': {'100.00': 'TurnOn'}}}}
+    mappings = [(BRIDGE1, {
+        60: {
+            'bond': {'id': 'a', 'actions': {'BTN_1': {'PRESS': 'TurnLightOn'}}},
+            'lutron': [
+                lutron_target(50, {'BTN_1': {'PRESS': {'SET_LEVEL': '100'}}}),
+                lutron_target(51, {'BTN_1': {'PRESS': {'SET_LEVEL': '100'}}}),
+            ],
+        },
+        50: {'tuya': [tuya, tuya]},
+        51: {'lutron': lutron_target(52, {'ANY': {'SET_LEVEL': {'SET_LEVEL': '0'}}})},
+        52: {'lutron': lutron_target(51, {'ANY': {'SET_LEVEL': {'SET_LEVEL': '0'}}})},
+    })]
+    graph = analysis.build_graph(mappings, BRIDGES)
+
+    totals = analysis.fan_out(mappings, graph)
+
+    # 60 leads into the loop between 51 and 52
+    assert totals[(BRIDGE1, 60, 'BTN_1', 'PRESS')] is None
+    assert totals[(BRIDGE1, 51, 'ANY', 'SET_LEVEL')] is None
+    assert totals[(BRIDGE1, 50, 'ANY', 'SET_LEVEL')] == 2
+
+    del mappings[0][1][52]
+    graph = analysis.build_graph(mappings, BRIDGES)
+
+    totals = analysis.fan_out(mappings, graph)
+
+    # Bond, two Lutron commands, two Tuya commands for 50 and one for 51
+    assert totals[(BRIDGE1, 60, 'BTN_1', 'PRESS')] == 6
+
+
+def test_format_state():
+    assert analysis.format_state((BRIDGE1, 60, 'BTN_1', 'PRESS')) == '10.0.0.10:60 BTN_1 PRESS'
+
+
+def test_check_actions__other_backend():
+    mappings = [(BRIDGE1, {21: {'hue': {'id': 'c', 'actions': {'BTN_1': {'PRESS': 'Any'}}}}})]
+
+    # Backends that don't list their actions only have components and actions checked
+    assert analysis.check_actions(mappings, BRIDGES, ACTION_NAMES) == []
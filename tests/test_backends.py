@@ -0,0 +1,96 @@
+import importlib.metadata
+import types
+
+import pytest
+
+from lutronbond import backends, bond, lutron
+
+
+@pytest.fixture(autouse=True)
+def reset_backends():
+    backends.get_entry_points.cache_clear()
+    backends.get_backend.cache_clear()
+    yield
+    backends.get_entry_points.cache_clear()
+    backends.get_backend.cache_clear()
+
+
+@pytest.fixture
+def entry_points(mocker):
+    backend = types.SimpleNamespace(KEYS={}, get_handler=lambda configmap: None)
+    entry_point = importlib.metadata.EntryPoint(
+        'hue', 'lutronbond_hue', backends.ENTRY_POINT_GROUP
+    )
+    mocker.patch.object(importlib.metadata.EntryPoint, 'load', return_value=backend)
+    mocker.patch('importlib.metadata.entry_points', return_value=[entry_point])
+    return backend
+
+
+def event(component, action, parameters=''):
+    operation = lutron.Operation.OUTPUT if parameters else lutron.Operation.DEVICE
+    return lutron.LutronEvent(operation, 99, component, action, parameters, '10.0.0.1')
+
+
+def test_get_kinds():
+    entry = {'name': 'A', 'hue': {}, 'lutron': {}, 'alarm': {}, 'bond': {}}
+
+    assert backends.get_kinds(entry) == ['bond', 'lutron', 'alarm', 'hue']
+
+
+def test_get_backend__builtin(mocker):
+    entry_points = mocker.patch('importlib.metadata.entry_points')
+
+    assert backends.get_backend('bond') is bond
+    # Built-in backends don't need the installed packages to be scanned
+    assert not entry_points.called
+
+
+def test_get_backend__entry_point(entry_points):
+    assert backends.get_backend('hue') is entry_points
+    importlib.metadata.entry_points.assert_called_once_with(  # type: ignore
+        group='lutronbond.backends'
+    )
+
+
+def test_get_backend__unknown(entry_points):
+    with pytest.raises(ValueError, match='Unknown kind of target: alarm'):
+        backends.get_backend('alarm')
+
+
+def test_get_hooks():
+    with_hook = types.SimpleNamespace(close=lambda: None)
+    targets = {'a': with_hook, 'b': types.SimpleNamespace()}
+
+    assert backends.get_hooks(targets, 'close') == {'a': with_hook.close}
+
+
+def test_resolve_action(mocker):
+    logger = mocker.Mock()
+    actions = {
+        'BTN_1': {'PRESS': 'TurnOn', 'RELEASE': None},
+        'ANY': {'SET_LEVEL': {'100.00': 'TurnOn'}},
+    }
+    press = event(lutron.Component.BTN_1, lutron.DeviceAction.PRESS)
+    release = event(lutron.Component.BTN_1, lutron.DeviceAction.RELEASE)
+    level = event(lutron.Component.ANY, lutron.OutputAction.SET_LEVEL, '100.00')
+
+    assert backends.resolve_action(actions, press, logger) == 'TurnOn'
+    assert backends.resolve_action(actions, release, logger) is None
+    assert backends.resolve_action(actions, level, logger) == 'TurnOn'
+    assert backends.resolve_action(actions, level, logger, by_level=False) == {
+        '100.00': 'TurnOn'
+    }
+    assert not logger.warning.called
+
+
+def test_resolve_action__unknown(mocker):
+    logger = mocker.Mock()
+    actions = {'ANY': {'SET_LEVEL': {'100.00': 'TurnOn'}}}
+
+    press = event(lutron.Component.BTN_1, lutron.DeviceAction.PRESS)
+    assert backends.resolve_action(actions, press, logger) is None
+    logger.warning.assert_called_with('Unknown component: %s', lutron.Component.BTN_1)
+
+    level = event(lutron.Component.ANY, lutron.OutputAction.SET_LEVEL, '0.00')
+    assert backends.resolve_action(actions, level, logger) is None
+    logger.warning.assert_called_with('Unknown action: %s:%s', 'ANY', '0.00')
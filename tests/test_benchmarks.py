@@ -0,0 +1,155 @@
+import json
+
+import pytest
+
+from benchmarks import e2e, micro, results
+from lutronbond import config, controller
+
+
+def test_percentile():
+    values = [5, 1, 4, 2, 3]
+
+    assert results.percentile(values, 50) == 3
+    assert results.percentile(values, 99) == 5
+    assert results.percentile(values, 0) == 1
+    assert results.percentile([], 50) == 0
+
+
+def test_compare():
+    baseline = [
+        {'workload': 'press', 'rate': 10, 'p50_ms': 1.0, 'p99_ms': 2.0, 'throughput': 10},
+        {'workload': 'fade', 'rate': 10, 'p50_ms': 1.0, 'p99_ms': 2.0, 'throughput': 10},
+    ]
+    current = [
+        {'workload': 'press', 'rate': 10, 'p50_ms': 1.1, 'p99_ms': 3.0, 'throughput': 10},
+        {'workload': 'fade', 'rate': 10, 'p50_ms': 1.0, 'p99_ms': 2.0, 'throughput': 7},
+        {'workload': 'fade', 'rate': 20, 'p50_ms': 9.0, 'p99_ms': 9.0, 'throughput': 1},
+    ]
+
+    regressions = results.compare(current, baseline, ('workload', 'rate'), 0.2)
+
+    assert regressions == [
+        'press 10: p99_ms 2.000 -> 3.000',
+        'fade 10: throughput 10.000 -> 7.000',
+    ]
+
+
+def test_changes():
+    baseline = [{'name': 'parse/device', 'median_us': 4.0}]
+    current = [
+        {'name': 'parse/device', 'median_us': 3.0},
+        {'name': 'pub/1', 'median_us': 1.0},
+    ]
+
+    assert results.changes(current, baseline, ('name',)) == [
+        'parse/device: median_us 4.000 -> 3.000 (-25.0%)',
+    ]
+
+
+def test_save_load(tmp_path):
+    path = str(tmp_path / 'results' / 'run.json')
+
+    results.save({'results': [{'p50_ms': 1.5}]}, path)
+
+    assert results.load(path) == {'results': [{'p50_ms': 1.5}]}
+    with open(path) as f:
+        assert json.load(f)['results'][0]['p50_ms'] == 1.5
+
+
+def test_make_events__press():
+    events = e2e.make_events('press', 2, 5)
+
+    assert events == [
+        (1, '~DEVICE,1,2,3'),
+        (1, '~DEVICE,1,2,4'),
+        (2, '~DEVICE,2,2,3'),
+        (2, '~DEVICE,2,2,4'),
+        (1, '~DEVICE,1,2,3'),
+    ]
+
+
+def test_make_events__fade():
+    events = e2e.make_events('fade', 2, 3)
+
+    assert events == [
+        (1, '~OUTPUT,1,1,0.00'),
+        (2, '~OUTPUT,2,1,0.00'),
+        (1, '~OUTPUT,1,1,10.00'),
+    ]
+
+
+def test_make_mapping():
+    tuya_device = e2e.tuya_sim.VirtualDevice('simtuya0002', '0' * 16, port=7000)
+
+    mapping = e2e.make_mapping(3, {'simtuya0002': tuya_device})
+
+    assert mapping[1]['bond']['id'] == 'sim0001'
+    assert mapping[2]['tuya']['port'] == 7000
+    assert mapping[3]['lutron']['id'] == 1003
+    for entry in mapping.values():
+        for target in entry.values():
+            if isinstance(target, dict):
+                assert set(target['actions']) == {'BTN_1', 'ANY'}
+
+
+@pytest.fixture
+def restore_config(mocker):
+    for name in (
+            'LUTRON_BRIDGE_ADDR', 'LUTRON_BRIDGE_PORT', 'BOND_BRIDGE_ADDR',
+            'BOND_BRIDGE_API_TOKEN', 'LUTRON_MAPPING', 'BOND_BPUP',
+            'BOND_KEEPALIVE_INTERVAL', 'TUYA_DISCOVERY', 'METRICS_PORT', 'LOOP_MONITOR',
+    ):
+        mocker.patch.object(config, name, getattr(config, name))
+    mocker.patch.object(controller, 'shutting_down', False)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('workload', e2e.WORKLOADS)
+async def test_run(restore_config, workload):
+    result = await e2e.run(workload, rate=40, duration=0.25, devices=3, timeout=5)
+
+    assert result['events'] == 10
+    assert result['completed'] == 10
+    assert result['missing'] == 0
+    assert 0 < result['p50_ms'] <= result['p99_ms'] <= result['max_ms']
+
+
+@pytest.mark.asyncio
+async def test_calibrate():
+    async def timer(loops):
+        return loops * 0.001
+
+    assert await micro.calibrate(timer, min_time=0.01) == 16
+
+
+@pytest.mark.asyncio
+async def test_measure():
+    calls = []
+
+    async def timer(loops):
+        calls.append(loops)
+        return loops * 2e-6
+
+    result = await micro.measure(timer, samples=3, min_time=0.001, warmups=1)
+
+    assert result['loops'] == 512
+    assert result['samples'] == 3
+    assert result['median_us'] == pytest.approx(2)
+    assert result['stdev_us'] == pytest.approx(0)
+    # Calibration, one warmup, then the samples
+    assert calls[-4:] == [512] * 4
+
+
+@pytest.mark.asyncio
+async def test_micro_run(mocker):
+    mocker.patch('lutronbond.config.BOND_ACTION_DEADLINE', 5)
+
+    report = await micro.run(['parse/*', 'handler/*'], samples=2, min_time=0.001)
+
+    assert [r['name'] for r in report] == [
+        'parse/device', 'parse/output', 'parse/after_prompt',
+        'handler/bond_ignored', 'handler/bond_light', 'handler/bond_fan_speed',
+        'handler/tuya_output', 'handler/lutron_output',
+    ]
+    for result in report:
+        assert 0 < result['min_us'] <= result['median_us']
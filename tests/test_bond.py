@@ -1,42 +1,83 @@
 import asyncio
+import time
 
 import aiohttp
 import pytest
 
-from lutronbond import bond, lutron
+from lutronbond import bond, breaker, lutron, metrics
 
 
 @pytest.fixture(autouse=True)
 def clear_get_bond_connection_cache():
     bond.get_bond_connection.cache_clear()
+    bond.sessions.clear()
+    bond.reset_inventory()
 
 
-def test_get_bond_connection_call(mocker):
+@pytest.fixture(autouse=True)
+def clear_bond_state():
+    bond.states.clear()
+
+
+@pytest.fixture(autouse=True)
+def reset_metrics():
+    metrics.reset()
+
+
+@pytest.fixture(autouse=True)
+def reset_breakers():
+    yield
+    breaker.reset()
+
+
+@pytest.mark.asyncio
+async def test_get_bond_connection_call(mocker):
     bond_mock = mocker.patch('bond_async.Bond')
 
     bond.get_bond_connection('10.0.0.1', 'apikey')
 
-    bond_mock.assert_called_with('10.0.0.1', 'apikey')
+    bond_mock.assert_called_with('10.0.0.1', 'apikey', session=bond.sessions['10.0.0.1'])
+    await bond.close()
 
 
-def test_get_bond_connection():
+@pytest.mark.asyncio
+async def test_get_bond_connection():
     result = bond.get_bond_connection('10.0.0.1', 'apikey')
 
     assert isinstance(result, bond.bond_async.Bond)
+    await bond.close()
 
 
-def test_get_bond_connection_cached():
+@pytest.mark.asyncio
+async def test_get_bond_connection_cached():
     result1 = bond.get_bond_connection('10.0.0.1', 'apikey')
     result2 = bond.get_bond_connection('10.0.0.1', 'apikey')
 
     assert result1 is result2
+    await bond.close()
 
 
-def test_get_bond_connection_not_cached():
+@pytest.mark.asyncio
+async def test_get_bond_connection_not_cached():
     result1 = bond.get_bond_connection('10.0.0.1', 'apikey')
     result2 = bond.get_bond_connection('10.0.0.2', 'apikey')
 
     assert result1 is not result2
+    assert result1._session is not result2._session
+    await bond.close()
+
+
+@pytest.mark.asyncio
+async def test_close():
+    bond.get_bond_connection('10.0.0.1', 'apikey')
+    session = bond.sessions['10.0.0.1']
+    bond.inventory['bondid'] = 1
+
+    await bond.close()
+
+    assert session.closed
+    assert bond.sessions == {}
+    assert bond.inventory == {}
 
 
 def test_get_default_bond_connection(mocker):
@@ -82,6 +123,96 @@ def test_get_handler__missing_actions(lutron_event):
         bond.get_handler({})
 
 
+def test_get_handler__unknown_bridge(mocker):
+    mocker.patch('lutronbond.config.BOND_BRIDGE2_ADDR', None, create=True)
+
+    with pytest.raises(ValueError) as e:
+        bond.get_handler({'actions': {}, 'id': 'bondid', 'bridge': 2})
+
+    assert str(e.value) == 'Unknown Bond bridge: 2'
+
+
+@pytest.fixture
+def bridge2(mocker):
+    mocker.patch('lutronbond.config.BOND_BRIDGE2_ADDR', '10.0.0.40', create=True)
+    mocker.patch('lutronbond.config.BOND_BRIDGE2_API_TOKEN', 'qwerqwer', create=True)
+
+
+def test_get_bridges(mocker):
+    mocker.patch('lutronbond.config.BOND_BRIDGE2_ADDR', None, create=True)
+
+    assert bond.get_bridges() == [1]
+
+
+def test_get_bridges__bridge2(bridge2):
+    assert bond.get_bridges() == [1, 2]
+
+
+def test_get_bridge_connection__bridge2(mocker, bridge2):
+    get_bond_connection = mocker.patch('lutronbond.bond.get_bond_connection')
+
+    result = bond.get_bridge_connection(2)
+
+    get_bond_connection.assert_called_with('10.0.0.40', 'qwerqwer')
+    assert result is get_bond_connection.return_value
+
+
+def test_get_device_connection__inventory(mocker, bridge2):
+    get_bridge_connection = mocker.patch('lutronbond.bond.get_bridge_connection')
+    bond.inventory['bondid'] = 2
+
+    bond.get_device_connection('bondid')
+    get_bridge_connection.assert_called_with(2)
+
+    bond.get_device_connection('otherid')
+    get_bridge_connection.assert_called_with(1)
+
+    bond.get_device_connection('bondid', 1)
+    get_bridge_connection.assert_called_with(1)
+
+
+@pytest.mark.asyncio
+async def test_build_inventory(mocker, amock, bridge2):
+    connections = {
+        1: mocker.Mock(devices=amock(return_value=['a', 'b'])),
+        2: mocker.Mock(devices=amock(return_value=['c'])),
+    }
+    mocker.patch(
+        'lutronbond.bond.get_bridge_connection',
+        side_effect=lambda bridge: connections[bridge]
+    )
+
+    result = await bond.build_inventory()
+
+    assert result == {1: ['a', 'b'], 2: ['c']}
+    assert bond.inventory == {'a': 1, 'b': 1, 'c': 2}
+
+
+@pytest.mark.asyncio
+async def test_reload(mocker, amock, bridge2, logger):
+    devices = {1: ['a'], 2: ['b']}
+    mocker.patch(
+        'lutronbond.bond.get_bridge_connection',
+        side_effect=lambda bridge: mocker.Mock(devices=amock(return_value=devices[bridge]))
+    )
+    await bond.build_inventory()
+    devices = {1: ['a', 'c'], 2: []}
+
+    await bond.reload()
+
+    assert bond.inventory == {'a': 1, 'c': 1}
+
+    mocker.patch(
+        'lutronbond.bond.get_bridge_connection',
+        return_value=mocker.Mock(devices=amock(side_effect=aiohttp.ClientError()))
+    )
+
+    await bond.reload()
+
+    assert bond.inventory == {'a': 1, 'c': 1}
+    assert logger.warning.called
+
+
 @pytest.mark.asyncio
 async def test_handler__unknown_component(lutron_event, logger):
     handler = bond.get_handler({'actions': {}})
@@ -133,6 +264,7 @@ def mock_default_bond_connection(mocker, amock):
     )
     get_default_bond_connection.return_value.action = amock()
     get_default_bond_connection.return_value.version = amock()
+    get_default_bond_connection.return_value.devices = amock(return_value=[])
     return get_default_bond_connection.return_value
 
 
@@ -292,11 +424,84 @@ async def test_verify_connection(mock_default_bond_connection, logger):
     await bond.verify_connection()
 
     assert mock_default_bond_connection.version.called
+    assert mock_default_bond_connection.devices.called
     logger.info.assert_called_with(
         'Connected to Bond Bridge. Model model. Version version'
     )
 
 
+@pytest.mark.asyncio
+async def test_handler__bridge2(
+        mocker,
+        lutron_event,
+        logger,
+        mock_bond_action,
+        amock,
+        bridge2):
+    get_bond_connection = mocker.patch('lutronbond.bond.get_bond_connection')
+    get_bond_connection.return_value.action = amock()
+    handler = bond.get_handler({
+        'actions': {'UNKNOWN': {'UNKNOWN': 'Hi'}},
+        'id': 'bondid',
+        'bridge': 2,
+    })
+
+    result = await handler(lutron_event)
+
+    get_bond_connection.assert_called_with('10.0.0.40', 'qwerqwer')
+    get_bond_connection.return_value.action.assert_called_with(
+        'bondid',
+        mock_bond_action.return_value
+    )
+    assert result is True
+
+
+@pytest.mark.asyncio
+async def test_handler__waits_for_inventory(
+        mocker,
+        lutron_event,
+        logger,
+        mock_bond_action,
+        amock,
+        bridge2):
+    get_bridge_connection = mocker.patch('lutronbond.bond.get_bridge_connection')
+    get_bridge_connection.return_value.action = amock()
+    handler = bond.get_handler({
+        'actions': {'UNKNOWN': {'UNKNOWN': 'Hi'}},
+        'id': 'bondid',
+    })
+
+    task = asyncio.ensure_future(handler(lutron_event))
+    await asyncio.sleep(0.01)
+
+    # Sent nowhere until it's known which bridge the device is on
+    assert not get_bridge_connection.return_value.action.called
+
+    bond.inventory['bondid'] = 2
+    bond.inventory_ready.set()
+
+    assert await task is True
+    get_bridge_connection.assert_called_with(2)
+
+
+@pytest.mark.asyncio
+async def test_wait_for_inventory__deadline(logger, bridge2):
+    await bond.wait_for_inventory(time.monotonic() + 0.01)
+
+    logger.warning.assert_called_with(
+        'Bond device inventory is not ready. Assuming Bond Bridge 1'
+    )
+
+
+@pytest.mark.asyncio
+async def test_build_inventory__ready(mocker, amock, mock_default_bond_connection):
+    await bond.build_inventory()
+
+    assert bond.inventory_ready.is_set()
+    await bond.close()
+    assert not bond.inventory_ready.is_set()
+
+
 @pytest.mark.asyncio
 async def test_keepalive(
         mock_default_bond_connection,
@@ -345,3 +550,399 @@ async def test_keepalive_cancel(
 
     assert not mock_default_bond_connection.version.called
     assert not logger.debug.called
+
+
+def state_message(device_id, body, status=200):
+    return {
+        'B': 'ZZBL12345',
+        't': 'devices/{}/state'.format(device_id),
+        's': status,
+        'b': body,
+    }
+
+
+def test_bond_state__notify():
+    bond.get_state(1).notify(state_message('bondid', {'light': 1, 'power': 0}))
+    bond.get_state(1).notify(state_message('bondid', {'power': 1}))
+
+    assert bond.get_state(1).alive
+    assert bond.get_state(1).devices == {'bondid': {'light': 1, 'power': 1}}
+
+
+def test_bond_state__notify__error_status():
+    bond.get_state(1).notify(state_message('bondid', {'light': 1}, status=500))
+
+    assert bond.get_state(1).alive
+    assert bond.get_state(1).devices == {}
+
+
+def test_bond_state__notify__other_topic():
+    bond.get_state(1).notify({'s': 200, 't': 'devices/bondid/properties', 'b': {'max_speed': 3}})
+
+    assert bond.get_state(1).devices == {}
+
+
+@pytest.mark.parametrize('action, arg, device_state, expected', [
+    ('TurnLightOn', None, {'light': 1}, True),
+    ('TurnLightOn', None, {'light': 0}, False),
+    ('TurnLightOff', None, {'light': 0}, True),
+    ('TurnOn', None, {'power': 1}, True),
+    ('TurnOff', None, {'power': 1}, False),
+    ('SetSpeed', 2, {'power': 1, 'speed': 2}, True),
+    ('SetSpeed', 2, {'power': 0, 'speed': 2}, False),
+    ('SetSpeed', 3, {'power': 1, 'speed': 2}, False),
+    ('SetDirection', -1, {'direction': -1}, True),
+    ('ToggleDirection', None, {'direction': -1}, False),
+    ('TurnLightOn', None, {}, False),
+])
+def test_is_redundant(action, arg, device_state, expected):
+    bond.get_state(1).notify(state_message('bondid', device_state))
+
+    assert bond.is_redundant('bondid', action, arg) is expected
+
+
+def test_is_redundant__unknown_device():
+    bond.get_state(1).notify(state_message('otherid', {'light': 1}))
+
+    assert bond.is_redundant('bondid', 'TurnLightOn', None) is False
+
+
+def test_is_redundant__not_alive():
+    bond.get_state(1).update('bondid', {'light': 1})
+
+    assert bond.is_redundant('bondid', 'TurnLightOn', None) is False
+
+
+def test_is_redundant__other_bridge():
+    bond.get_state(1).notify(state_message('otherid', {'light': 0}))
+    bond.get_state(2).update('bondid', {'light': 1})
+
+    # Push updates from bridge 1 say nothing about bridge 2
+    assert bond.is_redundant('bondid', 'TurnLightOn', None, 2) is False
+
+    bond.get_state(2).notify(state_message('bondid', {'light': 1}))
+
+    assert bond.is_redundant('bondid', 'TurnLightOn', None, 2) is True
+    assert bond.is_redundant('bondid', 'TurnLightOn', None, 1) is False
+
+
+@pytest.mark.asyncio
+async def test_handler__redundant_action(
+        lutron_event,
+        logger,
+        mock_bond_action,
+        mock_default_bond_connection):
+    bond.get_state(1).notify(state_message('bondid', {'light': 1}))
+    handler = bond.get_handler({
+        'actions': {'UNKNOWN': {'UNKNOWN': 'TurnLightOn'}},
+        'id': 'bondid',
+    })
+
+    result = await handler(lutron_event)
+
+    assert result is True
+    assert not mock_default_bond_connection.action.called
+    logger.info.assert_called_with(
+        'Skipping %s for %s: Bond device %s is already in that state',
+        'TurnLightOn',
+        'Unnamed',
+        'bondid'
+    )
+
+
+@pytest.mark.asyncio
+async def test_handler__fast_toggle(
+        lutron_event,
+        logger,
+        mock_bond_action,
+        mock_default_bond_connection):
+    bond.get_state(1).notify(state_message('bondid', {'light': 1}))
+    turn_off, turn_on = [
+        bond.get_handler({'actions': {'UNKNOWN': {'UNKNOWN': action}}, 'id': 'bondid'})
+        for action in ('TurnLightOff', 'TurnLightOn')
+    ]
+
+    # Pressed again before the bridge pushes the light going off
+    assert await turn_off(lutron_event) is True
+    assert await turn_on(lutron_event) is True
+
+    assert [c.args[0] for c in mock_bond_action.call_args_list] == [
+        'TurnLightOff', 'TurnLightOn'
+    ]
+
+    # Once the bridge catches up, its state can be trusted again
+    bond.get_state(1).notify(state_message('bondid', {'light': 1}))
+    mock_bond_action.reset_mock()
+
+    assert await turn_on(lutron_event) is True
+    assert not mock_bond_action.called
+
+
+@pytest.mark.asyncio
+async def test_prime_state(mock_default_bond_connection, amock):
+    mock_default_bond_connection.devices = amock(return_value=['a', 'b'])
+    mock_default_bond_connection.device_state = amock(
+        side_effect=[{'light': 1}, {'power': 0}]
+    )
+
+    await bond.prime_state()
+
+    assert bond.get_state(1).devices == {'a': {'light': 1}, 'b': {'power': 0}}
+
+
+@pytest.mark.asyncio
+async def test_keepalive__bpup(mock_default_bond_connection, logger, mocker, amock):
+    mocker.patch('lutronbond.config.BOND_BPUP', True)
+    mocker.patch('lutronbond.config.BOND_KEEPALIVE_INTERVAL', 0.01)
+    stop = mocker.Mock()
+    start_bpup = mocker.patch('bond_async.bpup.start_bpup', amock(return_value=stop))
+    mock_default_bond_connection.devices = amock(return_value=['bondid'])
+    mock_default_bond_connection.device_state = amock(return_value={'light': 0})
+
+    cancel = bond.keepalive()
+    await asyncio.sleep(0.02)
+
+    start_bpup.assert_called_with('10.0.0.30', bond.get_state(1))
+    assert bond.get_state(1).devices == {'bondid': {'light': 0}}
+    assert not mock_default_bond_connection.version.called
+
+    cancel()
+    await asyncio.sleep(0.01)
+
+    assert stop.called
+    assert bond.get_state(1).devices == {}
+
+
+@pytest.mark.asyncio
+async def test_listen__liveness_per_bridge(bridge2, logger, mocker, amock):
+    mocker.patch('lutronbond.bond.BPUP_LIVENESS_INTERVAL', 0.01)
+    mocker.patch('bond_async.bpup.start_bpup', amock(return_value=mocker.Mock()))
+    mocker.patch('lutronbond.bond.prime_state', amock())
+    bond.get_state(1).notify(state_message('bondid', {'light': 1}))
+
+    cancel = bond.listen()
+    await asyncio.sleep(0.015)
+    cancel()
+    await asyncio.sleep(0.01)
+
+    logger.warning.assert_called_once_with(
+        'No push updates received from Bond Bridge %s', 2
+    )
+
+
+@pytest.fixture
+def no_backoff_wait(mocker):
+    mocker.patch('backoff.full_jitter', lambda value: 0)
+
+
+@pytest.mark.asyncio
+async def test_listen__retry_subscribe(no_backoff_wait, logger, mocker, amock):
+    stop = mocker.Mock()
+    start_bpup = mocker.patch(
+        'bond_async.bpup.start_bpup',
+        amock(side_effect=[OSError('Network is unreachable'), stop])
+    )
+    prime_state = mocker.patch('lutronbond.bond.prime_state', amock())
+
+    cancel = bond.listen()
+    await asyncio.sleep(0.01)
+    cancel()
+    await asyncio.sleep(0.01)
+
+    assert start_bpup.call_count == 2
+    logger.warning.assert_called_once_with(
+        'Unable to subscribe to push updates from Bond Bridge %s, '
+        'retrying in %.1f seconds: %r',
+        1, 0, mocker.ANY
+    )
+    logger.info.assert_any_call('Subscribed to Bond Bridge push updates')
+    assert prime_state.called
+    assert stop.called
+
+
+def server_error(mocker, status):
+    return aiohttp.ClientResponseError(mocker.Mock(), (), status=status)
+
+
+@pytest.mark.parametrize('exception, expected', [
+    (aiohttp.ClientConnectionError(), True),
+    (aiohttp.ServerDisconnectedError(), True),
+    (asyncio.TimeoutError(), True),
+    (aiohttp.ClientPayloadError(), False),
+])
+def test_is_retryable(exception, expected):
+    assert bond.is_retryable(exception) is expected
+
+
+@pytest.mark.parametrize('status, expected', [
+    (500, True),
+    (503, True),
+    (404, False),
+    (401, False),
+])
+def test_is_retryable__response_status(mocker, status, expected):
+    assert bond.is_retryable(server_error(mocker, status)) is expected
+
+
+def test_get_deadline(mocker, lutron_event):
+    mocker.patch('lutronbond.config.BOND_ACTION_DEADLINE', 5.0)
+
+    assert bond.get_deadline(lutron_event) == lutron_event.timestamp + 5.0
+
+
+def test_get_deadline__disabled(mocker, lutron_event):
+    mocker.patch('lutronbond.config.BOND_ACTION_DEADLINE', 0)
+
+    assert bond.get_deadline(lutron_event) is None
+
+
+@pytest.mark.asyncio
+async def test_handler__stale_event(
+        mocker,
+        lutron_event,
+        logger,
+        mock_bond_action,
+        mock_default_bond_connection):
+    mocker.patch('lutronbond.config.BOND_ACTION_DEADLINE', 5.0)
+    lutron_event.timestamp = time.monotonic() - 6
+    handler = bond.get_handler({
+        'actions': {'UNKNOWN': {'UNKNOWN': 'Hi'}},
+        'id': 'bondid',
+    })
+
+    result = await handler(lutron_event)
+
+    assert result is False
+    assert not mock_default_bond_connection.action.called
+    assert bond.ACTION_GIVEUPS.get('bondid', 'stale') == 1
+
+
+@pytest.mark.asyncio
+async def test_handler__retry_on_server_error(
+        mocker,
+        lutron_event,
+        logger,
+        mock_bond_action,
+        mock_default_bond_connection,
+        no_backoff_wait):
+    mock_default_bond_connection.action.side_effect = iter([
+        server_error(mocker, 503),
+        asyncio.TimeoutError(),
+        None,
+    ])
+    handler = bond.get_handler({
+        'actions': {'UNKNOWN': {'UNKNOWN': 'Hi'}},
+        'id': 'bondid',
+    })
+
+    result = await handler(lutron_event)
+
+    assert result is True
+    assert mock_default_bond_connection.action.call_count == 3
+    assert bond.ACTION_RETRIES.get('bondid') == 2
+
+
+@pytest.mark.asyncio
+async def test_handler__no_retry_on_client_error(
+        mocker,
+        lutron_event,
+        logger,
+        mock_bond_action,
+        mock_default_bond_connection,
+        no_backoff_wait):
+    error = server_error(mocker, 404)
+    mock_default_bond_connection.action.side_effect = error
+    handler = bond.get_handler({
+        'actions': {'UNKNOWN': {'UNKNOWN': 'Hi'}},
+        'id': 'bondid',
+    })
+
+    result = await handler(lutron_event)
+
+    assert result is False
+    assert mock_default_bond_connection.action.call_count == 1
+    assert bond.ACTION_GIVEUPS.get('bondid', 'error') == 1
+    logger.error.assert_called_with(
+        '%s request to Bond Bridge %s failed: %r',
+        'Hi',
+        'bondid',
+        error
+    )
+
+
+@pytest.mark.asyncio
+async def test_handler__hung_request(
+        mocker,
+        lutron_event,
+        logger,
+        mock_bond_action,
+        mock_default_bond_connection,
+        no_backoff_wait):
+    mocker.patch('lutronbond.config.BOND_ACTION_DEADLINE', 0.05)
+
+    async def hang(*args):
+        await asyncio.sleep(10)
+
+    mock_default_bond_connection.action = hang
+    handler = bond.get_handler({
+        'actions': {'UNKNOWN': {'UNKNOWN': 'Hi'}},
+        'id': 'bondid',
+    })
+
+    start = time.monotonic()
+    result = await handler(lutron_event)
+
+    assert result is False
+    assert time.monotonic() - start < 1
+    assert bond.ACTION_GIVEUPS.get('bondid', 'error') + \
+        bond.ACTION_GIVEUPS.get('bondid', 'stale') == 1
+
+
+@pytest.mark.asyncio
+async def test_handler__circuit_open(
+        mocker,
+        lutron_event,
+        logger,
+        mock_bond_action,
+        mock_default_bond_connection,
+        no_backoff_wait):
+    mocker.patch('lutronbond.config.BREAKER_FAILURE_THRESHOLD', 2)
+    mocker.patch('lutronbond.config.BOND_RETRY_COUNT', 1)
+    mock_default_bond_connection.action.side_effect = asyncio.TimeoutError()
+    handler = bond.get_handler({
+        'actions': {'UNKNOWN': {'UNKNOWN': 'Hi'}},
+        'id': 'bondid',
+    })
+
+    assert await handler(lutron_event) is False
+    assert await handler(lutron_event) is False
+    assert await handler(lutron_event) is False
+
+    assert mock_default_bond_connection.action.call_count == 2
+    assert bond.ACTION_GIVEUPS.get('bondid', 'circuit_open') == 1
+    assert breaker.CIRCUIT_OPEN.get('bond:10.0.0.30') == 1
+    logger.warning.assert_called_with(
+        'Bond Bridge %s is unreachable. Skipping %s request to %s',
+        1,
+        'Hi',
+        'bondid'
+    )
+
+
+@pytest.mark.asyncio
+async def test_handler__client_error_does_not_open_circuit(
+        mocker,
+        lutron_event,
+        logger,
+        mock_bond_action,
+        mock_default_bond_connection):
+    mocker.patch('lutronbond.config.BREAKER_FAILURE_THRESHOLD', 1)
+    mock_default_bond_connection.action.side_effect = server_error(mocker, 404)
+    handler = bond.get_handler({
+        'actions': {'UNKNOWN': {'UNKNOWN': 'Hi'}},
+        'id': 'bondid',
+    })
+
+    await handler(lutron_event)
+
+    assert breaker.CIRCUIT_OPEN.get('bond:10.0.0.30') == 0
@@ -0,0 +1,143 @@
+import asyncio
+
+import pytest
+
+from lutronbond import breaker
+
+
+@pytest.fixture(autouse=True)
+def reset_breakers(mocker):
+    mocker.patch('lutronbond.config.BREAKER_FAILURE_THRESHOLD', 3)
+    mocker.patch('lutronbond.config.BREAKER_PROBE_INTERVAL', 0.01)
+    yield
+    breaker.reset()
+
+
+@pytest.fixture
+def probe(amock):
+    return amock()
+
+
+@pytest.mark.asyncio
+async def test_breaker__closed(probe):
+    circuit = breaker.CircuitBreaker('test', probe)
+
+    assert circuit.allow() is True
+    assert breaker.CIRCUIT_OPEN.get('test') == 0
+
+
+@pytest.mark.asyncio
+async def test_breaker__opens_after_threshold(probe):
+    probe.side_effect = OSError('unreachable')
+    circuit = breaker.CircuitBreaker('test', probe)
+
+    circuit.record_failure()
+    circuit.record_failure()
+    assert circuit.allow() is True
+
+    circuit.record_failure()
+    assert circuit.allow() is False
+    assert breaker.CIRCUIT_OPEN.get('test') == 1
+    assert breaker.CIRCUIT_REJECTED.get('test') == 1
+    circuit.cancel()
+
+
+@pytest.mark.asyncio
+async def test_breaker__success_resets_failures(probe):
+    circuit = breaker.CircuitBreaker('test', probe)
+
+    circuit.record_failure()
+    circuit.record_failure()
+    circuit.record_success()
+    circuit.record_failure()
+
+    assert circuit.allow() is True
+
+
+@pytest.mark.asyncio
+async def test_breaker__disabled(mocker, probe):
+    mocker.patch('lutronbond.config.BREAKER_FAILURE_THRESHOLD', 0)
+    circuit = breaker.CircuitBreaker('test', probe)
+
+    for _ in range(10):
+        circuit.record_failure()
+
+    assert circuit.allow() is True
+
+
+@pytest.mark.asyncio
+async def test_breaker__probe_closes_circuit(mocker):
+    results = iter([OSError('unreachable'), None])
+
+    async def probe():
+        result = next(results)
+        if result:
+            raise result
+
+    circuit = breaker.CircuitBreaker('test', probe)
+    for _ in range(3):
+        circuit.record_failure()
+
+    assert circuit.is_open
+    await asyncio.sleep(0.05)
+
+    assert not circuit.is_open
+    assert circuit.allow() is True
+    assert breaker.CIRCUIT_OPEN.get('test') == 0
+
+
+@pytest.mark.asyncio
+async def test_breaker__probe_timeout(mocker):
+    mocker.patch('lutronbond.breaker.PROBE_TIMEOUT', 0.01)
+
+    async def probe():
+        await asyncio.sleep(1)
+
+    circuit = breaker.CircuitBreaker('test', probe)
+    for _ in range(3):
+        circuit.record_failure()
+
+    await asyncio.sleep(0.05)
+
+    assert circuit.is_open
+    circuit.cancel()
+
+
+@pytest.mark.asyncio
+async def test_breaker__success_closes_circuit(probe):
+    probe.side_effect = OSError('unreachable')
+    circuit = breaker.CircuitBreaker('test', probe)
+    for _ in range(3):
+        circuit.record_failure()
+
+    circuit.record_success()
+
+    assert not circuit.is_open
+    assert circuit._probe_task is None
+
+
+def test_get_breaker(probe):
+    result1 = breaker.get_breaker('test', probe)
+    result2 = breaker.get_breaker('test', probe)
+    result3 = breaker.get_breaker('other', probe)
+
+    assert result1 is result2
+    assert result1 is not result3
+
+
+def test_remove(probe):
+    circuit = breaker.get_breaker('test', probe)
+
+    breaker.remove('test')
+    breaker.remove('missing')
+
+    assert breaker.breakers == {}
+    assert breaker.get_breaker('test', probe) is not circuit
+
+
+def test_reset(probe):
+    breaker.get_breaker('test', probe)
+
+    breaker.reset()
+
+    assert breaker.breakers == {}
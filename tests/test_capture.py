@@ -0,0 +1,111 @@
+import asyncio
+import threading
+
+import pytest
+
+from lutronbond import capture, lutron
+
+
+@pytest.fixture
+def capture_file(tmp_path, mocker):
+    path = str(tmp_path / 'traffic.lbcap')
+    mocker.patch('lutronbond.config.CAPTURE_FILE', path, create=True)
+    capture.close()
+    yield path
+    capture.close()
+
+
+def get_writer():
+    writer = capture.get_writer()
+    assert writer is not None
+    return writer
+
+
+def test_get_writer__disabled(mocker):
+    mocker.patch('lutronbond.config.CAPTURE_FILE', '', create=True)
+    capture.close()
+
+    assert capture.get_writer() is None
+
+
+def test_write_read(capture_file):
+    writer = get_writer()
+    writer.write('10.0.0.10', b'~DEVICE,5,2,3\r\n', 100.5)
+    writer.write('10.0.0.20', b'GNET> ~OUTPUT,12,1,100.00\r\n', 101.25)
+    capture.close()
+
+    assert list(capture.read(capture_file)) == [
+        capture.Record(100.5, '10.0.0.10', b'~DEVICE,5,2,3\r\n'),
+        capture.Record(101.25, '10.0.0.20', b'GNET> ~OUTPUT,12,1,100.00\r\n'),
+    ]
+
+
+def test_write__appends(capture_file):
+    get_writer().write('10.0.0.10', b'~DEVICE,5,2,3\r\n', 1.0)
+    capture.close()
+    get_writer().write('10.0.0.10', b'~DEVICE,5,2,4\r\n', 0.5)
+    capture.close()
+
+    assert [r.data for r in capture.read(capture_file)] == [
+        b'~DEVICE,5,2,3\r\n',
+        b'~DEVICE,5,2,4\r\n',
+    ]
+
+
+def test_write__background_thread(capture_file, mocker):
+    writer = get_writer()
+    threads = []
+    writer._file.close()
+    writer._file = mocker.Mock(
+        write=lambda data: threads.append(threading.current_thread().name)
+    )
+
+    writer.write('10.0.0.10', b'~DEVICE,5,2,3\r\n', 1.0)
+    capture.close()
+
+    assert threads == ['capture']
+    assert writer._file.flush.called
+
+
+def test_read__truncated(capture_file, mocker):
+    warning = mocker.patch.object(capture.logger, 'warning')
+    get_writer().write('10.0.0.10', b'~DEVICE,5,2,3\r\n', 1.0)
+    get_writer().write('10.0.0.10', b'~DEVICE,5,2,4\r\n', 2.0)
+    capture.close()
+    with open(capture_file, 'r+b') as f:
+        f.truncate(f.seek(0, 2) - 3)
+
+    assert [r.timestamp for r in capture.read(capture_file)] == [1.0]
+    assert warning.called
+
+
+def test_read__not_a_capture(tmp_path):
+    path = tmp_path / 'other'
+    path.write_bytes(b'hello')
+
+    with pytest.raises(ValueError):
+        list(capture.read(str(path)))
+
+
+@pytest.mark.asyncio
+async def test_stream__captures(capture_file, mocker):
+    mocker.patch('time.monotonic', return_value=42.0)
+    connection = lutron.LutronConnection('10.0.0.10', 23)
+    connection.is_connected = True
+    connection.is_logged_in = True
+    connection._reader = mocker.Mock(readuntil=mocker.AsyncMock(side_effect=[
+        b'~DEVICE,5,2,3\r\n',
+        b'~ERROR,6\r\n',
+        asyncio.exceptions.IncompleteReadError(b'', 32),
+    ]))
+    callback = mocker.Mock()
+
+    with pytest.raises(asyncio.exceptions.IncompleteReadError):
+        await connection.stream(callback)
+    capture.close()
+
+    assert callback.call_count == 1
+    assert list(capture.read(capture_file)) == [
+        capture.Record(42.0, '10.0.0.10', b'~DEVICE,5,2,3\r\n'),
+        capture.Record(42.0, '10.0.0.10', b'~ERROR,6\r\n'),
+    ]
@@ -56,3 +56,25 @@ def test_env__not_in_environment(env, import_config):
         'LB_BOND_BRIDGE_API_TOKEN. Please set an environment variable with '
         'this name and try again.'
     )
+
+
+def test_env__bond_bridge2(env, import_config):
+    env('LB_BOND_BRIDGE2_ADDR', '10.0.0.40')
+    env('LB_BOND_BRIDGE2_API_TOKEN', 'qwerqwer')
+
+    config = import_config()
+
+    assert config.BOND_BRIDGE2_ADDR == '10.0.0.40'
+    assert config.BOND_BRIDGE2_API_TOKEN == 'qwerqwer'
+
+    env('LB_BOND_BRIDGE2_API_TOKEN', None)
+
+    with pytest.raises(ValueError, match='LB_BOND_BRIDGE2_API_TOKEN'):
+        import_config()
+
+    # Reloading leaves behind what is no longer set
+    env('LB_BOND_BRIDGE2_ADDR', None)
+    del config.BOND_BRIDGE2_ADDR, config.BOND_BRIDGE2_API_TOKEN
+    import_config()
+
+    assert not hasattr(config, 'BOND_BRIDGE2_ADDR')
@@ -0,0 +1,321 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+from lutronbond import configfile
+
+
+DOCUMENT = {
+    'lutron_mapping': {
+        '21': {
+            'name': 'Fan Light Pico',
+            'bond': {
+                'id': '6409d2a2',
+                'actions': {'BTN_1': {'PRESS': None, 'RELEASE': {'SetSpeed': 2}}},
+            },
+        },
+        '12': {
+            'tuya': [{
+                'id': 'ebd9ffdea61cd889f90alo',
+                'key': '0123456789abcdef',
+                'addr': '192.168.1.147',
+                'version': '3.3',
+                'actions': {'ANY': {'SET_LEVEL': {'100.00': 'TurnOn', '0.00': 'TurnOff'}}},
+            }],
+        },
+    },
+    'lutron2_mapping': {
+        '60': {
+            'lutron': {'id': 50, 'actions': {'BTN_RAISE': {'RELEASE': {'SET_LEVEL': '100'}}}},
+        },
+    },
+}
+
+YAML = """
+lutron_mapping:
+  21:
+    name: Fan Light Pico
+    bond:
+      id: 6409d2a2
+      actions:
+        BTN_1: {PRESS: null, RELEASE: {SetSpeed: 2}}
+  12:
+    tuya:
+      - id: ebd9ffdea61cd889f90alo
+        key: 0123456789abcdef
+        addr: 192.168.1.147
+        version: 3.3
+        actions:
+          ANY:
+            SET_LEVEL: {100.00: TurnOn, 0: TurnOff}
+lutron2_mapping:
+  60:
+    lutron:
+      id: 50
+      actions:
+        BTN_RAISE: {RELEASE: {SET_LEVEL: '100'}}
+"""
+
+TOML = """
+[lutron_mapping.21]
+name = "Fan Light Pico"
+
+[lutron_mapping.21.bond]
+id = "6409d2a2"
+actions = { BTN_1 = { RELEASE = { SetSpeed = 2 } } }
+
+[[lutron_mapping.12.tuya]]
+id = "ebd9ffdea61cd889f90alo"
+key = "0123456789abcdef"
+addr = "192.168.1.147"
+version = 3.3
+actions = { ANY = { SET_LEVEL = { "100.00" = "TurnOn", "0.00" = "TurnOff" } } }
+
+[lutron2_mapping.60.lutron]
+id = 50
+actions = { BTN_RAISE = { RELEASE = { SET_LEVEL = "100" } } }
+"""
+
+EXPECTED = {
+    'LUTRON_MAPPING': {
+        21: {
+            'name': 'Fan Light Pico',
+            'bond': [{
+                'id': '6409d2a2',
+                'actions': {'BTN_1': {'PRESS': None, 'RELEASE': {'SetSpeed': 2}}},
+            }],
+        },
+        12: {
+            'tuya': [{
+                'id': 'ebd9ffdea61cd889f90alo',
+                'key': '0123456789abcdef',
+                'addr': '192.168.1.147',
+                'version': 3.3,
+                'actions': {'ANY': {'SET_LEVEL': {'100.00': 'TurnOn', '0.00': 'TurnOff'}}},
+            }],
+        },
+    },
+    'LUTRON2_MAPPING': {
+        60: {
+            'lutron': [
+                {'id': 50, 'actions': {'BTN_RAISE': {'RELEASE': {'SET_LEVEL': '100'}}}},
+            ],
+        },
+    },
+}
+
+
+@pytest.fixture
+def json_file(tmp_path):
+    path = tmp_path / 'lutronbond.json'
+    path.write_text(json.dumps(DOCUMENT))
+    return str(path)
+
+
+def test_load__json(json_file):
+    assert configfile.load(json_file) == EXPECTED
+
+
+def test_load__yaml(tmp_path):
+    path = tmp_path / 'lutronbond.yaml'
+    path.write_text(YAML)
+
+    assert configfile.load(str(path)) == EXPECTED
+
+
+def test_load__toml(tmp_path):
+    path = tmp_path / 'lutronbond.toml'
+    path.write_text(TOML)
+
+    result = configfile.load(str(path))
+
+    # TOML has no null, so PRESS is left out instead
+    result['LUTRON_MAPPING'][21]['bond'][0]['actions']['BTN_1']['PRESS'] = None
+    assert result == EXPECTED
+
+
+LEVELS = {'ANY': {'SET_LEVEL': {'100.00': 'TurnOn', '0.00': 'TurnOff'}}}
+
+
+def test_load__json_levels(tmp_path):
+    path = tmp_path / 'lutronbond.json'
+    path.write_text(json.dumps({'lutron_mapping': {'21': {'bond': {
+        'id': '6409d2a2',
+        'actions': {'ANY': {'SET_LEVEL': {'100': 'TurnOn', '0': 'TurnOff'}}},
+    }}}}))
+
+    result = configfile.load(str(path))
+
+    assert result['LUTRON_MAPPING'][21]['bond'][0]['actions'] == LEVELS
+
+
+def test_load__toml_levels(tmp_path):
+    path = tmp_path / 'lutronbond.toml'
+    path.write_text(
+        '[lutron_mapping.21.bond]\n'
+        'id = "6409d2a2"\n'
+        'actions = { ANY = { SET_LEVEL = { 100 = "TurnOn", "0" = "TurnOff" } } }\n'
+    )
+
+    result = configfile.load(str(path))
+
+    assert result['LUTRON_MAPPING'][21]['bond'][0]['actions'] == LEVELS
+
+
+def test_load__invalid_levels(tmp_path):
+    path = tmp_path / 'lutronbond.json'
+    path.write_text(json.dumps({'lutron_mapping': {'21': {'bond': {
+        'id': '6409d2a2',
+        'actions': {'ANY': {'SET_LEVEL': {'full': 'TurnOn', 'nan': 'TurnOff'}}},
+    }}}}))
+
+    with pytest.raises(ValueError) as e:
+        configfile.load(str(path))
+
+    assert str(e.value).splitlines()[1:] == [
+        '  lutron_mapping.21.bond.actions.ANY.SET_LEVEL.full: '
+        'expected a level like 100 or "100.00"',
+        '  lutron_mapping.21.bond.actions.ANY.SET_LEVEL.nan: '
+        'expected a level like 100 or "100.00"',
+    ]
+
+
+def test_load__unknown_type(tmp_path):
+    path = tmp_path / 'lutronbond.ini'
+    path.write_text('')
+
+    with pytest.raises(ValueError) as e:
+        configfile.load(str(path))
+
+    assert 'Unknown config file type' in str(e.value)
+
+
+def test_load__invalid(tmp_path):
+    path = tmp_path / 'lutronbond.json'
+    path.write_text(json.dumps({
+        'lutron_mapping': {
+            'kitchen': {},
+            '5': {
+                'bond': {'id': 42, 'actions': {'BTN_9': {}, 'BTN_1': {'TAP': 'TurnOn'}}},
+                'tuya': [{'id': 'a', 'addr': '10.0.0.2', 'version': 3.3, 'actions': {}}],
+                'lutron': {'id': 50, 'actions': {'BTN_1': {'PRESS': 'SET_LEVEL'}}, 'mode': 1},
+                'hue': {},
+            },
+        },
+        'lutron3_mapping': {},
+    }))
+
+    with pytest.raises(ValueError) as e:
+        configfile.load(str(path))
+
+    assert str(e.value).splitlines()[1:] == [
+        '  lutron_mapping.kitchen: expected a Lutron integration ID',
+        '  lutron_mapping.5.bond.id: expected str',
+        '  lutron_mapping.5.bond.actions.BTN_9: unknown component',
+        '  lutron_mapping.5.bond.actions.BTN_1.TAP: unknown action',
+        '  lutron_mapping.5.tuya[0]: missing key',
+        '  lutron_mapping.5.lutron.mode: unknown setting',
+        '  lutron_mapping.5.lutron.actions.BTN_1.PRESS: expected a table like {SET_LEVEL: "100"}',
+        '  lutron_mapping.5.hue: unknown target kind',
+        '  lutron3_mapping: unknown section',
+    ]
+
+
+def test_validate__missing_mapping():
+    assert configfile.validate({}) == ['missing lutron_mapping']
+    assert configfile.validate([]) == [
+        'expected a table with lutron_mapping and optionally lutron2_mapping'
+    ]
+
+
+def test_load__cached(json_file, tmp_path, mocker):
+    cache_dir = str(tmp_path / 'cache')
+    configfile.load(json_file, cache_dir)
+    parse = mocker.spy(configfile, 'parse')
+
+    assert configfile.load(json_file, cache_dir) == EXPECTED
+
+    assert not parse.called
+    assert len(os.listdir(cache_dir)) == 1
+
+
+def test_load__shared(tmp_path):
+    actions = {'BTN_1': {'PRESS': 'TurnLightOn'}}
+    path = tmp_path / 'lutronbond.json'
+    path.write_text(json.dumps({'lutron_mapping': {
+        '21': {'bond': {'id': 'a', 'actions': actions}},
+        '22': {'bond': {'id': 'b', 'actions': actions}},
+    }}))
+    cache_dir = str(tmp_path / 'cache')
+
+    for _ in range(2):
+        # Compiled, then from the cache
+        mapping = configfile.load(str(path), cache_dir)['LUTRON_MAPPING']
+
+        assert mapping[21]['bond'][0]['actions'] is mapping[22]['bond'][0]['actions']
+
+
+def test_load__cache_invalidated(json_file, tmp_path):
+    cache_dir = str(tmp_path / 'cache')
+    configfile.load(json_file, cache_dir)
+    document = dict(DOCUMENT, lutron2_mapping={})
+    with open(json_file, 'w') as f:
+        json.dump(document, f)
+
+    result = configfile.load(json_file, cache_dir)
+
+    assert result['LUTRON2_MAPPING'] == {}
+    # The cache of the old file is gone
+    assert len(os.listdir(cache_dir)) == 1
+
+
+def test_load__cache_unreadable(json_file, tmp_path, mocker):
+    warning = mocker.patch.object(configfile.logger, 'warning')
+    cache_dir = str(tmp_path / 'cache')
+    configfile.load(json_file, cache_dir)
+    for name in os.listdir(cache_dir):
+        with open(os.path.join(cache_dir, name), 'wb') as f:
+            f.write(b'\xff')
+
+    assert configfile.load(json_file, cache_dir) == EXPECTED
+    assert warning.called
+
+
+def test_load__cache_unwritable(json_file, tmp_path, mocker):
+    warning = mocker.patch.object(configfile.logger, 'warning')
+    cache_dir = tmp_path / 'cache'
+    cache_dir.write_text('not a directory')
+
+    assert configfile.load(json_file, str(cache_dir)) == EXPECTED
+    assert warning.called
+
+
+def test_config(env, import_config, json_file, tmp_path):
+    env('LB_CONFIG_FILE', json_file)
+    env('LB_CONFIG_CACHE_DIR', str(tmp_path / 'cache'))
+
+    try:
+        config = import_config()
+
+        assert config.LUTRON_MAPPING == EXPECTED['LUTRON_MAPPING']
+        assert config.LUTRON2_MAPPING == EXPECTED['LUTRON2_MAPPING']
+    finally:
+        env('LB_CONFIG_FILE', None)
+        import_config()
+
+
+def test_config__import_order(json_file):
+    # Loading the file needs the lutron module, which imports config itself
+    result = subprocess.run(
+        [sys.executable, '-c', 'import lutronbond.lutron, lutronbond.config as c; '
+                               'print(sorted(c.LUTRON_MAPPING))'],
+        capture_output=True,
+        text=True,
+        env=dict(os.environ, LB_CONFIG_FILE=json_file, LB_CONFIG_CACHE_DIR=''),
+    )
+
+    assert result.stderr == ''
+    assert result.stdout.strip() == '[12, 21]'
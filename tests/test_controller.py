@@ -1,9 +1,12 @@
 import asyncio
+import json
 import signal
+import subprocess
+import sys
 
 import pytest
 
-from lutronbond import lutron, controller
+from lutronbond import backends, bond, config, controller, eventbus, lutron, tuya
 
 
 @pytest.fixture
@@ -19,17 +22,23 @@ def bus(mocker):
 
 
 @pytest.fixture
-def bond_get_handler(mocker):
+def uninstrumented(mocker):
+    # So handlers are subscribed just as the backend returned them
+    mocker.patch('lutronbond.latency.instrument', side_effect=lambda target, handler: handler)
+
+
+@pytest.fixture
+def bond_get_handler(mocker, uninstrumented):
     return mocker.patch('lutronbond.bond.get_handler')
 
 
 @pytest.fixture
-def tuya_get_handler(mocker):
+def tuya_get_handler(mocker, uninstrumented):
     return mocker.patch('lutronbond.tuya.get_handler')
 
 
 @pytest.fixture
-def lutron_get_handler(mocker):
+def lutron_get_handler(mocker, uninstrumented):
     return mocker.patch('lutronbond.lutron.get_handler')
 
 
@@ -69,6 +78,7 @@ def test__handler__valid_operation__DEVICE(import_config, logger, bus):
 
     logger.info.assert_called_with('Handling Lutron event: %s', event)
     bus.pub.assert_called_with('{}:{}'.format(config.LUTRON_BRIDGE_ADDR, 99), event)
+    assert event.dispatched_at is not None
 
 
 def test__handler__valid_operation__OUTPUT(import_config, logger, bus):
@@ -118,7 +128,9 @@ def test__add_bond_listener(
     )
     bond_get_handler.assert_called_with(subconfig['bond'])
     assert not tuya_get_handler.called
-    bus.sub.assert_called_with('{}:{}'.format(env_config.LUTRON_BRIDGE_ADDR, 99), handler)
+    bus.sub.assert_called_with(
+        '{}:{}'.format(env_config.LUTRON_BRIDGE_ADDR, 99), handler, 'bond:a1b2c3d4'
+    )
 
 
 def test__add_bond_listener_list(
@@ -169,11 +181,13 @@ def test__add_bond_listener_list(
     bus.sub.assert_has_calls([
         mocker.call(
             '{}:{}'.format(env_config.LUTRON_BRIDGE_ADDR, 99),
-            handler
+            handler,
+            'bond:a1b2c3d4'
         ),
         mocker.call(
             '{}:{}'.format(env_config.LUTRON_BRIDGE_ADDR, 99),
-            handler
+            handler,
+            'bond:e5f6g7h8'
         )
     ])
 
@@ -232,8 +246,8 @@ def test__add_bond_listeners__bridge2(
         mocker.call(subconfig2['bond'])
     ])
     bus.sub.assert_has_calls([
-        mocker.call('{}:{}'.format(env_config.LUTRON_BRIDGE_ADDR, 99), handler),
-        mocker.call('{}:{}'.format(env_config.LUTRON_BRIDGE2_ADDR, 88), handler)
+        mocker.call('{}:{}'.format(env_config.LUTRON_BRIDGE_ADDR, 99), handler, 'bond:a1b2c3d4'),
+        mocker.call('{}:{}'.format(env_config.LUTRON_BRIDGE2_ADDR, 88), handler, 'bond:a1b2c3d4')
     ])
 
 
@@ -270,7 +284,9 @@ def test__add_tuya_listener(
     )
     tuya_get_handler.assert_called_with(subconfig['tuya'])
     assert not bond_get_handler.called
-    bus.sub.assert_called_with('{}:{}'.format(env_config.LUTRON_BRIDGE_ADDR, 99), handler)
+    bus.sub.assert_called_with(
+        '{}:{}'.format(env_config.LUTRON_BRIDGE_ADDR, 99), handler, 'tuya:asdf'
+    )
 
 
 def test__add_tuya_listener_list(
@@ -326,11 +342,13 @@ def test__add_tuya_listener_list(
     bus.sub.assert_has_calls([
         mocker.call(
             '{}:{}'.format(env_config.LUTRON_BRIDGE_ADDR, 99),
-            handler
+            handler,
+            'tuya:asdf'
         ),
         mocker.call(
             '{}:{}'.format(env_config.LUTRON_BRIDGE_ADDR, 99),
-            handler
+            handler,
+            'tuya:qwer'
         )
     ])
 
@@ -366,7 +384,9 @@ def test__add_lutron_listener(
         env_config.LUTRON_BRIDGE_ADDR, 99, subconfig
     )
     lutron_get_handler.assert_called_with(subconfig['lutron'])
-    bus.sub.assert_called_with('{}:{}'.format(env_config.LUTRON_BRIDGE_ADDR, 99), handler)
+    bus.sub.assert_called_with(
+        '{}:{}'.format(env_config.LUTRON_BRIDGE_ADDR, 99), handler, 'lutron:1'
+    )
 
 
 def test__add_lutron_listener_list(
@@ -420,15 +440,47 @@ def test__add_lutron_listener_list(
     bus.sub.assert_has_calls([
         mocker.call(
             '{}:{}'.format(env_config.LUTRON_BRIDGE_ADDR, 99),
-            handler
+            handler,
+            'lutron:1'
         ),
         mocker.call(
             '{}:{}'.format(env_config.LUTRON_BRIDGE_ADDR, 99),
-            handler
+            handler,
+            'lutron:2:2'
         )
     ])
 
 
+def test__add_listeners__shared_target(mocker, logger, bus, bond_get_handler):
+    target = {'id': 'a1b2c3d4', 'actions': {'BTN_1': {'PRESS': 'TurnLightOn'}}}
+    mocker.patch('lutronbond.config.LUTRON_MAPPING', {
+        8: {'bond': target},
+        13: {'bond': target},
+        72: {'bond': dict(target)},
+    })
+    mocker.patch('lutronbond.config.LUTRON2_MAPPING', {1: {'bond': target}})
+
+    controller.add_listeners()
+
+    # One for the shared target and one for the copy
+    assert bond_get_handler.call_count == 2
+    assert bus.sub.call_count == 4
+
+
+def test__config__shared(import_config):
+    mapping = import_config().LUTRON_MAPPING
+
+    assert mapping[8]['bond'] is mapping[13]['bond']
+    assert mapping[21]['bond']['actions'] is mapping[72]['bond']['actions']
+
+
+def test__report_footprint(mocker, logger):
+    controller.report_footprint()
+
+    assert controller.MAPPING_BYTES.get() > 0
+    assert logger.info.called
+
+
 def test__add_tuya_and_bond_listeners(
         mocker, logger, bus, tuya_get_handler, bond_get_handler, import_config):
     env_config = import_config()
@@ -475,11 +527,13 @@ def test__add_tuya_and_bond_listeners(
     bus.sub.assert_has_calls([
         mocker.call(
             '{}:{}'.format(env_config.LUTRON_BRIDGE_ADDR, 99),
-            bond_handler
+            bond_handler,
+            'bond:a1b2c3d4'
         ),
         mocker.call(
             '{}:{}'.format(env_config.LUTRON_BRIDGE_ADDR, 99),
-            tuya_handler
+            tuya_handler,
+            'tuya:asdf'
         )
     ])
 
@@ -506,6 +560,65 @@ async def test__shutdown(mocker, amock, logger):
     controller.shutting_down = False
 
 
+@pytest.mark.asyncio
+async def test__shutdown__drains(mocker, amock, logger, real_bus):
+    mocker.patch('lutronbond.config.SHUTDOWN_TIMEOUT', 0.05)
+    get_connection = mocker.patch('lutronbond.lutron.LutronConnection')
+    get_connection.return_value.close = amock()
+    lutron.get_lutron_connection('a')
+    finished = []
+
+    async def quick(event):
+        await asyncio.sleep(0)
+        # The bridge connections are still open for Lutron targets
+        assert not get_connection.return_value.close.called
+        finished.append(event)
+
+    async def slow(event):
+        await asyncio.sleep(10)
+
+    real_bus.sub('quick', quick)
+    real_bus.sub('slow', slow, 'bond:a1b2c3d4')
+    real_bus.pub('quick', 1)
+    real_bus.pub('slow', 2)
+    dropped = controller.DROPPED.get('command')
+
+    await controller.shutdown()
+
+    assert finished == [1]
+    logger.warning.assert_has_calls([
+        mocker.call('Cancelled %s commands still running after %s seconds', 1, 0.05),
+        mocker.call('Cancelled command to %s for %s', 'bond:a1b2c3d4', '2'),
+    ])
+    assert controller.DROPPED.get('command') == dropped + 1
+    assert get_connection.return_value.close.called
+
+    # Only the first signal counts
+    get_connection.return_value.close.reset_mock()
+    await controller.shutdown()
+    assert not get_connection.return_value.close.called
+
+    controller.shutting_down = False
+
+
+def test__handler__shutting_down(mocker, logger, bus):
+    mocker.patch('lutronbond.controller.shutting_down', True)
+    event = lutron.LutronEvent(
+        lutron.Operation.DEVICE,
+        99,
+        lutron.Component.BTN_1,
+        lutron.DeviceAction.PRESS,
+        '',
+        config.LUTRON_BRIDGE_ADDR
+    )
+    dropped = controller.DROPPED.get('event')
+
+    controller.handler(event)
+
+    assert not bus.pub.called
+    assert controller.DROPPED.get('event') == dropped + 1
+
+
 @pytest.mark.asyncio
 async def test__start(mocker, logger, amock):
     loop = mocker.patch('asyncio.get_running_loop').return_value
@@ -529,6 +642,8 @@ async def test__start(mocker, logger, amock):
 
     await controller.start()
 
+    loop.add_signal_handler.assert_any_call(signal.SIGHUP, mocker.ANY)
+    loop.add_signal_handler.assert_any_call(signal.SIGTERM, mocker.ANY)
     loop.add_signal_handler.assert_called_with(signal.SIGINT, mocker.ANY)
     assert verify_connection.called
     assert keepalive.called
@@ -602,3 +717,370 @@ async def test__start__read_error(mocker, logger, amock):
     )
 
     controller.shutting_down = False
+
+
+@pytest.mark.asyncio
+async def test__start__lutron_only(mocker, logger, amock):
+    mocker.patch('asyncio.get_running_loop')
+    mocker.patch('lutronbond.config.LUTRON_MAPPING', {
+        99: {'lutron': {'id': 50, 'actions': {}}},
+    })
+    mocker.patch('lutronbond.config.LUTRON2_MAPPING', {})
+    get_backend = mocker.spy(backends, 'get_backend')
+    lutron_connection = mocker.patch(
+        'lutronbond.lutron.LutronConnection'
+    ).return_value
+    lutron_connection.open = amock(return_value=False)
+    lutron_connection.close = amock()
+
+    await controller.start()
+
+    assert {c.args[0] for c in get_backend.call_args_list} == {'lutron'}
+
+
+def test__get_target_kinds(mocker):
+    mocker.patch('lutronbond.config.LUTRON_MAPPING', {
+        1: {'name': 'A', 'tuya': {}},
+        2: {'tuya': [{}, {}]},
+    })
+    mocker.patch('lutronbond.config.LUTRON2_MAPPING', {3: {'lutron': {}}})
+
+    assert controller.get_target_kinds() == ['tuya', 'lutron']
+
+    mocker.patch('lutronbond.config.LUTRON_BRIDGE2_ADDR', '')
+
+    assert controller.get_target_kinds() == ['tuya']
+
+
+def test__import__no_target_dependencies():
+    # A fresh interpreter, as this one has imported everything already
+    code = (
+        'import sys, lutronbond.controller; '
+        'print(",".join(sorted({"aiohttp", "bond_async", "tinytuya"} & set(sys.modules))))'
+    )
+
+    result = subprocess.run(
+        [sys.executable, '-c', code], capture_output=True, check=True, text=True
+    )
+
+    assert result.stdout.strip() == ''
+
+
+@pytest.mark.asyncio
+async def test__start__parallel(mocker, logger, amock):
+    mocker.patch('asyncio.get_running_loop')
+    mocker.patch('lutronbond.bond.keepalive')
+    mocker.patch('lutronbond.controller.add_listeners')
+    report = mocker.patch('lutronbond.startup.report')
+    streaming = asyncio.Event()
+
+    async def verify_connection():
+        # Only finishes once events are being handled
+        await streaming.wait()
+
+    mocker.patch('lutronbond.bond.verify_connection', verify_connection)
+    lutron_connection = mocker.patch(
+        'lutronbond.lutron.LutronConnection'
+    ).return_value
+    lutron_connection.open = amock(return_value=True)
+    lutron_connection.close = amock()
+
+    async def stream(handler):
+        streaming.set()
+        # Startup finishes while events are being handled
+        while not report.called:
+            await asyncio.sleep(0.001)
+        controller.shutting_down = True
+
+    lutron_connection.stream = stream
+
+    await asyncio.wait_for(controller.start(), 1)
+
+    controller.shutting_down = False
+
+
+@pytest.mark.asyncio
+async def test__start__verify_failed(mocker, logger, amock):
+    mocker.patch('asyncio.get_running_loop')
+    keepalive = mocker.patch('lutronbond.bond.keepalive')
+    mocker.patch('lutronbond.controller.add_listeners')
+    mocker.patch(
+        'lutronbond.bond.verify_connection',
+        amock(side_effect=ConnectionRefusedError())
+    )
+    lutron_connection = mocker.patch(
+        'lutronbond.lutron.LutronConnection'
+    ).return_value
+    lutron_connection.open = amock(return_value=True)
+    lutron_connection.close = amock()
+
+    async def stream(handler):
+        await asyncio.Event().wait()
+
+    lutron_connection.stream = stream
+
+    with pytest.raises(ConnectionRefusedError):
+        await asyncio.wait_for(controller.start(), 1)
+
+    assert lutron_connection.close.called
+    assert keepalive.return_value.called
+
+
+def test__check_mappings(mocker, logger):
+    mocker.patch('lutronbond.config.LUTRON_MAPPING', {
+        60: {'lutron': {'id': 50, 'actions': {'BTN_1': {'PRESS': {'SET_LEVEL': '100'}}}}},
+        50: {'lutron': {'id': 60, 'actions': {'ANY': {'SET_LEVEL': {'BTN_1': 'PRESS'}}}}},
+    })
+    mocker.patch('lutronbond.config.LUTRON2_MAPPING', {})
+
+    controller.check_mappings()
+
+    logger.warning.assert_called_with(
+        mocker.ANY,
+        '10.0.0.10:50 ANY SET_LEVEL -> 10.0.0.10:60 BTN_1 PRESS -> 10.0.0.10:50 ANY SET_LEVEL'
+    )
+    assert not logger.info.called
+
+
+def test__check_mappings__fan_out(mocker, logger):
+    mocker.patch('lutronbond.config.LUTRON_MAPPING', {
+        60: {'lutron': {'id': 50, 'actions': {'BTN_1': {'PRESS': {'SET_LEVEL': '100'}}}}},
+        50: {'lutron': {'id': 51, 'actions': {'ANY': {'SET_LEVEL': {'BTN_1': 'PRESS'}}}}},
+    })
+    mocker.patch('lutronbond.config.LUTRON2_MAPPING', {})
+
+    controller.check_mappings()
+
+    assert not logger.warning.called
+    logger.info.assert_called_with(mocker.ANY, 2, '10.0.0.10:60 BTN_1 PRESS')
+
+
+def test__check_mappings__invalid(mocker, logger):
+    mocker.patch('lutronbond.config.LUTRON_MAPPING', {
+        21: {'bond': {'id': 'a', 'actions': {'BTN_1': {'PRESS': 'TurnLightOnn'}}}},
+    })
+    mocker.patch('lutronbond.config.LUTRON2_MAPPING', {})
+
+    with pytest.raises(ValueError, match="unknown Bond action 'TurnLightOnn'"):
+        controller.check_mappings()
+
+
+@pytest.fixture
+def config_file(mocker, tmp_path):
+    path = tmp_path / 'config.json'
+    mocker.patch('lutronbond.config.CONFIG_FILE', str(path), create=True)
+    mocker.patch('lutronbond.config.CONFIG_CACHE_DIR', '')
+    mocker.patch('lutronbond.config.LUTRON2_MAPPING', {})
+
+    def write(document):
+        path.write_text(json.dumps(document))
+
+    return write
+
+
+@pytest.fixture
+def real_bus(mocker):
+    bus = eventbus.EventBus()
+    mocker.patch('lutronbond.eventbus.get_bus', return_value=bus)
+    return bus
+
+
+@pytest.mark.asyncio
+async def test__reload(mocker, logger, config_file, real_bus):
+    mocker.patch('lutronbond.config.LUTRON_MAPPING', {
+        99: {'lutron': {'id': 50, 'actions': {}}},
+    })
+    controller.add_listeners()
+    config_file({'lutron_mapping': {'21': {'lutron': {'id': 51, 'actions': {}}}}})
+    successes = controller.RELOADS.get('success')
+
+    assert await controller.reload()
+
+    assert list(real_bus._bus) == ['{}:21'.format(config.LUTRON_BRIDGE_ADDR)]
+    assert config.LUTRON_MAPPING == {21: {'lutron': [{'id': 51, 'actions': {}}]}}
+    assert controller.RELOADS.get('success') == successes + 1
+
+
+@pytest.mark.asyncio
+async def test__reload__invalid(mocker, logger, config_file, real_bus):
+    mapping = {99: {'lutron': {'id': 50, 'actions': {}}}}
+    mocker.patch('lutronbond.config.LUTRON_MAPPING', mapping)
+    controller.add_listeners()
+    config_file({'lutron_mapping': {'21': {'lutron': {'id': 'x', 'actions': {}}}}})
+    failures = controller.RELOADS.get('failure')
+
+    assert not await controller.reload()
+
+    config_file({'lutron_mapping': {'21': {'lutron': {'id': 51, 'actions': {
+        'BTN_1': {'PRESS': {'SET_LEVELS': '100'}},
+    }}}}})
+
+    assert not await controller.reload()
+
+    assert list(real_bus._bus) == ['{}:99'.format(config.LUTRON_BRIDGE_ADDR)]
+    assert config.LUTRON_MAPPING is mapping
+    assert controller.RELOADS.get('failure') == failures + 2
+    assert logger.error.called
+
+
+@pytest.fixture
+def started(mocker):
+    mocker.patch.dict('lutronbond.controller.targets', clear=True)
+    mocker.patch('lutronbond.controller.stop_background', [])
+    return controller.targets
+
+
+@pytest.mark.asyncio
+async def test__reload__invalid_keeps_tuya_devices(
+        mocker, logger, config_file, real_bus, started
+):
+    mocker.patch('tinytuya.OutletDevice')
+    tuya.reset_device_cache()
+    started['tuya'] = tuya
+    mocker.patch('lutronbond.config.LUTRON_MAPPING', {
+        99: {'tuya': {'id': 'asdf', 'addr': '10.0.0.2', 'key': 'ghjk', 'version': 3.3,
+                      'actions': {}}},
+    })
+    controller.add_listeners()
+    devices = dict(tuya.devices)
+    config_file({'lutron_mapping': {
+        '21': {'tuya': {'id': 'asdf', 'addr': '10.0.0.3', 'key': 'ghjk', 'version': 3.3,
+                        'actions': {}}},
+        '22': {'tuya': {'id': 'qwer', 'addr': '10.0.0.4', 'key': 'tyui', 'version': 3.3,
+                        'actions': {}}},
+        '23': {'bond': {'id': 'a', 'bridge': 3, 'actions': {}}},
+    }})
+
+    assert not await controller.reload()
+
+    assert tuya.devices == devices
+    assert tuya.device_settings == {'asdf': ('10.0.0.2', 'ghjk', 3.3, None)}
+    tuya.reset_device_cache()
+
+
+@pytest.mark.asyncio
+async def test__reload__config_py(mocker, logger, real_bus, started, amock):
+    mocker.patch('tinytuya.OutletDevice')
+    mocker.patch('lutronbond.controller.warm_up', amock())
+    mocker.patch('lutronbond.controller.start_targets')
+    mocker.patch('lutronbond.config.LUTRON_MAPPING', {})
+
+    assert await controller.reload()
+
+    # Back to the mappings in config.py
+    assert config.LUTRON_MAPPING
+    assert len(real_bus._bus) == len(config.LUTRON_MAPPING) + len(config.LUTRON2_MAPPING)
+    tuya.reset_device_cache()
+
+
+@pytest.mark.asyncio
+async def test__reload__drains_removed_tuya_devices(mocker, logger, config_file, real_bus):
+    mocker.patch('tinytuya.OutletDevice')
+    tuya.reset_device_cache()
+    mocker.patch('lutronbond.config.LUTRON_MAPPING', {
+        99: {'tuya': {'id': 'asdf', 'addr': '10.0.0.2', 'key': 'ghjk', 'version': 3.3,
+                      'actions': {}}},
+    })
+    controller.add_listeners()
+    config_file({'lutron_mapping': {'21': {'lutron': {'id': 51, 'actions': {}}}}})
+    finish = asyncio.Event()
+
+    async def running_handler(event):
+        await finish.wait()
+
+    real_bus.sub('running', running_handler)
+    real_bus.pub('running', None)
+    reloading = asyncio.create_task(controller.reload())
+
+    await asyncio.sleep(0.05)
+    # Switched over, but waiting on the handler that was already running
+    assert list(real_bus._bus) == ['{}:21'.format(config.LUTRON_BRIDGE_ADDR)]
+    assert 'asdf' in tuya.devices
+
+    finish.set()
+    assert await reloading
+    assert 'asdf' not in tuya.devices
+
+
+BOND_MAPPING = {'21': {'bond': {'id': 'a', 'actions': {'BTN_1': {'PRESS': 'TurnLightOn'}}}}}
+
+
+@pytest.mark.asyncio
+async def test__reload__new_kind(mocker, logger, config_file, real_bus, started, amock):
+    mocker.patch('lutronbond.config.LUTRON_MAPPING', {
+        99: {'lutron': {'id': 50, 'actions': {}}},
+    })
+    controller.start_targets(controller.get_backends())
+    verify_connection = mocker.patch('lutronbond.bond.verify_connection', amock())
+    keepalive = mocker.patch('lutronbond.bond.keepalive')
+    config_file({'lutron_mapping': BOND_MAPPING})
+
+    assert await controller.reload()
+
+    assert verify_connection.called
+    assert keepalive.called
+    assert list(started) == ['lutron', 'bond']
+
+    close = mocker.patch('lutronbond.bond.close', amock())
+    await controller.close_targets()
+
+    assert keepalive.return_value.called
+    assert close.called
+    assert not started
+
+
+@pytest.mark.asyncio
+async def test__reload__warm_up_failed(mocker, logger, config_file, real_bus, started, amock):
+    mapping = {99: {'lutron': {'id': 50, 'actions': {}}}}
+    mocker.patch('lutronbond.config.LUTRON_MAPPING', mapping)
+    controller.start_targets(controller.get_backends())
+    controller.add_listeners()
+    mocker.patch(
+        'lutronbond.bond.verify_connection',
+        amock(side_effect=ConnectionRefusedError())
+    )
+    keepalive = mocker.patch('lutronbond.bond.keepalive')
+    close = mocker.patch('lutronbond.bond.close', amock())
+    config_file({'lutron_mapping': BOND_MAPPING})
+
+    assert not await controller.reload()
+
+    assert config.LUTRON_MAPPING is mapping
+    assert list(real_bus._bus) == ['{}:99'.format(config.LUTRON_BRIDGE_ADDR)]
+    assert not keepalive.called
+    assert close.called
+    assert list(started) == ['lutron']
+
+
+@pytest.mark.asyncio
+async def test__reload__started_kind(mocker, logger, config_file, real_bus, started, amock):
+    mocker.patch('lutronbond.config.LUTRON_MAPPING', {21: BOND_MAPPING['21']})
+    started['bond'] = bond
+    reload = mocker.patch('lutronbond.bond.reload', amock())
+    verify_connection = mocker.patch('lutronbond.bond.verify_connection', amock())
+    config_file({'lutron_mapping': BOND_MAPPING})
+
+    assert await controller.reload()
+
+    assert reload.called
+    assert not verify_connection.called
+
+
+@pytest.mark.parametrize('target, expected', [
+    ({'id': 'bondid'}, 'bond:bondid'),
+    ({'id': 40, 'bridge': 1}, 'lutron:40'),
+    ({'id': 40, 'bridge': 2}, 'lutron:2:40'),
+])
+def test_get_target_name(target, expected):
+    kind = expected.split(':')[0]
+    assert controller.get_target_name(kind, target) == expected
+
+
+def test_get_handler__instrumented(mocker, bond_get_handler):
+    instrument = mocker.patch('lutronbond.latency.instrument')
+    target = {'id': 'bondid'}
+
+    handler = controller.get_handler('bond', target, {})
+
+    instrument.assert_called_once_with('bond:bondid', bond_get_handler.return_value)
+    assert handler is instrument.return_value
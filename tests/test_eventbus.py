@@ -1,3 +1,4 @@
+import asyncio
 from collections import defaultdict
 
 import pytest
@@ -73,6 +74,76 @@ async def test_pub__action_with_args(bus, amock):
     action.assert_called_with(1, arg=2)
 
 
+@pytest.mark.asyncio
+async def test_pub__inflight_gauge(bus, amock):
+    eventbus.IN_FLIGHT.reset()
+    bus.sub('test', amock())
+
+    bus.pub('test')
+    assert eventbus.IN_FLIGHT.get() == 1
+
+    await bus.await_running_handlers()
+    assert eventbus.IN_FLIGHT.get() == 0
+
+
+@pytest.mark.asyncio
+async def test_replace(bus, amock):
+    old_action = amock()
+    new_action = amock()
+    bus.sub('old', old_action)
+    new_bus = eventbus.EventBus()
+    new_bus.sub('new', new_action)
+
+    bus.pub('old')
+    bus.replace(new_bus)
+    bus.pub('old')
+    bus.pub('new')
+    await bus.await_running_handlers()
+
+    # Started before the swap, so still runs
+    assert old_action.call_count == 1
+    assert new_action.call_count == 1
+
+
+@pytest.mark.asyncio
+async def test_await_running_handlers__return_exceptions(bus, amock):
+    bus.sub('test', amock(side_effect=RuntimeError))
+    bus.sub('test', amock())
+
+    bus.pub('test')
+
+    await bus.await_running_handlers(return_exceptions=True)
+    assert not bus._running_handlers
+
+
+@pytest.mark.asyncio
+async def test_drain(bus):
+    finished = []
+
+    async def quick(event):
+        await asyncio.sleep(0)
+        finished.append('quick')
+
+    async def slow(event):
+        await asyncio.sleep(10)
+        finished.append('slow')
+
+    bus.sub('test', quick)
+    bus.sub('test', slow, 'slow target')
+    bus.pub('test', 'event')
+
+    cancelled = await bus.drain(0.05)
+
+    assert [(task.get_name(), args) for task, args in cancelled] == [('slow target', ('event',))]
+    assert finished == ['quick']
+    assert not bus._running_handlers
+
+
+@pytest.mark.asyncio
+async def test_drain__idle(bus):
+    assert await bus.drain(10) == []
+
+
 def test_get_default_bus():
     result1 = eventbus.get_bus()
     result2 = eventbus.get_bus()
@@ -0,0 +1,59 @@
+import asyncio
+import sys
+import types
+
+import pytest
+
+from lutronbond import eventloop
+
+
+@pytest.fixture
+def uvloop(mocker):
+    module = types.SimpleNamespace(new_event_loop=asyncio.new_event_loop)
+    mocker.patch.dict(sys.modules, {'uvloop': module})
+    return module
+
+
+@pytest.fixture
+def no_uvloop(mocker):
+    # Importing a module that is None in sys.modules raises ImportError
+    mocker.patch.dict(sys.modules, {'uvloop': None})
+
+
+def test_get_loop_factory__auto(uvloop):
+    assert eventloop.get_loop_factory() == ('uvloop', uvloop.new_event_loop)
+
+
+def test_get_loop_factory__auto__fallback(no_uvloop):
+    assert eventloop.get_loop_factory('auto') == ('asyncio', asyncio.new_event_loop)
+
+
+def test_get_loop_factory__asyncio(uvloop):
+    assert eventloop.get_loop_factory('asyncio') == ('asyncio', asyncio.new_event_loop)
+
+
+def test_get_loop_factory__uvloop_missing(no_uvloop):
+    with pytest.raises(ValueError, match='pip install uvloop'):
+        eventloop.get_loop_factory('uvloop')
+
+
+def test_get_loop_factory__unknown():
+    with pytest.raises(ValueError, match='Unknown event loop: tokio'):
+        eventloop.get_loop_factory('tokio')
+
+
+def test_run(mocker):
+    loop_factory = mocker.Mock(side_effect=asyncio.new_event_loop)
+    mocker.patch('lutronbond.eventloop.get_loop_factory', return_value=('uvloop', loop_factory))
+
+    async def main():
+        await asyncio.sleep(0)
+        return 42
+
+    assert eventloop.run(main, 'uvloop') == 42
+    assert loop_factory.called
+
+
+@pytest.mark.asyncio
+async def test_current():
+    assert eventloop.current() == 'asyncio'
@@ -0,0 +1,46 @@
+from lutronbond import flyweight
+
+
+ACTIONS = {'BTN_1': {'PRESS': 'TurnLightOn', 'RELEASE': None}}
+
+
+def test_intern():
+    mapping = {
+        1: {'bond': {'id': 'a', 'actions': dict(ACTIONS)}},
+        2: {'bond': {'id': 'a', 'actions': dict(ACTIONS)}},
+        3: {'bond': {'id': 'b', 'actions': dict(ACTIONS)}},
+    }
+
+    result = flyweight.intern(mapping)
+
+    assert result == mapping
+    assert result[1]['bond'] is result[2]['bond']
+    assert result[1]['bond'] is not result[3]['bond']
+    assert result[1]['bond']['actions'] is result[3]['bond']['actions']
+    # The original is left alone
+    assert mapping[1]['bond'] is not mapping[2]['bond']
+
+
+def test_intern__types():
+    result = flyweight.intern([{'SetSpeed': 1}, {'SetSpeed': 1.0}, {'SetSpeed': True}, [1], [1]])
+
+    assert result[0] is not result[1]
+    assert result[0] is not result[2]
+    assert type(result[1]['SetSpeed']) is float
+    assert result[3] is result[4]
+
+
+def test_intern_all():
+    mapping1, mapping2 = flyweight.intern_all({1: dict(ACTIONS)}, {2: dict(ACTIONS)})
+
+    assert mapping1[1] is mapping2[2]
+
+
+def test_footprint():
+    shared = {'BTN_1': {'PRESS': 'TurnLightOn'}}
+    used, unshared = flyweight.footprint([shared, shared])
+    copied = {'BTN_1': {'PRESS': 'TurnLightOn'}}
+    copied_used, copied_unshared = flyweight.footprint([shared, copied])
+
+    assert used < copied_used <= unshared
+    assert unshared == copied_unshared
@@ -0,0 +1,93 @@
+import asyncio
+import time
+
+import pytest
+
+from lutronbond import latency, lutron, metrics
+
+
+@pytest.fixture(autouse=True)
+def reset_metrics():
+    metrics.reset()
+
+
+@pytest.fixture
+def event():
+    return lutron.LutronEvent(
+        lutron.Operation.DEVICE,
+        99,
+        lutron.Component.BTN_1,
+        lutron.DeviceAction.PRESS,
+        '',
+        '10.0.0.1',
+        timestamp=time.monotonic() - 0.5
+    )
+
+
+def test_record_parse(event):
+    latency.record_parse(event)
+
+    assert latency.EVENT_LATENCY.percentile(100, '10.0.0.1', 'parse') >= 0.5
+
+
+def test_record_dispatch(event):
+    latency.record_dispatch(event)
+
+    assert event.dispatched_at is not None
+    assert event.dispatched_at - event.timestamp >= 0.5
+    assert latency.EVENT_LATENCY.count('10.0.0.1', 'dispatch') == 1
+
+
+def test_record_queue(event):
+    event.dispatched_at = time.monotonic() - 0.25
+
+    latency.record_queue('bond:a', event)
+
+    assert latency.HANDLER_LATENCY.percentile(100, 'bond:a', 'queue') >= 0.25
+
+
+def test_record_queue__not_dispatched(event):
+    latency.record_queue('bond:a', event)
+
+    assert latency.HANDLER_LATENCY.count('bond:a', 'queue') == 0
+
+
+def test_record_handler():
+    latency.record_handler('bond:a', time.monotonic() - 0.1)
+
+    assert latency.HANDLER_LATENCY.percentile(100, 'bond:a', 'handler') >= 0.1
+
+
+def test_record_total(event):
+    latency.record_total('bond:a', event)
+
+    assert latency.HANDLER_LATENCY.percentile(100, 'bond:a', 'total') >= 0.5
+
+
+@pytest.mark.asyncio
+async def test_instrument(event):
+    event.dispatched_at = time.monotonic() - 0.25
+
+    async def handler(event):
+        await asyncio.sleep(0.01)
+        return True
+
+    assert await latency.instrument('bond:a', handler)(event) is True
+
+    assert latency.HANDLER_LATENCY.percentile(100, 'bond:a', 'queue') >= 0.25
+    assert latency.HANDLER_LATENCY.percentile(100, 'bond:a', 'handler') >= 0.01
+    assert latency.HANDLER_LATENCY.percentile(100, 'bond:a', 'total') >= 0.5
+
+
+@pytest.mark.asyncio
+async def test_instrument__not_sent(event):
+    event.dispatched_at = time.monotonic()
+
+    async def handler(event):
+        return False
+
+    assert await latency.instrument('bond:a', handler)(event) is False
+
+    assert latency.HANDLER_LATENCY.count('bond:a', 'queue') == 1
+    assert latency.HANDLER_LATENCY.count('bond:a', 'handler') == 0
+    assert latency.HANDLER_LATENCY.count('bond:a', 'total') == 0
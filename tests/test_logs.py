@@ -0,0 +1,77 @@
+import io
+import json
+import logging
+
+import pytest
+
+from lutronbond import logs, lutron
+
+
+@pytest.fixture(autouse=True)
+def root_logger():
+    root = logging.getLogger()
+    handlers, level = root.handlers[:], root.level
+    yield root
+    root.handlers[:] = handlers
+    root.setLevel(level)
+
+
+@pytest.fixture
+def event():
+    return lutron.LutronEvent(
+        lutron.Operation.DEVICE,
+        60,
+        lutron.Component.BTN_1,
+        lutron.DeviceAction.PRESS,
+        '',
+        '10.0.0.10'
+    )
+
+
+def test_setup(root_logger):
+    stream = io.StringIO()
+
+    stop = logs.setup('INFO', stream=stream)
+    logging.getLogger('lutronbond.test').info('Hello %s', 'world')
+    logging.getLogger('lutronbond.test').debug('Hidden')
+    stop()
+
+    assert isinstance(root_logger.handlers[-1], logs.QueueHandler)
+    assert stream.getvalue() == 'INFO:lutronbond.test:Hello world\n'
+
+
+def test_setup__json(event):
+    stream = io.StringIO()
+
+    stop = logs.setup(logging.INFO, 'json', stream=stream)
+    logging.getLogger('lutronbond.test').info('Handling Lutron event: %s', event)
+    stop()
+
+    record = json.loads(stream.getvalue())
+    assert record['level'] == 'INFO'
+    assert record['logger'] == 'lutronbond.test'
+    assert record['message'] == 'Handling Lutron event: {}'.format(event)
+    assert record['lutron'] == {
+        'type': 'LutronEvent',
+        'bridge': '10.0.0.10',
+        'operation': 'DEVICE',
+        'device': 60,
+        'component': 'BTN_1',
+        'action': 'PRESS',
+        'parameters': None,
+    }
+
+
+def test_setup__no_queue(root_logger, event):
+    stream = io.StringIO()
+
+    logs.setup('INFO', 'json', use_queue=False, stream=stream)
+    logging.getLogger('lutronbond.test').info('Sent %s', event)
+
+    assert isinstance(root_logger.handlers[-1], logging.StreamHandler)
+    assert json.loads(stream.getvalue())['lutron']['device'] == 60
+
+
+def test_setup__unknown_format():
+    with pytest.raises(ValueError, match='Unknown log format: xml'):
+        logs.setup('INFO', 'xml')
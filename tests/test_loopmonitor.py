@@ -0,0 +1,138 @@
+import asyncio
+import time
+
+import pytest
+
+from lutronbond import loopmonitor
+
+
+@pytest.fixture(autouse=True)
+def reset_metrics():
+    yield
+    loopmonitor.SLOW_CALLBACKS.reset()
+    loopmonitor.LOOP_LAG.reset()
+    loopmonitor.LOOP_LAG_HISTOGRAM.reset()
+
+
+async def blocking_task():
+    await asyncio.sleep(0)
+    time.sleep(0.02)
+    await asyncio.sleep(0)
+
+
+@pytest.mark.asyncio
+async def test_slow_callback_detector(mocker):
+    warning = mocker.patch.object(loopmonitor.logger, 'warning')
+    uninstall = loopmonitor.install_slow_callback_detector(0.01)
+
+    try:
+        await asyncio.create_task(blocking_task(), name='blocker')
+    finally:
+        assert uninstall()
+
+    assert loopmonitor.SLOW_CALLBACKS.get() == 1
+    message, duration, description = warning.call_args[0]
+    assert duration >= 20
+    assert description.startswith('task blocker (blocking_task) at ')
+    # Suspended at the await following the blocking call
+    line = blocking_task.__code__.co_firstlineno + 3
+    assert description.endswith('test_loopmonitor.py:{}'.format(line))
+
+
+@pytest.mark.asyncio
+async def test_slow_callback_detector__fast_callbacks(mocker):
+    warning = mocker.patch.object(loopmonitor.logger, 'warning')
+    uninstall = loopmonitor.install_slow_callback_detector(1)
+
+    try:
+        await asyncio.create_task(asyncio.sleep(0))
+    finally:
+        uninstall()
+
+    assert loopmonitor.SLOW_CALLBACKS.get() == 0
+    assert not warning.called
+
+
+def test_slow_callback_detector__uninstall():
+    original = asyncio.events.Handle._run
+
+    loopmonitor.install_slow_callback_detector(0.01)()
+
+    assert asyncio.events.Handle._run is original
+
+
+def test_describe__plain_callback():
+    loop = asyncio.new_event_loop()
+    handle = loop.call_soon(print)
+
+    try:
+        assert loopmonitor.describe(handle).startswith('<Handle print()')
+    finally:
+        handle.cancel()
+        loop.close()
+
+
+@pytest.mark.asyncio
+async def test_sample_lag(mocker):
+    mocker.patch.object(loopmonitor, 'SAMPLE_INTERVAL', 0.01)
+    mocker.patch('lutronbond.config.LOOP_MONITOR', 5)
+    warning = mocker.patch.object(loopmonitor.logger, 'warning')
+
+    task = asyncio.create_task(loopmonitor.sample_lag())
+    await asyncio.sleep(0)
+    time.sleep(0.03)
+    await asyncio.sleep(0.02)
+    task.cancel()
+
+    assert loopmonitor.LOOP_LAG_HISTOGRAM.percentile(100) >= 0.015
+    assert warning.called
+
+
+def test_start__disabled(mocker):
+    mocker.patch('lutronbond.config.METRICS_PORT', 0)
+    mocker.patch('lutronbond.config.LOOP_MONITOR', 0)
+    install = mocker.patch.object(loopmonitor, 'install_slow_callback_detector')
+
+    assert loopmonitor.start()()
+    assert not install.called
+
+
+@pytest.mark.asyncio
+async def test_start__enabled(mocker):
+    mocker.patch('lutronbond.config.LOOP_MONITOR', 50)
+    uninstall = mocker.Mock()
+    install = mocker.patch.object(
+        loopmonitor,
+        'install_slow_callback_detector',
+        return_value=uninstall
+    )
+
+    loopmonitor.start()()
+
+    install.assert_called_with(0.05)
+    assert uninstall.called
+
+
+@pytest.mark.asyncio
+async def test_start__uvloop(mocker):
+    mocker.patch('lutronbond.config.LOOP_MONITOR', 50)
+    mocker.patch('lutronbond.eventloop.current', return_value='uvloop')
+    logger = mocker.patch('lutronbond.loopmonitor.logger')
+    install = mocker.patch.object(loopmonitor, 'install_slow_callback_detector')
+
+    loopmonitor.start()()
+
+    assert logger.warning.called
+    assert not install.called
+
+
+@pytest.mark.parametrize('name,monitor,expected', [
+    ('auto', 0, 'auto'),
+    ('auto', 20, 'asyncio'),
+    ('uvloop', 20, 'uvloop'),
+    ('asyncio', 20, 'asyncio'),
+])
+def test_choose_loop(mocker, name, monitor, expected):
+    mocker.patch('lutronbond.config.LOOP_MONITOR', monitor)
+
+    assert loopmonitor.choose_loop(name) == expected
@@ -13,6 +13,22 @@ BRIDGE_ADDR = '10.0.0.1'
 ##
 
 
+def test__LutronEvent__init__timestamp(mocker):
+    mocker.patch('time.monotonic', return_value=42.0)
+
+    event = lutron.LutronEvent(
+        lutron.Operation.UNKNOWN,
+        -99,
+        lutron.Component.UNKNOWN,
+        lutron.DeviceAction.UNKNOWN,
+        "",
+        BRIDGE_ADDR
+    )
+
+    assert event.timestamp == 42.0
+    assert event.dispatched_at is None
+
+
 def test__LutronEvent__init():
     event = lutron.LutronEvent(
         lutron.Operation.UNKNOWN,
@@ -38,6 +54,15 @@ def test__LutronEvent__parse__unrecognized_event():
         lutron.LutronEvent.parse(rawevent, BRIDGE_ADDR)
 
 
+def test__LutronEvent__parse__debug_off(mocker):
+    logger = mocker.patch('lutronbond.lutron.logger')
+    logger.isEnabledFor.return_value = False
+
+    lutron.LutronEvent.parse(b"~DEVICE,60,2,3", BRIDGE_ADDR)
+
+    assert not logger.debug.called
+
+
 def test__LutronEvent__parse__invalid_event():
     rawevent = b"~OUTPUT,16,1"
 
@@ -273,6 +298,20 @@ async def test__LutronConnection__connect(
     assert asyncio_open_connection.called
     assert lutron_connection.is_connected is True
     assert result is True
+    assert lutron.RECONNECTS.get('10.0.0.1') == 0
+
+
+@pytest.mark.asyncio
+async def test__LutronConnection__connect__reconnect(
+        lutron_connection,
+        asyncio_open_connection
+):
+    lutron.RECONNECTS.reset()
+
+    await lutron_connection.connect()
+    await lutron_connection.connect()
+
+    assert lutron.RECONNECTS.get('10.0.0.1') == 1
 
 
 @pytest.mark.asyncio
@@ -481,6 +520,35 @@ async def test__LutronConnection__stream__valid_data(
     )
 
 
+@pytest.mark.asyncio
+async def test__LutronConnection__stream__receive_time(
+        mocker,
+        logged_in_lutron_connection
+):
+    monotonic = mocker.patch('time.monotonic', return_value=1234.5)
+    event = lutron.LutronEvent(
+        lutron.Operation.DEVICE,
+        1,
+        lutron.Component.BTN_1,
+        lutron.DeviceAction.PRESS,
+        "",
+        BRIDGE_ADDR,
+        timestamp=1.0
+    )
+    mocker.patch('lutronbond.lutron.LutronEvent.parse', return_value=event)
+
+    logged_in_lutron_connection._reader.readuntil.side_effect = [
+        b'~DEVICE,1,2,3\r\n',
+        asyncio.exceptions.IncompleteReadError(b'', 32),
+    ]
+
+    with pytest.raises(asyncio.exceptions.IncompleteReadError):
+        await logged_in_lutron_connection.stream(mocker.Mock())
+
+    assert monotonic.called
+    assert event.timestamp == 1234.5
+
+
 @pytest.fixture
 def lutron_command():
     return lutron.LutronCommand(
@@ -554,6 +622,7 @@ def test_get_lutron_connection():
     result2 = lutron.get_lutron_connection('10.0.0.1')
 
     assert result1 is result2
+    assert result1.port == 23
     assert len(lutron.connections) == 1
 
 
@@ -600,6 +669,11 @@ def logger(mocker):
     return mocker.patch('lutronbond.lutron.logger')
 
 
+@pytest.fixture(autouse=True)
+def reset_recent_commands():
+    lutron.recent_commands.clear()
+
+
 def test_get_handler__missing_actions():
     with pytest.raises(KeyError):
         lutron.get_handler({})
@@ -1042,3 +1116,50 @@ async def test_handler__output_event__unknown_output_action(
         lutron_output_event.action,
         lutron_output_event.parameters
     )
+
+
+def test_is_storm(mocker, lutron_command):
+    mocker.patch('lutronbond.config.STORM_LIMIT', 2)
+    mocker.patch('lutronbond.config.STORM_WINDOW', 1.0)
+    monotonic = mocker.patch('time.monotonic', return_value=100.0)
+    other_command = lutron.LutronCommand(
+        lutron.Operation.OUTPUT,
+        2,
+        lutron.Component.ANY,
+        lutron.OutputAction.SET_LEVEL,
+        '100',
+        BRIDGE_ADDR
+    )
+
+    assert not lutron.is_storm(lutron_command)
+    assert not lutron.is_storm(lutron_command)
+    assert lutron.is_storm(lutron_command)
+    assert not lutron.is_storm(other_command)
+
+    monotonic.return_value = 101.5
+
+    assert not lutron.is_storm(lutron_command)
+
+
+def test_is_storm__disabled(mocker, lutron_command):
+    mocker.patch('lutronbond.config.STORM_LIMIT', 0)
+
+    assert not any(lutron.is_storm(lutron_command) for _ in range(100))
+
+
+@pytest.mark.asyncio
+async def test_handler__storm(get_lutron_connection, lutron_device_event, logger, mocker):
+    mocker.patch('lutronbond.config.STORM_LIMIT', 3)
+    mocker.patch('lutronbond.config.STORM_WINDOW', 1.0)
+    handler = lutron.get_handler({
+        'actions': {'BTN_1': {'PRESS': {'SET_LEVEL': '100'}}},
+        'id': 2
+    })
+    suppressed = lutron.STORM_SUPPRESSED.get('lutron:10.0.0.10:2')
+
+    results = [await handler(lutron_device_event) for _ in range(5)]
+
+    assert results == [True, True, True, False, False]
+    assert get_lutron_connection.send.call_count == 3
+    assert lutron.STORM_SUPPRESSED.get('lutron:10.0.0.10:2') == suppressed + 2
+    assert logger.warning.called
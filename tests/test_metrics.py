@@ -0,0 +1,227 @@
+import asyncio
+
+import pytest
+
+from lutronbond import metrics
+
+
+@pytest.fixture
+def registry(mocker):
+    return mocker.patch.dict(metrics.registry, clear=True)
+
+
+def test_counter():
+    counter = metrics.Counter('test_total', 'Test', ['device'])
+
+    counter.inc('a')
+    counter.inc('a')
+    counter.inc('b', amount=3)
+
+    assert counter.get('a') == 2
+    assert counter.get('b') == 3
+    assert counter.get('c') == 0
+
+
+def test_counter__reset():
+    counter = metrics.Counter('test_total', 'Test')
+    counter.inc()
+
+    counter.reset()
+
+    assert counter.get() == 0
+
+
+def test_metric__abstract():
+    class Incomplete(metrics.BucketMetric):
+        def reset(self):
+            pass
+
+    with pytest.raises(TypeError):
+        metrics.Metric('test', 'Test')  # type: ignore
+
+    with pytest.raises(TypeError, match='cumulative'):
+        Incomplete('test', 'Test')  # type: ignore
+
+
+def test_histogram():
+    histogram = metrics.Histogram(
+        'test_seconds', 'Test', ['device'], buckets=(0.1, 1.0, float('inf'))
+    )
+
+    histogram.observe(0.05, 'a')
+    histogram.observe(0.1, 'a')
+    histogram.observe(0.5, 'a')
+    histogram.observe(5, 'a')
+
+    assert histogram.counts[('a',)] == [2, 1, 1]
+    assert histogram.sums[('a',)] == pytest.approx(5.65)
+    assert histogram.count('a') == 4
+    assert histogram.count('b') == 0
+
+
+@pytest.fixture
+def latency_histogram():
+    return metrics.LatencyHistogram(
+        'test_seconds', 'Test', ['target'], buckets=(0.01, 0.1, float('inf'))
+    )
+
+
+def test_latency_histogram__percentile(latency_histogram):
+    for i in range(1, 1001):
+        latency_histogram.observe(i / 1000, 'a')
+
+    assert latency_histogram.count('a') == 1000
+    assert latency_histogram.percentile(50, 'a') == pytest.approx(0.5, rel=0.035)
+    assert latency_histogram.percentile(99, 'a') == pytest.approx(0.99, rel=0.035)
+    assert latency_histogram.percentile(100, 'a') == pytest.approx(1.0, rel=0.035)
+    assert latency_histogram.percentile(50, 'b') == 0
+
+
+def test_latency_histogram__small_values_exact(latency_histogram):
+    latency_histogram.observe(0.000005, 'a')
+
+    assert latency_histogram.percentile(100, 'a') == pytest.approx(0.000005)
+
+
+def test_latency_histogram__negative(latency_histogram):
+    latency_histogram.observe(-1, 'a')
+
+    assert latency_histogram.percentile(100, 'a') == 0
+
+
+def test_latency_histogram__buckets_cover_values(latency_histogram):
+    for value in range(0, 100000, 7):
+        index = latency_histogram._index(value)
+
+        assert latency_histogram._upper_bound(index) >= value
+        if index:
+            assert latency_histogram._upper_bound(index - 1) < value
+
+
+def test_latency_histogram__cumulative(latency_histogram):
+    latency_histogram.observe(0.005, 'a')
+    latency_histogram.observe(0.05, 'a')
+    latency_histogram.observe(0.06, 'a')
+    latency_histogram.observe(5, 'a')
+
+    assert latency_histogram.cumulative('a') == [1, 3, 4]
+    assert latency_histogram.sums[('a',)] == pytest.approx(5.115)
+
+
+def test_latency_histogram__reset(latency_histogram):
+    latency_histogram.observe(1, 'a')
+
+    latency_histogram.reset()
+
+    assert latency_histogram.count('a') == 0
+
+
+def test_register(registry):
+    counter = metrics.counter('test_total', 'Test')
+
+    assert metrics.registry['test_total'] is counter
+
+
+def test_register__duplicate(registry):
+    metrics.counter('test_total', 'Test')
+
+    with pytest.raises(ValueError):
+        metrics.histogram('test_total', 'Test')
+
+
+def test_reset(registry):
+    counter = metrics.counter('test_total', 'Test')
+    histogram = metrics.histogram('test_seconds', 'Test')
+    counter.inc()
+    histogram.observe(1)
+
+    metrics.reset()
+
+    assert counter.get() == 0
+    assert histogram.count() == 0
+
+
+def test_render(registry):
+    counter = metrics.counter('test_total', 'Test counter', ['device'])
+    histogram = metrics.histogram('test_seconds', 'Test histogram', buckets=(1, float('inf')))
+    counter.inc('a "quoted"\\name')
+    histogram.observe(0.5)
+    histogram.observe(2)
+
+    assert metrics.render() == (
+        '# HELP test_total Test counter\n'
+        '# TYPE test_total counter\n'
+        'test_total{device="a \\"quoted\\"\\\\name"} 1\n'
+        '# HELP test_seconds Test histogram\n'
+        '# TYPE test_seconds histogram\n'
+        'test_seconds_bucket{le="1"} 1\n'
+        'test_seconds_bucket{le="+Inf"} 2\n'
+        'test_seconds_sum 2.5\n'
+        'test_seconds_count 2\n'
+    )
+
+
+@pytest.fixture
+def metrics_server(registry, mocker):
+    mocker.patch('lutronbond.config.METRICS_ADDR', '127.0.0.1')
+    metrics.counter('test_total', 'Test').inc()
+
+    async def request(request_line):
+        server = await asyncio.start_server(metrics.handle_request, '127.0.0.1', 0)
+        port = server.sockets[0].getsockname()[1]
+
+        async with server:
+            reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            writer.write(request_line + b'Host: localhost\r\n\r\n')
+            response = await reader.read()
+            writer.close()
+
+        return response
+
+    return request
+
+
+@pytest.mark.asyncio
+async def test_handle_request(metrics_server):
+    response = await metrics_server(b'GET /metrics HTTP/1.1\r\n')
+
+    headers, body = response.split(b'\r\n\r\n', 1)
+    assert headers.startswith(b'HTTP/1.1 200 OK\r\n')
+    assert b'Content-Type: text/plain; version=0.0.4' in headers
+    assert b'test_total 1\n' in body
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('request_line,status', [
+    (b'GET / HTTP/1.1\r\n', b'404 Not Found'),
+    (b'POST /metrics HTTP/1.1\r\n', b'405 Method Not Allowed'),
+    (b'garbage\r\n', b'400 Bad Request'),
+])
+async def test_handle_request__error(metrics_server, request_line, status):
+    response = await metrics_server(request_line)
+
+    assert response.startswith(b'HTTP/1.1 ' + status)
+
+
+@pytest.mark.asyncio
+async def test_handle_request__timeout(registry, mocker):
+    mocker.patch('lutronbond.metrics.REQUEST_TIMEOUT', 0.05)
+    server = await asyncio.start_server(metrics.handle_request, '127.0.0.1', 0)
+    port = server.sockets[0].getsockname()[1]
+
+    async with server:
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        # Never finishes the request
+        writer.write(b'GET /metrics HTTP/1.1\r\n')
+        response = await asyncio.wait_for(reader.read(), 1)
+        writer.close()
+
+    assert response == b''
+
+
+def test_serve__disabled(mocker):
+    mocker.patch('lutronbond.config.METRICS_PORT', 0)
+    create_task = mocker.patch('asyncio.AbstractEventLoop.create_task')
+
+    assert metrics.serve()()
+    create_task.assert_not_called()
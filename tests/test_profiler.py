@@ -0,0 +1,64 @@
+import pstats
+import signal
+
+import pytest
+
+from lutronbond import profiler
+
+
+@pytest.fixture(autouse=True)
+def profile_dir(mocker, tmp_path):
+    mocker.patch('lutronbond.config.PROFILE_DIR', str(tmp_path))
+    yield tmp_path
+    if profiler.profile is not None:
+        profiler.profile.disable()
+        profiler.profile = None
+
+
+def test_start_stop_profiling(profile_dir):
+    assert profiler.start_profiling() is True
+    sum(range(1000))
+    path = profiler.stop_profiling()
+
+    assert path is not None
+    assert path.startswith(str(profile_dir))
+    assert pstats.Stats(path).stats  # type: ignore
+    assert profiler.profile is None
+
+
+def test_start_profiling__already_running(mocker):
+    warning = mocker.patch.object(profiler.logger, 'warning')
+    profiler.start_profiling()
+    current = profiler.profile
+
+    assert profiler.start_profiling() is False
+    assert profiler.profile is current
+    warning.assert_called_with('Profiler is already running')
+
+
+def test_stop_profiling__not_running(mocker):
+    warning = mocker.patch.object(profiler.logger, 'warning')
+
+    assert profiler.stop_profiling() is None
+    warning.assert_called_with('Profiler is not running')
+
+
+def test_stop_profiling__write_error(mocker, profile_dir):
+    mocker.patch('lutronbond.config.PROFILE_DIR', str(profile_dir / 'missing'))
+    error = mocker.patch.object(profiler.logger, 'error')
+    profiler.start_profiling()
+
+    assert profiler.stop_profiling() is None
+    assert error.called
+    assert profiler.profile is None
+
+
+def test_install(mocker):
+    loop = mocker.Mock()
+
+    profiler.install(loop)
+
+    loop.add_signal_handler.assert_has_calls([
+        mocker.call(signal.SIGUSR1, profiler.start_profiling),
+        mocker.call(signal.SIGUSR2, profiler.stop_profiling),
+    ])
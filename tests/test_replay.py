@@ -0,0 +1,137 @@
+import argparse
+
+import pytest
+import pytest_asyncio
+
+from lutronbond import bond, breaker, capture, config, eventbus, lutron, replay, tuya
+
+
+MAPPING = {
+    5: {
+        'bond': {'id': 'fan', 'actions': {'BTN_1': {'PRESS': 'TurnLightOn'}}},
+        'tuya': {
+            'id': 'plug',
+            'addr': '10.0.0.40',
+            'key': '0123456789abcdef',
+            'version': 3.3,
+            'actions': {'BTN_1': {'PRESS': 'TurnOn'}},
+        },
+    },
+    6: {
+        'lutron': {'id': 50, 'actions': {'BTN_1': {'PRESS': {'SET_LEVEL': '100'}}}},
+    },
+}
+
+
+@pytest_asyncio.fixture
+async def stubbed(mocker):
+    mocker.patch('lutronbond.config.LUTRON_BRIDGE_ADDR', '10.0.0.10')
+    mocker.patch('lutronbond.config.LUTRON_BRIDGE2_ADDR', '', create=True)
+    mocker.patch('lutronbond.config.LUTRON_MAPPING', MAPPING)
+    mocker.patch('lutronbond.config.BOND_BRIDGE2_ADDR', '', create=True)
+    eventbus.get_bus.cache_clear()
+    tuya.reset_device_cache()
+    bond.get_bond_connection.cache_clear()
+    lutron.reset_connection_cache()
+
+    replay.controller.add_listeners()
+    yield replay.stub_targets()
+
+    await bond.close()
+    eventbus.get_bus.cache_clear()
+    tuya.reset_device_cache()
+    bond.get_bond_connection.cache_clear()
+    lutron.reset_connection_cache()
+    breaker.reset()
+
+
+@pytest.mark.asyncio
+async def test_replay(stubbed, mocker):
+    warning = mocker.patch.object(replay.logger, 'warning')
+    records = [
+        capture.Record(1.0, '10.0.0.10', b'~DEVICE,5,2,3\r\n'),
+        capture.Record(2.0, '10.0.0.10', b'GNET> \r\n'),
+        capture.Record(3.0, '192.168.1.2', b'~DEVICE,6,2,3\r\n'),
+        capture.Record(4.0, '10.0.0.99', b'~DEVICE,6,2,3\r\n'),
+    ]
+
+    result = await replay.replay(records, None, bridges={'192.168.1.2': '10.0.0.10'})
+
+    assert result['lines'] == 4
+    assert result['events'] == 3
+    assert result['unparsed'] == 1
+    assert result['captured_seconds'] == 3.0
+    assert stubbed == {'bond': 1, 'tuya': 1, 'lutron': 1}
+    warning.assert_called_once()
+    assert warning.call_args.args[1] == '10.0.0.99'
+
+
+@pytest.mark.asyncio
+async def test_replay__speed(stubbed):
+    records = [
+        capture.Record(100.0, '10.0.0.10', b'~DEVICE,5,2,3\r\n'),
+        # The program was restarted here
+        capture.Record(0.0, '10.0.0.10', b'~DEVICE,5,2,4\r\n'),
+        capture.Record(0.5, '10.0.0.10', b'~DEVICE,5,2,3\r\n'),
+        capture.Record(3600.5, '10.0.0.10', b'~DEVICE,5,2,4\r\n'),
+    ]
+
+    result = await replay.replay(records, speed=10, max_gap=1)
+
+    assert result['captured_seconds'] == 1.5
+    assert 0.15 <= result['elapsed_seconds'] < 1
+    assert stubbed['bond'] == 2
+
+
+@pytest.mark.asyncio
+async def test_main(stubbed, mocker, tmp_path, capsys):
+    path = str(tmp_path / 'traffic.lbcap')
+    writer = capture.CaptureWriter(path)
+    writer.write('10.0.0.10', b'~DEVICE,6,2,3\r\n', 1.0)
+    writer.close()
+    mocker.patch('lutronbond.config.LUTRON_MAPPING', {})
+    mocker.patch('lutronbond.config.STORM_LIMIT', 10)
+
+    assert await replay.main([path, '--stub', '--speed', 'max']) == 0
+
+    assert 'Replayed 1 lines (1 events, 0 unparsed)' in capsys.readouterr().out
+    assert config.STORM_LIMIT == 0
+
+
+def test_parse_args__storm_limit():
+    assert replay.parse_args(['traffic.lbcap']).storm_limit == 0
+    assert replay.parse_args(['traffic.lbcap', '--storm-limit', '5']).storm_limit == 5
+
+
+@pytest.mark.asyncio
+async def test_main__warms_up(stubbed, mocker, amock, tmp_path, capsys):
+    path = str(tmp_path / 'traffic.lbcap')
+    capture.CaptureWriter(path).close()
+    open_connections = mocker.patch(
+        'lutronbond.controller.open_connections', amock(return_value=True)
+    )
+    warm_up = mocker.patch('lutronbond.controller.warm_up', amock())
+    start_targets = mocker.patch('lutronbond.controller.start_targets')
+    close_targets = mocker.patch('lutronbond.controller.close_targets', amock())
+
+    assert await replay.main([path]) == 0
+
+    assert list(warm_up.call_args.args[0]) == ['bond', 'tuya', 'lutron']
+    start_targets.assert_called_with(warm_up.call_args.args[0])
+    assert open_connections.called
+    assert close_targets.called
+
+
+def test_parse_speed():
+    assert replay.parse_speed('max') is None
+    assert replay.parse_speed('60') == 60
+
+    with pytest.raises(argparse.ArgumentTypeError):
+        replay.parse_speed('0')
+
+
+def test_parse_bridge():
+    assert replay.parse_bridge('192.168.1.2=127.0.0.1') == ('192.168.1.2', '127.0.0.1')
+
+    with pytest.raises(argparse.ArgumentTypeError):
+        replay.parse_bridge('192.168.1.2')
@@ -0,0 +1,152 @@
+import asyncio
+import random
+
+import aiohttp
+import bond_async  # type: ignore
+import pytest
+import pytest_asyncio
+
+from lutronbond import bond, breaker, lutron, metrics
+from lutronbond.sim import bond as sim
+
+
+@pytest_asyncio.fixture
+async def simulator():
+    async with sim.BondSimulator(seed=1) as simulator:
+        yield simulator
+
+
+@pytest_asyncio.fixture
+async def client(simulator):
+    client = bond_async.Bond(simulator.address, simulator.token)
+    yield client
+
+
+@pytest_asyncio.fixture
+async def connected_bond(simulator, mocker):
+    mocker.patch('lutronbond.config.BOND_BRIDGE_ADDR', simulator.address)
+    mocker.patch('lutronbond.config.BOND_BRIDGE_API_TOKEN', simulator.token)
+    mocker.patch('backoff.full_jitter', lambda value: 0)
+    bond.get_bond_connection.cache_clear()
+    metrics.reset()
+    yield
+    await bond.close()
+    bond.get_bond_connection.cache_clear()
+    breaker.reset()
+
+
+@pytest.fixture
+def press_event():
+    return lutron.LutronEvent(
+        lutron.Operation.DEVICE,
+        5,
+        lutron.Component.BTN_1,
+        lutron.DeviceAction.PRESS,
+        '',
+        '10.0.0.1'
+    )
+
+
+@pytest.mark.asyncio
+async def test_api(simulator, client):
+    assert (await client.version())['fw_ver'] == 'v3.0.0-sim'
+    assert await client.devices() == list(simulator.devices)
+
+    await client.action('sim0001', bond_async.Action.set_speed(3))
+
+    assert await client.device_state('sim0001') == {
+        'power': 1, 'light': 0, 'speed': 3, 'direction': 1
+    }
+    assert simulator.actions('sim0001')[0].body == {'argument': 3}
+
+
+@pytest.mark.asyncio
+async def test_api__bad_token(simulator):
+    with pytest.raises(aiohttp.ClientResponseError) as e:
+        await bond_async.Bond(simulator.address, 'wrong').version()
+
+    assert e.value.status == 401
+
+
+@pytest.mark.asyncio
+async def test_api__unknown_device(simulator, client):
+    with pytest.raises(aiohttp.ClientResponseError) as e:
+        await client.device_state('nope')
+
+    assert e.value.status == 404
+
+
+@pytest.mark.asyncio
+async def test_fault__error(simulator, client):
+    simulator.faults.error_rate = 1
+
+    with pytest.raises(aiohttp.ClientResponseError) as e:
+        await client.version()
+
+    assert e.value.status == 500
+    assert simulator.requests[-1].status == 500
+
+
+@pytest.mark.asyncio
+async def test_fault__reset(simulator, client):
+    simulator.faults.reset_rate = 1
+
+    with pytest.raises(aiohttp.ServerDisconnectedError):
+        await client.version()
+
+    assert simulator.requests[-1].status is None
+
+
+@pytest.mark.asyncio
+async def test_concurrency():
+    async with sim.BondSimulator(concurrency=1, faults=sim.Faults(sim.constant(0.02))) as s:
+        client = bond_async.Bond(s.address, s.token)
+        await asyncio.gather(*[client.version() for _ in range(3)])
+
+    completed = [r.completed or 0 for r in s.requests]
+    assert [r.sequence for r in s.requests] == [1, 2, 3]
+    # Served one at a time, so each finished after the previous one
+    assert completed == sorted(completed)
+    assert completed[2] - s.requests[0].arrived >= 0.06
+
+
+@pytest.mark.asyncio
+async def test_handler__retries_server_errors(simulator, connected_bond, press_event):
+    simulator.faults.error_rate = 0.5
+    # Fails the first request, then succeeds
+    simulator.random.seed(9)
+    handler = bond.get_handler({
+        'id': 'sim0001',
+        'actions': {'BTN_1': {'PRESS': 'TurnLightOn'}},
+    })
+
+    assert await handler(press_event)
+
+    statuses = [r.status for r in simulator.requests]
+    assert statuses[0] == 500
+    assert statuses[-1] == 200
+    assert simulator.state['sim0001']['light'] == 1
+    assert bond.ACTION_RETRIES.get('sim0001') == len(statuses) - 1
+
+
+@pytest.mark.parametrize('spec, expected', [
+    ('0.05', 0.05),
+    ('uniform:0.01,0.01', 0.01),
+    ('lognormal:0,1', 0.0),
+])
+def test_parse_latency(spec, expected):
+    assert sim.parse_latency(spec)(random.Random(1)) == pytest.approx(expected)
+
+
+def test_parse_latency__unknown():
+    with pytest.raises(ValueError):
+        sim.parse_latency('pareto:1,2')
+
+
+def test_lognormal():
+    rng = random.Random(1)
+    latency = sim.lognormal(0.05, 0.5)
+
+    values = sorted(latency(rng) for _ in range(1001))
+
+    assert values[500] == pytest.approx(0.05, rel=0.2)
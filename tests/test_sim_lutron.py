@@ -0,0 +1,145 @@
+import asyncio
+
+import pytest
+import pytest_asyncio
+
+from lutronbond import lutron
+from lutronbond.sim import lutron as sim
+
+
+@pytest_asyncio.fixture
+async def simulator():
+    async with sim.LutronSimulator(seed=1) as simulator:
+        yield simulator
+
+
+@pytest_asyncio.fixture
+async def connection(simulator):
+    c = lutron.LutronConnection(simulator.host, simulator.port)
+    yield c
+    await c.close()
+
+
+async def collect(connection, count):
+    events = []
+
+    def callback(evt):
+        events.append(evt)
+        if len(events) == count:
+            connection.is_logged_in = False
+
+    await asyncio.wait_for(connection.stream(callback), 2)
+    return events
+
+
+@pytest.mark.asyncio
+async def test_login(simulator, connection):
+    assert await connection.open()
+
+    assert connection.is_logged_in
+    assert simulator.connection_count == 1
+
+
+@pytest.mark.asyncio
+async def test_login__rejected(simulator, connection):
+    simulator.faults.reject_login = True
+
+    await connection.open()
+
+    assert not connection.is_logged_in
+
+
+@pytest.mark.asyncio
+async def test_stream(simulator, connection):
+    simulator.rate = 200
+    simulator.max_chunk = 3
+
+    await connection.open()
+    events = await collect(connection, 4)
+
+    assert [(e.device, e.component, e.action) for e in events] == [
+        (5, lutron.Component.BTN_1, lutron.DeviceAction.PRESS),
+        (5, lutron.Component.BTN_1, lutron.DeviceAction.RELEASE),
+    ] * 2
+    assert len(simulator.sent) >= 4
+
+
+@pytest.mark.asyncio
+async def test_emit(simulator, connection):
+    await connection.open()
+    await asyncio.sleep(0)
+
+    await simulator.emit('~OUTPUT,16,1,75.00')
+    events = await collect(connection, 1)
+
+    assert events[0].operation == lutron.Operation.OUTPUT
+    assert events[0].parameters == '75.00'
+
+
+@pytest.mark.asyncio
+async def test_command(simulator, connection):
+    await connection.open()
+
+    await connection.send(lutron.LutronCommand(
+        lutron.Operation.OUTPUT,
+        16,
+        lutron.Component.ANY,
+        lutron.OutputAction.SET_LEVEL,
+        '50.00',
+        simulator.host
+    ))
+    events = await collect(connection, 1)
+
+    assert simulator.commands[0][1] == b'#OUTPUT,16,1,50.00'
+    assert simulator.output_levels == {16: '50.00'}
+    assert events[0].device == 16
+    assert events[0].parameters == '50.00'
+
+
+def test_respond__query(simulator):
+    simulator.output_levels[16] = '25.00'
+
+    assert simulator.respond(b'?OUTPUT,16,1') == b'~OUTPUT,16,1,25.00'
+    assert simulator.respond(b'?OUTPUT,17,1') == b'~OUTPUT,17,1,0.00'
+    assert simulator.respond(b'#BOGUS') == b'~ERROR,1'
+
+
+@pytest.mark.asyncio
+async def test_fault__disconnect(simulator, connection):
+    simulator.rate = 200
+    simulator.faults.disconnect_after = 2
+
+    await connection.open()
+
+    with pytest.raises(asyncio.IncompleteReadError):
+        await collect(connection, 3)
+
+
+@pytest.mark.asyncio
+async def test_fault__half_open(simulator, connection):
+    simulator.rate = 200
+    simulator.faults.half_open_after = 1
+
+    await connection.open()
+
+    with pytest.raises(asyncio.TimeoutError):
+        await asyncio.wait_for(collect(connection, 2), 0.2)
+
+    assert len(simulator.sent) == 1
+
+
+def test_chunks(simulator):
+    simulator.max_chunk = 4
+
+    chunks = list(simulator.chunks(b'~DEVICE,5,2,3\r\n'))
+
+    assert b''.join(chunks) == b'~DEVICE,5,2,3\r\n'
+    assert all(1 <= len(c) <= 4 for c in chunks)
+
+
+def test_parse_args():
+    args = sim.parse_args(['--rate', '5', '--event', '~DEVICE,1,2,3', '--disconnect-after', '3'])
+
+    assert args.rate == 5
+    assert args.events == ['~DEVICE,1,2,3']
+    assert args.disconnect_after == 3
@@ -0,0 +1,134 @@
+import asyncio
+
+import pytest
+import pytest_asyncio
+import tinytuya  # type: ignore
+
+from lutronbond import breaker, lutron, metrics, tuya
+from lutronbond.sim import tuya as sim
+
+
+@pytest.fixture(autouse=True)
+def reset_tuya(mocker):
+    mocker.patch('lutronbond.config.TUYA_CONNECTION_TIMEOUT', 0.2)
+    mocker.patch('lutronbond.config.TUYA_RETRY_COUNT', 1)
+    tuya.reset_device_cache()
+    metrics.reset()
+    yield
+    tuya.reset_device_cache()
+    breaker.reset()
+
+
+@pytest_asyncio.fixture(params=[3.1, 3.3])
+async def device(request):
+    device = sim.VirtualDevice('simdev', '0123456789abcdef', request.param, port=0)
+    async with sim.TuyaEmulator([device]):
+        yield device
+
+
+@pytest.fixture
+def press_event():
+    return lutron.LutronEvent(
+        lutron.Operation.DEVICE,
+        5,
+        lutron.Component.BTN_1,
+        lutron.DeviceAction.PRESS,
+        '',
+        '10.0.0.1'
+    )
+
+
+def get_handler(device, action):
+    return tuya.get_handler(dict(device.config, actions={'BTN_1': {'PRESS': action}}))
+
+
+@pytest.mark.asyncio
+async def test_handler__turn_on(device, press_event):
+    assert await get_handler(device, 'TurnOn')(press_event)
+
+    assert device.dps == {'1': True}
+    _, cmd, data = device.requests[-1]
+    assert cmd == tinytuya.CONTROL
+    assert data['dps'] == {'1': True}
+
+
+@pytest.mark.asyncio
+async def test_status(device):
+    client = tuya.get_device(device.config)
+    device.dps['1'] = True
+
+    result = await asyncio.to_thread(client.status)
+
+    assert result['dps'] == {'1': True}
+
+
+@pytest.mark.asyncio
+async def test_handler__silent(device, press_event):
+    device.silent = True
+
+    assert not await get_handler(device, 'TurnOn')(press_event)
+
+    assert tuya.ACTION_FAILURES.get('simdev', 'unreachable') == 1
+
+
+@pytest.mark.asyncio
+async def test_handler__stopped(device, press_event):
+    await device.stop()
+
+    assert not await get_handler(device, 'TurnOff')(press_event)
+
+    assert tuya.ACTION_FAILURES.get('simdev', 'unreachable') == 1
+
+
+@pytest.mark.asyncio
+async def test_push(device):
+    client = tuya.get_device(device.config)
+    client.set_socketPersistent(True)
+    await asyncio.to_thread(client.status)
+
+    await device.push({'1': True})
+    result = await asyncio.to_thread(client.receive)
+    client.close()
+
+    assert result['dps'] == {'1': True}
+
+
+@pytest.mark.asyncio
+async def test_wrong_key(device, mocker):
+    warning = mocker.patch.object(sim.logger, 'warning')
+    config = dict(device.config, key='fedcba9876543210')
+
+    result = await asyncio.to_thread(tuya.get_device(config).turn_on)
+
+    assert 'Error' in result
+    assert warning.called
+    assert device.dps == {'1': False}
+
+
+def test_unsupported_version():
+    with pytest.raises(ValueError):
+        sim.VirtualDevice('simdev', '0123456789abcdef', 3.4)
+
+
+def test_devices_from_mapping():
+    devices = sim.devices_from_mapping({
+        1: {'tuya': {'id': 'a', 'addr': '127.0.0.2', 'key': 'k' * 16, 'version': '3.3'}},
+        2: {'tuya': [
+            {'id': 'b', 'addr': '127.0.0.3', 'key': 'k' * 16, 'version': 3.1, 'port': 7000},
+            {'id': 'a', 'addr': '127.0.0.2', 'key': 'k' * 16, 'version': '3.3'},
+        ]},
+        3: {'bond': {'id': 'c'}},
+    })
+
+    assert [(d.id, d.address, d.port, d.version) for d in devices] == [
+        ('a', '127.0.0.2', tinytuya.TCPPORT, 3.3),
+        ('b', '127.0.0.3', 7000, 3.1),
+    ]
+
+
+def test_make_devices():
+    devices = sim.make_devices(300)
+
+    assert devices[0].address == '127.0.0.2'
+    assert devices[299].address == '127.0.1.45'
+    assert len({d.id for d in devices}) == 300
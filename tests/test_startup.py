@@ -0,0 +1,65 @@
+import asyncio
+import time
+
+import pytest
+
+from lutronbond import startup
+
+
+@pytest.fixture(autouse=True)
+def reset_startup():
+    startup.reset()
+    yield
+    startup.reset()
+
+
+def test_phase(mocker):
+    mocker.patch('time.perf_counter', side_effect=[10.0, 10.25])
+
+    with startup.phase('import bond'):
+        pass
+
+    name, elapsed, rss = startup.phases[0]
+    assert (name, elapsed) == ('import bond', 0.25)
+    assert rss >= 0
+    assert startup.STARTUP_SECONDS.get('import bond') == 0.25
+
+
+def test_phase__error():
+    with pytest.raises(RuntimeError):
+        with startup.phase('verify bond'):
+            raise RuntimeError()
+
+    assert [name for name, _, _ in startup.phases] == ['verify bond']
+
+
+def test_report(mocker):
+    info = mocker.patch.object(startup.logger, 'info')
+    startup.phases.extend([('import', 0.1, 5.0), ('import tuya', 0.05, 2.5)])
+    startup.started = 10.0
+    mocker.patch('time.perf_counter', return_value=10.15)
+
+    startup.report()
+
+    message, total, _, breakdown = info.call_args.args
+    assert message.startswith('Started in')
+    assert total == pytest.approx(150)
+    assert breakdown == 'import 100 ms (+5.0 MB), import tuya 50 ms (+2.5 MB)'
+
+
+@pytest.mark.asyncio
+async def test_timed__overlapping():
+    async def sleep(seconds):
+        await asyncio.sleep(seconds)
+        return seconds
+
+    results = await asyncio.gather(
+        startup.timed('verify bond', sleep(0.05)),
+        startup.timed('open lutron', sleep(0.05)),
+    )
+
+    assert results == [0.05, 0.05]
+    assert sorted(name for name, _, _ in startup.phases) == ['open lutron', 'verify bond']
+    # Run side by side, so the total is less than the sum of the phases
+    assert startup.started is not None
+    assert time.perf_counter() - startup.started < 0.1
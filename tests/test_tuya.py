@@ -1,6 +1,19 @@
+import asyncio
+import json
+
 import pytest
+import tinytuya  # type: ignore
+
+from lutronbond import breaker, tuya, lutron
 
-from lutronbond import tuya, lutron
+
+@pytest.fixture(autouse=True)
+def reset_tuya_caches():
+    tuya.reset_device_cache()
+    tuya.device_addresses.clear()
+    tuya.address_cache_loaded = False
+    yield
+    breaker.reset()
 
 
 @pytest.fixture()
@@ -329,3 +342,399 @@ async def test_handler__turn_off__OUTPUT(
         'Unnamed'
     )
     assert result is True
+
+
+def test_get_device__cached(mock_device):
+    configmap = {
+        'id': 'asdf',
+        'addr': '10.0.0.2',
+        'key': 'ghjk',
+        'version': 3.3,
+    }
+
+    result1 = tuya.get_device(configmap)
+    result2 = tuya.get_device(dict(configmap, actions={}))
+
+    assert result1 is result2
+
+
+def test_get_device__settings_changed(mocker):
+    outlet_device = mocker.patch('tinytuya.OutletDevice')
+    outlet_device.side_effect = lambda **kwargs: mocker.Mock()
+    configmap = {
+        'id': 'asdf',
+        'addr': '10.0.0.2',
+        'key': 'ghjk',
+        'version': 3.3,
+    }
+
+    result1 = tuya.get_device(configmap)
+    tuya.get_device_breaker('asdf', result1)
+    result2 = tuya.get_device(dict(configmap, addr='10.0.0.3'))
+
+    assert result1 is not result2
+    assert result2 is tuya.get_device(dict(configmap, addr='10.0.0.3'))
+    assert 'tuya:asdf' not in breaker.breakers
+
+
+@pytest.mark.asyncio
+async def test_close(mock_device):
+    tuya.get_device({'id': 'asdf', 'addr': '10.0.0.2', 'key': 'key', 'version': 3.3})
+
+    await tuya.close()
+
+    assert mock_device.close.called
+    assert not tuya.devices
+
+
+def test_forget_device(mock_device):
+    tuya.get_device({
+        'id': 'asdf',
+        'addr': '10.0.0.2',
+        'key': 'ghjk',
+        'version': 3.3,
+    })
+
+    tuya.forget_device('asdf')
+    tuya.forget_device('missing')
+
+    assert tuya.devices == {}
+    assert tuya.device_settings == {}
+
+
+def test_checkpoint(mocker):
+    mocker.patch('tinytuya.OutletDevice', side_effect=lambda **kwargs: mocker.Mock())
+    kept = tuya.get_device({'id': 'asdf', 'addr': '10.0.0.2', 'key': 'ghjk', 'version': 3.3})
+    replaced = tuya.get_device({'id': 'qwer', 'addr': '10.0.0.3', 'key': 'tyui', 'version': 3.3})
+    tuya.get_device_breaker('qwer', replaced)
+    rollback = tuya.checkpoint()
+
+    tuya.get_device({'id': 'qwer', 'addr': '10.0.0.4', 'key': 'tyui', 'version': 3.3})
+    added = tuya.get_device({'id': 'zxcv', 'addr': '10.0.0.5', 'key': 'bnm', 'version': 3.3})
+    tuya.get_device_breaker('zxcv', added)
+    rollback()
+
+    assert tuya.devices == {'asdf': kept, 'qwer': replaced}
+    assert tuya.device_settings['qwer'] == ('10.0.0.3', 'tyui', 3.3, None)
+    assert 'tuya:zxcv' not in breaker.breakers
+
+
+def test_get_device__discovered_address(mocker):
+    outlet_device = mocker.patch('tinytuya.OutletDevice')
+    tuya.device_addresses['asdf'] = '10.0.0.99'
+
+    tuya.get_device({
+        'id': 'asdf',
+        'addr': '10.0.0.2',
+        'key': 'ghjk',
+        'version': 3.3,
+    })
+
+    outlet_device.assert_called_with(
+        dev_id='asdf',
+        address='10.0.0.99',
+        local_key='ghjk',
+        version=3.3
+    )
+
+
+def make_broadcast(payload, encrypt):
+    data = json.dumps(payload).encode()
+    if encrypt:
+        data = tinytuya.encrypt(data.decode(), tinytuya.udpkey)
+
+    return tinytuya.pack_message(
+        tinytuya.TuyaMessage(0, tinytuya.UDP_NEW, 0, b'\x00\x00\x00\x00' + data, 0, True)
+    )
+
+
+@pytest.mark.parametrize('encrypt', [False, True])
+def test_parse_broadcast(encrypt):
+    data = make_broadcast({'gwId': 'asdf', 'ip': '10.0.0.5', 'version': '3.3'}, encrypt)
+
+    result = tuya.parse_broadcast(data)
+
+    assert result['gwId'] == 'asdf'
+    assert result['ip'] == '10.0.0.5'
+
+
+def test_parse_broadcast__invalid():
+    with pytest.raises(ValueError):
+        tuya.parse_broadcast(b'o hai')
+
+
+def test_parse_broadcast__incomplete():
+    data = make_broadcast({'gwId': 'asdf'}, False)
+
+    with pytest.raises(ValueError):
+        tuya.parse_broadcast(data)
+
+
+def test_update_address__retargets_device(mocker, tmp_path, mock_device, logger):
+    mocker.patch('lutronbond.config.TUYA_ADDRESS_CACHE', str(tmp_path / 'cache.json'))
+    mock_device.address = '10.0.0.2'
+    tuya.get_device({
+        'id': 'asdf',
+        'addr': '10.0.0.2',
+        'key': 'ghjk',
+        'version': 3.3,
+    })
+
+    assert tuya.update_address('asdf', '10.0.0.3') is True
+
+    assert mock_device.address == '10.0.0.3'
+    logger.info.assert_called_with(
+        'Tuya device %s moved from %s to %s',
+        'asdf',
+        '10.0.0.2',
+        '10.0.0.3'
+    )
+    with open(tmp_path / 'cache.json') as f:
+        assert json.load(f) == {'asdf': '10.0.0.3'}
+
+
+def test_update_address__unchanged(mocker, tmp_path):
+    mocker.patch('lutronbond.config.TUYA_ADDRESS_CACHE', str(tmp_path / 'cache.json'))
+    tuya.device_addresses['asdf'] = '10.0.0.3'
+
+    assert tuya.update_address('asdf', '10.0.0.3') is False
+    assert not (tmp_path / 'cache.json').exists()
+
+
+def test_update_address__cached_but_device_stale(mocker, tmp_path, mock_device, logger):
+    mocker.patch('lutronbond.config.TUYA_ADDRESS_CACHE', str(tmp_path / 'cache.json'))
+    mock_device.address = '192.168.1.22'
+    tuya.get_device({
+        'id': 'asdf',
+        'addr': '192.168.1.22',
+        'key': 'ghjk',
+        'version': 3.3,
+    })
+    tuya.device_addresses['asdf'] = '10.0.0.99'
+
+    assert tuya.update_address('asdf', '10.0.0.99') is False
+
+    assert mock_device.address == '10.0.0.99'
+
+
+def test_get_device__restart_with_stale_addr(mocker, tmp_path, logger):
+    # Handlers are built before discovery starts
+    path = tmp_path / 'cache.json'
+    path.write_text(json.dumps({'asdf': '10.0.0.99'}))
+    mocker.patch('lutronbond.config.TUYA_ADDRESS_CACHE', str(path))
+    mocker.patch('lutronbond.config.TUYA_DISCOVERY', True)
+    outlet_device = mocker.patch('tinytuya.OutletDevice')
+    outlet_device.side_effect = lambda **kwargs: mocker.Mock(address=kwargs['address'])
+
+    device = tuya.get_device({
+        'id': 'asdf',
+        'addr': '192.168.1.22',
+        'key': 'ghjk',
+        'version': 3.3,
+    })
+    # As discovery does when it starts
+    tuya.load_address_cache()
+
+    assert device.address == '10.0.0.99'
+
+    data = make_broadcast({'gwId': 'asdf', 'ip': '10.0.0.98', 'version': '3.3'}, True)
+    tuya.DiscoveryProtocol().datagram_received(data, ('10.0.0.98', 6667))
+
+    assert device.address == '10.0.0.98'
+
+
+def test_load_address_cache(mocker, tmp_path):
+    path = tmp_path / 'cache.json'
+    path.write_text(json.dumps({'asdf': '10.0.0.4'}))
+    mocker.patch('lutronbond.config.TUYA_ADDRESS_CACHE', str(path))
+
+    tuya.load_address_cache()
+
+    assert tuya.device_addresses == {'asdf': '10.0.0.4'}
+
+
+def test_load_address_cache__missing(mocker, tmp_path):
+    mocker.patch('lutronbond.config.TUYA_ADDRESS_CACHE', str(tmp_path / 'cache.json'))
+
+    tuya.load_address_cache()
+
+    assert tuya.device_addresses == {}
+
+
+def test_discovery_protocol(mocker, tmp_path):
+    mocker.patch('lutronbond.config.TUYA_ADDRESS_CACHE', str(tmp_path / 'cache.json'))
+    data = make_broadcast({'gwId': 'asdf', 'ip': '10.0.0.5', 'version': '3.3'}, True)
+
+    tuya.DiscoveryProtocol().datagram_received(data, ('10.0.0.5', 6667))
+
+    assert tuya.device_addresses == {'asdf': '10.0.0.5'}
+
+
+def test_discover_disabled(mocker):
+    mocker.patch('lutronbond.config.TUYA_DISCOVERY', False)
+    listen = mocker.patch('lutronbond.tuya.listen')
+
+    cancel = tuya.discover()
+
+    assert cancel() is True
+    assert not listen.called
+
+
+@pytest.mark.asyncio
+async def test_discover(mocker, amock, tmp_path):
+    mocker.patch('lutronbond.config.TUYA_DISCOVERY', True)
+    mocker.patch('lutronbond.config.TUYA_ADDRESS_CACHE', str(tmp_path / 'cache.json'))
+    loop = asyncio.get_running_loop()
+    endpoint = mocker.patch.object(
+        loop,
+        'create_datagram_endpoint',
+        amock(return_value=(mocker.Mock(), None))
+    )
+
+    cancel = tuya.discover()
+    await asyncio.sleep(0.01)
+    cancel()
+    await asyncio.sleep(0.01)
+
+    assert endpoint.call_count == len(tuya.DISCOVERY_PORTS)
+
+
+@pytest.mark.asyncio
+async def test_listen__port_in_use(mocker, amock, logger):
+    loop = asyncio.get_running_loop()
+    transport = mocker.Mock()
+    mocker.patch.object(
+        loop,
+        'create_datagram_endpoint',
+        amock(side_effect=[OSError(98, 'Address already in use'), (transport, None)])
+    )
+
+    listening = asyncio.ensure_future(tuya.listen())
+    await asyncio.sleep(0.01)
+
+    logger.error.assert_called_with(
+        'Unable to listen for Tuya broadcasts on port %s: %s',
+        tuya.DISCOVERY_PORTS[0],
+        mocker.ANY
+    )
+    logger.info.assert_called_with(
+        'Listening for Tuya broadcasts on ports %s', [tuya.DISCOVERY_PORTS[1]]
+    )
+
+    listening.cancel()
+    await asyncio.gather(listening, return_exceptions=True)
+    assert transport.close.called
+
+
+@pytest.mark.asyncio
+async def test_listen__no_ports(mocker, amock, logger):
+    loop = asyncio.get_running_loop()
+    mocker.patch.object(
+        loop,
+        'create_datagram_endpoint',
+        amock(side_effect=PermissionError(13, 'Permission denied'))
+    )
+
+    await asyncio.wait_for(tuya.listen(), 1)
+
+    assert logger.error.call_count == len(tuya.DISCOVERY_PORTS)
+    assert logger.warning.called
+
+
+@pytest.mark.asyncio
+async def test_handler__circuit_open(
+        mocker,
+        lutron_event,
+        logger,
+        mock_device):
+    mocker.patch('lutronbond.config.BREAKER_FAILURE_THRESHOLD', 2)
+    mock_device.turn_on.return_value = {
+        'Error': 'Network Error: Device Unreachable',
+        'Err': '905',
+        'Payload': None
+    }
+    handler = tuya.get_handler({
+        'id': 'asdf',
+        'addr': '10.0.0.2',
+        'key': 'ghjk',
+        'version': 3.3,
+        'actions': {
+            'UNKNOWN': {
+                'UNKNOWN': 'TurnOn'
+            }
+        }
+    })
+
+    assert await handler(lutron_event) is False
+    assert await handler(lutron_event) is False
+    assert await handler(lutron_event) is False
+
+    assert mock_device.turn_on.call_count == 2
+    assert breaker.CIRCUIT_OPEN.get('tuya:asdf') == 1
+    logger.warning.assert_called_with(
+        'Tuya device %s (%s) is unreachable. Skipping %s request',
+        'asdf',
+        'Unnamed',
+        'TurnOn'
+    )
+
+
+@pytest.mark.asyncio
+async def test_handler__payload_error_does_not_open_circuit(
+        mocker,
+        lutron_event,
+        logger,
+        mock_device):
+    mocker.patch('lutronbond.config.BREAKER_FAILURE_THRESHOLD', 1)
+    mock_device.turn_on.return_value = {
+        'Error': 'Unexpected Payload from Device',
+        'Err': '904',
+        'Payload': None
+    }
+    handler = tuya.get_handler({
+        'id': 'asdf',
+        'addr': '10.0.0.2',
+        'key': 'ghjk',
+        'version': 3.3,
+        'actions': {
+            'UNKNOWN': {
+                'UNKNOWN': 'TurnOn'
+            }
+        }
+    })
+
+    assert await handler(lutron_event) is False
+
+    assert breaker.CIRCUIT_OPEN.get('tuya:asdf') == 0
+
+
+@pytest.mark.asyncio
+async def test_probe_device(mocker, amock):
+    writer = mocker.Mock(wait_closed=amock())
+    open_connection = mocker.patch(
+        'asyncio.open_connection',
+        amock(return_value=(mocker.Mock(), writer))
+    )
+    device = mocker.Mock(address='10.0.0.2', port=6668)
+
+    await tuya.probe_device(device)
+
+    open_connection.assert_called_with('10.0.0.2', 6668)
+    assert writer.close.called
+
+
+@pytest.mark.asyncio
+async def test_warm_up(mocker, amock):
+    warning = mocker.patch.object(tuya.logger, 'warning')
+    probe_device = mocker.patch(
+        'lutronbond.tuya.probe_device',
+        amock(side_effect=[None, ConnectionRefusedError()])
+    )
+    tuya.devices['a'] = mocker.Mock(address='10.0.0.2')
+    tuya.devices['b'] = mocker.Mock(address='10.0.0.3')
+
+    await tuya.warm_up()
+
+    assert probe_device.call_count == 2
+    warning.assert_called_once()
+    assert warning.call_args.args[1:3] == ('b', '10.0.0.3')